@@ -0,0 +1,166 @@
+import glob
+import os
+import os.path as op
+import tempfile
+from fsub_extractor.utils.froi_utils import intersect_gmwmi
+from fsub_extractor.utils.streamline_utils import extract_tck_mrtrix, merge_tck_files
+from fsub_extractor.utils.system_utils import find_program
+from .bench_orchestration import run_extractor
+from .synthetic import STREAMLINE_COUNTS, synthetic_roi_pair, synthetic_tck
+
+
+def _require(*programs):
+    """Skips a benchmark (asv convention) if MRtrix tools are not installed"""
+    for program in programs:
+        try:
+            find_program(program)
+        except Exception:
+            raise NotImplementedError(f"{program} is not installed.")
+
+
+class RoiAssignment:
+    """Assigning streamlines to two ROIs and extracting the connecting sub-bundle"""
+
+    params = STREAMLINE_COUNTS
+    param_names = ["n_streamlines"]
+    timeout = 3600
+
+    def setup(self, n_streamlines):
+        _require("tck2connectome")
+        self.tck_file = synthetic_tck(n_streamlines)
+        self.rois, _ = synthetic_roi_pair()
+        self.out_dir = tempfile.mkdtemp()
+
+    def time_extract_two_rois(self, n_streamlines):
+        extract_tck_mrtrix(
+            self.tck_file,
+            self.rois,
+            op.join(self.out_dir, "bench"),
+            two_rois=True,
+            search_dist="2.0",
+            search_type="radial",
+        )
+
+
+class Merging:
+    """Concatenating .tck files"""
+
+    params = STREAMLINE_COUNTS
+    param_names = ["n_streamlines"]
+    timeout = 3600
+
+    def setup(self, n_streamlines):
+        _require("tckedit")
+        self.tck_files = [
+            synthetic_tck(n_streamlines // 2, seed=0),
+            synthetic_tck(n_streamlines // 2, seed=1),
+        ]
+        self.out_dir = tempfile.mkdtemp()
+
+    def time_merge_two_halves(self, n_streamlines):
+        merge_tck_files(self.tck_files, op.join(self.out_dir, "merged.tck"))
+
+
+class Intersection:
+    """Intersecting an ROI with the GM/WM interface"""
+
+    timeout = 600
+
+    def setup(self):
+        _require("mrgrid", "mrcalc")
+        self.rois, self.gmwmi = synthetic_roi_pair()
+        self.out_dir = tempfile.mkdtemp()
+
+    def time_intersect_gmwmi(self):
+        intersect_gmwmi(self.rois, "bench", self.gmwmi, op.join(self.out_dir, "bench"))
+
+
+# Seeding efficiency needs real data: tckgen acceptance depends on the subject's anatomy and FODs
+GENERATION_INPUTS = {
+    "fs_dir": os.getenv("FSUB_BENCH_FS_DIR"),
+    "subject": os.getenv("FSUB_BENCH_SUBJECT"),
+    "wmfod": os.getenv("FSUB_BENCH_WMFOD"),
+    "roi1": os.getenv("FSUB_BENCH_ROI1"),
+    "roi2": os.getenv("FSUB_BENCH_ROI2"),
+    "hemi": os.getenv("FSUB_BENCH_HEMI", "lh,rh"),
+    "fs2dwi": os.getenv("FSUB_BENCH_FS2DWI"),
+    "n_streamlines": os.getenv("FSUB_BENCH_GENERATE_STREAMLINES", "2000"),
+}
+
+
+class GenerationSeeding:
+    """Seeding efficiency of --generate with and without the pial exclusion mask, on a real subject
+    (skipped unless FSUB_BENCH_FS_DIR, FSUB_BENCH_SUBJECT, FSUB_BENCH_WMFOD, FSUB_BENCH_ROI1 and
+    FSUB_BENCH_ROI2 are set, and MRtrix is installed)"""
+
+    params = [False, True]
+    param_names = ["pial_exclusion"]
+    timeout = 7200
+    number = 1
+    repeat = 3
+
+    def setup_cache(self):
+        # Build the 5TT image, projected ROIs and pial mask once, so runs only differ in tckgen
+        out_dir = tempfile.mkdtemp()
+        if self._inputs_missing() == False:
+            run_extractor(*self._args(out_dir, True))
+        return out_dir
+
+    def setup(self, out_dir, pial_exclusion):
+        if self._inputs_missing():
+            raise NotImplementedError("Set FSUB_BENCH_* to a subject to benchmark generation.")
+        _require("tckgen", "tckedit", "5ttgen")
+
+    def _inputs_missing(self):
+        required = ["fs_dir", "subject", "wmfod", "roi1", "roi2"]
+        return any(GENERATION_INPUTS[name] == None for name in required)
+
+    def _args(self, out_dir, pial_exclusion):
+        args = [
+            "--subject", GENERATION_INPUTS["subject"],
+            "--fs-dir", GENERATION_INPUTS["fs_dir"],
+            "--roi1", GENERATION_INPUTS["roi1"],
+            "--roi2", GENERATION_INPUTS["roi2"],
+            "--hemi", GENERATION_INPUTS["hemi"],
+            "--out-dir", out_dir,
+            "--generate",
+            "--wmfod", GENERATION_INPUTS["wmfod"],
+            "--n-streamlines", GENERATION_INPUTS["n_streamlines"],
+            "--overwrite",
+        ]
+        if GENERATION_INPUTS["fs2dwi"] != None:
+            args += ["--fs2dwi", GENERATION_INPUTS["fs2dwi"]]
+        if pial_exclusion:
+            args += ["--pial-exclusion"]
+        return args
+
+    def _generate(self, out_dir, pial_exclusion):
+        """Runs generation and sums the totals of its _tckgen-stats.tsv files"""
+        run_extractor(*self._args(out_dir, pial_exclusion))
+        selected, generated, seconds = 0, 0, 0.0
+        for stats_file in glob.glob(op.join(out_dir, "*", "dwi", "*_tckgen-stats.tsv")):
+            with open(stats_file) as f:
+                header = f.readline().rstrip("\n").split("\t")
+                for line in f:
+                    row = dict(zip(header, line.rstrip("\n").split("\t")))
+                    if row["shard"] == "total":
+                        selected += int(row["selected"])
+                        generated += int(row["generated"])
+                        # Both seeding directions run at the same time
+                        seconds = max(seconds, float(row["seconds"]))
+        return selected, generated, seconds
+
+    def time_generate(self, out_dir, pial_exclusion):
+        run_extractor(*self._args(out_dir, pial_exclusion))
+
+    def track_acceptance_rate(self, out_dir, pial_exclusion):
+        selected, generated, _ = self._generate(out_dir, pial_exclusion)
+        return selected / max(generated, 1)
+
+    track_acceptance_rate.unit = "selected / generated"
+
+    def track_selected_per_second(self, out_dir, pial_exclusion):
+        selected, _, seconds = self._generate(out_dir, pial_exclusion)
+        return selected / max(seconds, 1e-3)
+
+    track_selected_per_second.unit = "streamlines / second"
@@ -0,0 +1,106 @@
+import os
+import os.path as op
+import shutil
+import sys
+import tempfile
+import time
+from contextlib import redirect_stdout
+from io import StringIO
+from fsub_extractor.cli_starters import extractor_start
+from .fake_toolchain import fake_toolchain, install_fake_toolchain, max_concurrency, read_call_log
+from .synthetic import synthetic_fs_subject, synthetic_scalar, synthetic_tck
+
+# Seconds each stand-in program takes in the timed benchmarks, roughly what the real tools
+# take on a small subject relative to each other
+TOOL_DELAYS = {"5ttgen": 0.5, "tckgen": 1.0, "tck2connectome": 0.2}
+
+
+def run_extractor(*args):
+    """Runs the extractor command line (quietly) with the given arguments"""
+    argv = sys.argv
+    sys.argv = ["extractor"] + [str(arg) for arg in args]
+    try:
+        with redirect_stdout(StringIO()):
+            extractor_start.main()
+    finally:
+        sys.argv = argv
+
+
+class Orchestration:
+    """The full extractor pipeline against stand-in MRtrix / FreeSurfer programs (see fake_tools.py),
+    which measures the pipeline's own scheduling and bookkeeping rather than the tools"""
+
+    timeout = 600
+
+    def setup(self):
+        self.fs_dir, self.subject, self.label_file = synthetic_fs_subject(n_subdivisions=5)
+        self.tck_file = synthetic_tck(10000)
+        # The tckgen stand-in only needs an image to exist for the FOD input
+        self.wmfod = synthetic_scalar()
+        self.bin_dir = install_fake_toolchain()
+        self.work_dir = tempfile.mkdtemp()
+        self.log_file = op.join(self.work_dir, "calls.tsv")
+
+    def teardown(self):
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+        shutil.rmtree(self.bin_dir, ignore_errors=True)
+
+    def _fresh_log(self):
+        if op.exists(self.log_file):
+            os.remove(self.log_file)
+        return self.log_file
+
+    def _args(self, *args):
+        out_dir = tempfile.mkdtemp(dir=self.work_dir)
+        return [
+            "--subject", self.subject,
+            "--fs-dir", self.fs_dir,
+            "--roi1", self.label_file,
+            "--out-dir", out_dir,
+        ] + list(args)
+
+    def _two_roi_args(self, *args):
+        return self._args(
+            "--roi2", self.label_file.replace("lh.", "rh."), "--hemi", "lh,rh", *args
+        )
+
+    def time_extract_one_roi(self):
+        with fake_toolchain(self.fs_dir, delays=TOOL_DELAYS, bin_dir=self.bin_dir):
+            run_extractor(*self._args("--tract", self.tck_file, "--hemi", "lh"))
+
+    def time_extract_two_rois(self):
+        with fake_toolchain(self.fs_dir, delays=TOOL_DELAYS, bin_dir=self.bin_dir):
+            run_extractor(*self._two_roi_args("--tract", self.tck_file))
+
+    def time_generate_two_rois_sharded(self):
+        with fake_toolchain(self.fs_dir, delays=TOOL_DELAYS, bin_dir=self.bin_dir):
+            run_extractor(
+                *self._two_roi_args(
+                    "--generate", "--wmfod", self.wmfod, "--n-streamlines", 200, "--n-shards", 2
+                )
+            )
+
+    def track_tool_concurrency_generate(self):
+        with fake_toolchain(
+            self.fs_dir, delays=TOOL_DELAYS, log_file=self._fresh_log(), bin_dir=self.bin_dir
+        ):
+            run_extractor(
+                *self._two_roi_args(
+                    "--generate", "--wmfod", self.wmfod, "--n-streamlines", 200, "--n-shards", 2
+                )
+            )
+        return max_concurrency(read_call_log(self.log_file))
+
+    track_tool_concurrency_generate.unit = "programs"
+
+    def track_orchestration_overhead_seconds(self):
+        # With instant tools, whatever is left of the wall time is the pipeline's own work
+        # (Python-side projection, file handling, planning) plus process start-up
+        with fake_toolchain(self.fs_dir, log_file=self._fresh_log(), bin_dir=self.bin_dir):
+            start = time.perf_counter()
+            run_extractor(*self._two_roi_args("--tract", self.tck_file))
+            wall = time.perf_counter() - start
+        calls = read_call_log(self.log_file)
+        return wall - sum(end - begin for _, begin, end in calls)
+
+    track_orchestration_overhead_seconds.unit = "seconds"
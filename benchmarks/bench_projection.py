@@ -0,0 +1,70 @@
+import os.path as op
+import tempfile
+from fsub_extractor.utils import surface_utils
+from fsub_extractor.utils.anat_utils import get_pial_surf
+from fsub_extractor.utils.surface_utils import (
+    load_surface_geometry,
+    surf2vol_native,
+    surf2vol_native_batch,
+    surface_mask_native,
+)
+from .synthetic import synthetic_fs_subject
+
+
+class SurfaceProjection:
+    """Projecting surface ROIs into white matter on fsaverage-sized (163842 vertex) surfaces"""
+
+    timeout = 600
+
+    def setup(self):
+        self.fs_dir, self.subject, self.label = synthetic_fs_subject()
+        self.out_dir = tempfile.mkdtemp()
+        # Warm the on-disk geometry cache
+        load_surface_geometry(self.fs_dir, self.subject, "lh", cache_dir=self.out_dir)
+        # Build the per-subject pial mask that later runs reuse
+        get_pial_surf(self.subject, self.fs_dir, anat_out_dir=self.out_dir)
+
+    def time_read_geometry_uncached(self):
+        surface_utils._GEOMETRY_CACHE.clear()
+        load_surface_geometry(self.fs_dir, self.subject, "lh")
+
+    def time_read_geometry_disk_cache(self):
+        surface_utils._GEOMETRY_CACHE.clear()
+        load_surface_geometry(self.fs_dir, self.subject, "lh", cache_dir=self.out_dir)
+
+    def time_project_label(self):
+        surf2vol_native(
+            self.label,
+            self.fs_dir,
+            self.subject,
+            "lh",
+            op.join(self.out_dir, "roi.nii.gz"),
+            [-1, 0, 0.05],
+            cache_dir=self.out_dir,
+        )
+
+    def peakmem_project_label(self):
+        self.time_project_label()
+
+    def time_project_10_labels_batch(self):
+        surf2vol_native_batch(
+            [self.label] * 10,
+            ["lh"] * 10,
+            self.fs_dir,
+            self.subject,
+            op.join(self.out_dir, "rois.nii.gz"),
+            [-1, 0, 0.05],
+            stack=True,
+            cache_dir=self.out_dir,
+        )
+
+    def time_pial_mask(self):
+        surface_mask_native(
+            self.fs_dir,
+            self.subject,
+            op.join(self.out_dir, "pial.nii.gz"),
+            cache_dir=self.out_dir,
+        )
+
+    def time_pial_mask_cached(self):
+        get_pial_surf(self.subject, self.fs_dir, anat_out_dir=self.out_dir)
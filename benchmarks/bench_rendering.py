@@ -0,0 +1,48 @@
+import os.path as op
+import tempfile
+from .synthetic import STREAMLINE_COUNTS, synthetic_roi_pair, synthetic_scalar, synthetic_tck
+
+
+class Rendering:
+    """Building QC actors and rendering views offscreen. Skipped where no OpenGL context can be made."""
+
+    params = STREAMLINE_COUNTS
+    param_names = ["n_streamlines"]
+    timeout = 1800
+
+    def setup(self, n_streamlines):
+        try:
+            from fsub_extractor.utils import fury_viz
+
+            self.renderer = fury_viz.BatchRenderer(size=(600, 450))
+        except Exception:
+            raise NotImplementedError("Offscreen rendering is not available.")
+        self.fury_viz = fury_viz
+        self.orig_bundle = synthetic_tck(n_streamlines)
+        self.fsub_bundle = synthetic_tck(10000, seed=1)
+        self.rois, _ = synthetic_roi_pair()
+        self.ref_anat = synthetic_scalar()
+        self.out_dir = tempfile.mkdtemp()
+
+    def build_actors(self):
+        self.fury_viz._ROI_MESH_CACHE.clear()
+        return self.fury_viz.build_sub_bundle_actors(
+            self.fsub_bundle,
+            self.ref_anat,
+            self.rois,
+            orig_bundle=self.orig_bundle,
+            show_anat=True,
+        )
+
+    def time_build_actors(self, n_streamlines):
+        self.build_actors()
+
+    def peakmem_build_actors(self, n_streamlines):
+        self.build_actors()
+
+    def time_render_three_views(self, n_streamlines):
+        out_files = {
+            view: op.join(self.out_dir, f"view-{view}.png")
+            for view in ["lh", "rh", "axial"]
+        }
+        self.renderer.render(self.build_actors(), out_files)
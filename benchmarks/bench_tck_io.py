@@ -0,0 +1,204 @@
+import os
+import os.path as op
+import shutil
+import tempfile
+import numpy as np
+from fsub_extractor.utils.streamline_utils import (
+    assign_endpoints,
+    build_parcel_index,
+    connectome_edges,
+    decimate_streamlines,
+    endpoint_voxel_map,
+    extract_parcel_bundle,
+    load_sift2_weights,
+    mask_streamlines,
+    read_tck_header,
+    read_tck_streamlines,
+    subsample_streamline_indices,
+    tck_streamline_lengths,
+    tck_streamline_offsets,
+)
+from .synthetic import (
+    STREAMLINE_COUNTS,
+    synthetic_atlas,
+    synthetic_roi_pair,
+    synthetic_scalar,
+    synthetic_sift2_weights,
+    synthetic_tck,
+)
+
+
+class TckIO:
+    """Reading .tck files: header, streamline offsets, subsets, and rendering decimation"""
+
+    params = STREAMLINE_COUNTS
+    param_names = ["n_streamlines"]
+    timeout = 1800
+
+    def setup(self, n_streamlines):
+        self.tck_file = synthetic_tck(n_streamlines)
+        self.subset = subsample_streamline_indices(n_streamlines, n_streamlines // 100)
+
+    def time_read_header(self, n_streamlines):
+        read_tck_header(self.tck_file)
+
+    def time_streamline_offsets(self, n_streamlines):
+        tck_streamline_offsets(self.tck_file)
+
+    def peakmem_streamline_offsets(self, n_streamlines):
+        tck_streamline_offsets(self.tck_file)
+
+    def time_streamline_lengths(self, n_streamlines):
+        tck_streamline_lengths(self.tck_file)
+
+    def time_read_1pct_subset(self, n_streamlines):
+        read_tck_streamlines(self.tck_file, self.subset)
+
+    def time_decimate_for_rendering(self, n_streamlines):
+        decimate_streamlines(self.tck_file)
+
+    def peakmem_decimate_for_rendering(self, n_streamlines):
+        decimate_streamlines(self.tck_file)
+
+    def track_file_size_mb(self, n_streamlines):
+        return op.getsize(self.tck_file) / 1024**2
+
+    track_file_size_mb.unit = "MB"
+
+
+class TckLoadDipy:
+    """Full DIPY parse of a .tck file, the baseline the memory-mapped reader replaces"""
+
+    params = STREAMLINE_COUNTS
+    param_names = ["n_streamlines"]
+    timeout = 1800
+
+    def setup(self, n_streamlines):
+        self.tck_file = synthetic_tck(n_streamlines)
+        self.reference = synthetic_scalar()
+
+    def time_load_tck(self, n_streamlines):
+        from dipy.io.streamline import load_tck
+
+        load_tck(self.tck_file, self.reference, bbox_valid_check=False)
+
+    def peakmem_load_tck(self, n_streamlines):
+        from dipy.io.streamline import load_tck
+
+        load_tck(self.tck_file, self.reference, bbox_valid_check=False)
+
+
+class Sift2Weights:
+    """Loading whole-tractogram SIFT2 weights from text, and from the binary cache"""
+
+    params = STREAMLINE_COUNTS
+    param_names = ["n_streamlines"]
+    timeout = 1800
+
+    def setup(self, n_streamlines):
+        self.weights_file = synthetic_sift2_weights(n_streamlines)
+        self.cache_file = op.splitext(self.weights_file)[0] + ".npy"
+        load_sift2_weights(self.weights_file)
+
+    def time_parse_text(self, n_streamlines):
+        os.remove(self.cache_file)
+        load_sift2_weights(self.weights_file)
+
+    def time_load_cached(self, n_streamlines):
+        load_sift2_weights(self.weights_file)
+
+
+class ConnectomeEdges:
+    """Summarizing node assignments into a full atlas connectome (counts, SIFT2 weights, mean lengths)"""
+
+    params = (STREAMLINE_COUNTS, [100, 1000])
+    param_names = ["n_streamlines", "n_nodes"]
+    timeout = 1800
+
+    def setup(self, n_streamlines, n_nodes):
+        rng = np.random.default_rng(0)
+        # About a third of streamline ends are unassigned, as with a cortical atlas
+        self.assignments = rng.integers(0, n_nodes + 1, size=(n_streamlines, 2))
+        self.assignments[rng.random(self.assignments.shape) < 0.3] = 0
+        self.weights = load_sift2_weights(synthetic_sift2_weights(n_streamlines))
+        self.lengths = rng.uniform(20, 200, size=n_streamlines)
+
+    def time_connectome_edges(self, n_streamlines, n_nodes):
+        connectome_edges(self.assignments, weights=self.weights, lengths=self.lengths)
+
+
+class EndpointVoxels:
+    """Assigning streamline endpoints to atlas nodes: building the per-tractogram endpoint voxel map,
+    and evaluating a new atlas against the cached map"""
+
+    params = STREAMLINE_COUNTS
+    param_names = ["n_streamlines"]
+    timeout = 1800
+
+    def setup(self, n_streamlines):
+        self.tck_file = synthetic_tck(n_streamlines)
+        self.atlas = synthetic_atlas(100)
+        self.cache_dir = tempfile.mkdtemp()
+        self.endpoint_map = endpoint_voxel_map(self.tck_file, self.atlas, cache_dir=self.cache_dir)
+
+    def teardown(self, n_streamlines):
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    def time_build_map(self, n_streamlines):
+        endpoint_voxel_map(self.tck_file, self.atlas, cache_dir=tempfile.mkdtemp(dir=self.cache_dir))
+
+    def time_assign_cached(self, n_streamlines):
+        assign_endpoints(
+            endpoint_voxel_map(self.tck_file, self.atlas, cache_dir=self.cache_dir), self.atlas
+        )
+
+
+class ParcelIndex:
+    """Extracting the sub-bundle of a parcel pair from a prebuilt parcel index"""
+
+    params = STREAMLINE_COUNTS
+    param_names = ["n_streamlines"]
+    timeout = 1800
+
+    def setup(self, n_streamlines):
+        self.tck_file = synthetic_tck(n_streamlines)
+        atlas = synthetic_atlas(100)
+        self.work_dir = tempfile.mkdtemp()
+        assignments = assign_endpoints(
+            endpoint_voxel_map(self.tck_file, atlas, cache_dir=self.work_dir), atlas
+        )
+        self.index_file = build_parcel_index(
+            assignments, op.join(self.work_dir, "parcelindex.npz"), tck_file=self.tck_file
+        )
+        self.assignments = assignments
+
+    def teardown(self, n_streamlines):
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    def time_build_index(self, n_streamlines):
+        build_parcel_index(self.assignments, op.join(self.work_dir, "rebuilt.npz"))
+
+    def time_query_pair(self, n_streamlines):
+        extract_parcel_bundle(self.index_file, op.join(self.work_dir, "pair.tck"), [3, 17])
+
+
+class StreamlineMasking:
+    """Include / exclude / truncation masking of a whole tractogram's points, as done on extracted
+    sub-bundles instead of running tckedit"""
+
+    params = STREAMLINE_COUNTS
+    param_names = ["n_streamlines"]
+    timeout = 1800
+
+    def setup(self, n_streamlines):
+        self.tck_file = synthetic_tck(n_streamlines)
+        self.rois, self.gmwmi = synthetic_roi_pair()
+        _, self.starts, self.ends = tck_streamline_offsets(self.tck_file)
+
+    def time_include_exclude(self, n_streamlines):
+        mask_streamlines(
+            self.tck_file, self.starts, self.ends, exclude_mask=self.rois, include_mask=self.gmwmi
+        )
+
+    def time_truncate(self, n_streamlines):
+        mask_streamlines(self.tck_file, self.starts, self.ends, streamline_mask=self.gmwmi)
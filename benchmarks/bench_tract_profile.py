@@ -0,0 +1,34 @@
+import dipy.stats.analysis as dsa
+from dipy.io.image import load_nifti
+from dipy.tracking.streamline import Streamlines
+from fsub_extractor.utils.streamline_utils import read_tck_streamlines
+from .synthetic import synthetic_scalar, synthetic_tck
+
+
+class TractProfile:
+    """Tract profiles of a sub-bundle, computed as in streamline_scalar"""
+
+    params = [1000, 10000]
+    param_names = ["n_streamlines"]
+    timeout = 600
+
+    def setup(self, n_streamlines):
+        self.streamlines = Streamlines(read_tck_streamlines(synthetic_tck(n_streamlines)))
+        self.scalar, self.affine = load_nifti(synthetic_scalar())
+
+    def time_gaussian_weights(self, n_streamlines):
+        dsa.gaussian_weights(self.streamlines, n_points=100)
+
+    def time_afq_profile(self, n_streamlines):
+        weights = dsa.gaussian_weights(self.streamlines, n_points=100)
+        dsa.afq_profile(
+            self.scalar,
+            self.streamlines,
+            self.affine,
+            weights=weights,
+            n_points=100,
+            orient_by=self.streamlines[0],
+        )
+
+    def peakmem_afq_profile(self, n_streamlines):
+        self.time_afq_profile(n_streamlines)
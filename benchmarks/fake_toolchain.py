@@ -0,0 +1,108 @@
+import os
+import os.path as op
+import sys
+import tempfile
+from contextlib import contextmanager
+from fsub_extractor.utils import system_utils
+from .fake_tools import PROGRAMS
+
+_FAKE_TOOLS = op.join(op.dirname(op.abspath(__file__)), "fake_tools.py")
+
+
+def install_fake_toolchain(bin_dir=None):
+    """Writes one executable wrapper per stand-in program (see fake_tools.py) into a folder
+    Parameters
+    ==========
+    bin_dir: str
+            Folder for the wrappers (default = a new temporary folder)
+
+    Outputs
+    =======
+    bin_dir: str
+            Folder to put at the front of PATH
+    """
+
+    if bin_dir == None:
+        bin_dir = tempfile.mkdtemp(prefix="fsub_fake_bin_")
+    os.makedirs(bin_dir, exist_ok=True)
+    for program in PROGRAMS:
+        wrapper = op.join(bin_dir, program)
+        with open(wrapper, "w") as f:
+            f.write(f'#!/bin/sh\nexec "{sys.executable}" "{_FAKE_TOOLS}" {program} "$@"\n')
+        os.chmod(wrapper, 0o755)
+
+    return bin_dir
+
+
+@contextmanager
+def fake_toolchain(subjects_dir=None, delay=0.0, delays=None, log_file=None, bin_dir=None):
+    """Runs the enclosed code with the stand-in MRtrix / FreeSurfer programs on PATH
+    Parameters
+    ==========
+    subjects_dir: str
+            FreeSurfer subjects folder for the FreeSurfer stand-ins (sets SUBJECTS_DIR)
+    delay: float
+            Seconds every program takes
+    delays: dict
+            Per-program seconds, e.g. {"tckgen": 2, "5ttgen": 5}
+    log_file: str
+            File to which every program call appends (program, start, end, pid); see read_call_log
+    bin_dir: str
+            Folder with already-installed wrappers (default = install new ones)
+
+    Outputs
+    =======
+    Yields the folder with the wrappers
+    """
+
+    bin_dir = install_fake_toolchain() if bin_dir == None else bin_dir
+    env = {
+        "PATH": bin_dir + os.pathsep + os.environ.get("PATH", ""),
+        "FSUB_FAKE_DELAY": str(delay),
+    }
+    for program, seconds in (delays or {}).items():
+        env["FSUB_FAKE_DELAY_" + "".join(c if c.isalnum() else "_" for c in program.upper())] = str(seconds)
+    if subjects_dir != None:
+        env["SUBJECTS_DIR"] = subjects_dir
+    if log_file != None:
+        env["FSUB_FAKE_LOG"] = log_file
+
+    previous = {key: os.environ.get(key) for key in env}
+    os.environ.update(env)
+    # Program lookups are cached by PATH, but versions are not
+    system_utils.probe_program_version.cache_clear()
+    try:
+        yield bin_dir
+    finally:
+        for key, value in previous.items():
+            if value == None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+        system_utils.probe_program_version.cache_clear()
+
+
+def read_call_log(log_file):
+    """Reads a fake toolchain call log
+    Outputs
+    =======
+    calls: list of (program, start, end) tuples, ordered by start time
+    """
+
+    calls = []
+    if op.exists(log_file):
+        with open(log_file) as f:
+            for line in f:
+                program, start, end, _ = line.rstrip("\n").split("\t")
+                calls += [(program, float(start), float(end))]
+    return sorted(calls, key=lambda call: call[1])
+
+
+def max_concurrency(calls):
+    """Largest number of program calls that were running at the same time"""
+    events = sorted([(start, 1) for _, start, _ in calls] + [(end, -1) for _, _, end in calls])
+    running = peak = 0
+    for _, change in events:
+        running += change
+        peak = max(peak, running)
+    return peak
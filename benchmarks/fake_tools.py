@@ -0,0 +1,488 @@
+"""Lightweight stand-ins for the MRtrix and FreeSurfer programs that fsub_extractor calls.
+
+Run as `python fake_tools.py <program> [arguments...]` (install_fake_toolchain in fake_toolchain.py
+puts one wrapper per program on PATH). Each stand-in accepts the arguments fsub_extractor passes,
+writes outputs of the right type, grid and rough content, and sleeps for a configurable delay:
+
+FSUB_FAKE_DELAY: seconds every program sleeps (default 0)
+FSUB_FAKE_DELAY_<PROGRAM>: per-program delay, e.g. FSUB_FAKE_DELAY_TCKGEN or FSUB_FAKE_DELAY_5TTGEN
+FSUB_FAKE_LOG: file to which each call appends a tab-separated line (program, start, end, pid)
+FSUB_FAKE_TCKGEN_ACCEPTANCE: fraction of generated streamlines that tckgen selects (default 0.2)
+"""
+import os
+import os.path as op
+import sys
+import time
+import numpy as np
+import nibabel as nib
+
+# Stand-ins for FreeSurfer projections reuse fsub_extractor's native implementations
+sys.path.insert(0, op.dirname(op.dirname(op.abspath(__file__))))
+
+# MRtrix options that take a value (any other "-option" is treated as a flag)
+_VALUE_OPTIONS = {
+    "-seeds", "-seed_gmwmi", "-seed_image", "-algorithm", "-act", "-include", "-exclude",
+    "-mask", "-select", "-nthreads", "-cutoff", "-minlength", "-maxlength", "-step",
+    "-angle", "-power", "-trials", "-max_attempts_per_seed", "-strides", "-linear",
+    "-interp", "-template", "-abs", "-comparison", "-out_assignments", "-tck_weights_in",
+    "-tck_weights_out", "-prefix_tck_weights_out", "-nodes", "-files", "-stat_tck",
+    "-assignment_radial_search", "-assignment_reverse_search", "-assignment_forward_search",
+    "-datatype",
+}
+
+
+def _parse_mrtrix(args):
+    """Splits MRtrix-style arguments into positional arguments and a dict of option -> list of values"""
+    positional, options = [], {}
+    i = 0
+    while i < len(args):
+        if args[i].startswith("-") and not _is_number(args[i]):
+            if args[i] in _VALUE_OPTIONS:
+                options.setdefault(args[i], []).append(args[i + 1])
+                i += 2
+                continue
+            options.setdefault(args[i], [])
+        else:
+            positional.append(args[i])
+        i += 1
+    return positional, options
+
+
+def _parse_freesurfer(args, flags=()):
+    """Parses FreeSurfer-style '--option value...' arguments into a dict of option -> list of values"""
+    options, current = {}, None
+    for arg in args:
+        if arg.startswith("--"):
+            current = arg
+            options[current] = []
+            if arg in flags:
+                current = None
+        elif current != None:
+            options[current].append(arg)
+    return options
+
+
+def _is_number(value):
+    try:
+        float(value)
+        return True
+    except ValueError:
+        return False
+
+
+def _save(data, affine, out_file):
+    """Saves an image (.mgz or NIfTI)"""
+    if out_file.endswith(".mgz"):
+        nib.save(nib.MGHImage(data, affine), out_file)
+    else:
+        nib.save(nib.Nifti1Image(data, affine), out_file)
+
+
+def _load(img_file):
+    img = nib.load(img_file)
+    return np.asarray(img.dataobj), img.affine
+
+
+def _read_tck(tck_file):
+    """Reads a .tck file into a list of (n, 3) float32 arrays and its header"""
+    from fsub_extractor.utils.streamline_utils import read_tck_header, read_tck_streamlines
+
+    return read_tck_streamlines(tck_file), read_tck_header(tck_file)
+
+
+def _write_tck(tck_file, streamlines, total_count=None):
+    """Writes streamlines (in RAS mm) to a .tck file"""
+    header = f"mrtrix tracks\ncount: {len(streamlines)}\n"
+    header += f"total_count: {len(streamlines) if total_count == None else total_count}\n"
+    header += "datatype: Float32LE\n"
+    offset = len(header) + len("file: . 0000000000\nEND\n")
+    header += f"file: . {offset:010d}\nEND\n"
+    delimiter = np.full((1, 3), np.nan, dtype="<f4")
+    with open(tck_file, "wb") as f:
+        f.write(header.encode("latin-1"))
+        for streamline in streamlines:
+            f.write(np.asarray(streamline, dtype="<f4").tobytes())
+            f.write(delimiter.tobytes())
+        f.write(np.full(3, np.inf, dtype="<f4").tobytes())
+
+
+def _world_to_voxel(points, affine, shape):
+    """Nearest voxel index of each point, and whether it is inside the grid"""
+    ijk = np.rint(nib.affines.apply_affine(np.linalg.inv(affine), points)).astype(np.int64)
+    inside = np.all((ijk >= 0) & (ijk < shape[:3]), axis=-1)
+    return np.clip(ijk, 0, np.array(shape[:3]) - 1), inside
+
+
+def _sample(data, affine, points):
+    """Nearest-neighbour values of an image at world points (0 outside the grid)"""
+    ijk, inside = _world_to_voxel(points, affine, data.shape)
+    return np.where(inside, data[ijk[:, 0], ijk[:, 1], ijk[:, 2]], 0)
+
+
+def _neighbour_max(mask):
+    """Dilates a 3D array by one voxel (6-connectivity)"""
+    out = mask.copy()
+    for axis in range(3):
+        for shift in [-1, 1]:
+            out = np.maximum(out, np.roll(mask, shift, axis=axis))
+    return out
+
+
+### MRtrix stand-ins
+
+
+def fivettgen(args):
+    """5ttgen <algorithm> <input> <output>: concentric CSF / GM / WM shells on a 2 mm version of the input grid"""
+    positional, _ = _parse_mrtrix(args)
+    algorithm, anat, out_file = positional[:3]
+    template = op.join(anat, "mri", "orig.mgz") if algorithm == "hsvs" else anat
+    img = nib.load(template)
+    shape = tuple(int(dim) // 2 for dim in img.shape[:3])
+    affine = img.affine @ np.diag([2, 2, 2, 1])
+
+    half = np.array(shape)[:, None, None, None] / 2
+    radius = np.linalg.norm((np.indices(shape) - half) / half, axis=0)
+    fivett = np.zeros(shape + (5,), dtype=np.float32)
+    fivett[..., 2] = radius < 0.5  # WM
+    fivett[..., 0] = (radius >= 0.5) & (radius < 0.6)  # cortical GM
+    fivett[..., 3] = (radius >= 0.6) & (radius < 0.65)  # CSF
+    _save(fivett, affine, out_file)
+
+
+def fivett2gmwmi(args):
+    """5tt2gmwmi <5tt> <output>: WM voxels that border GM"""
+    positional, _ = _parse_mrtrix(args)
+    fivett, affine = _load(positional[0])
+    gm, wm = fivett[..., 0], fivett[..., 2]
+    _save((wm * _neighbour_max(gm)).astype(np.float32), affine, positional[1])
+
+
+def mrthreshold(args):
+    """mrthreshold -abs <t> -comparison <c> <input> <output>"""
+    positional, options = _parse_mrtrix(args)
+    data, affine = _load(positional[0])
+    threshold = float(options.get("-abs", [0])[0])
+    comparison = options.get("-comparison", ["gt"])[0]
+    compare = {"gt": np.greater, "ge": np.greater_equal, "lt": np.less, "le": np.less_equal}
+    _save(compare[comparison](data, threshold).astype(np.uint8), affine, positional[1])
+
+
+def mrcalc(args):
+    """mrcalc <reverse Polish expression of images, numbers and -operators> <output>"""
+    operators = {
+        "-mult": np.multiply, "-add": np.add, "-subtract": np.subtract, "-divide": np.divide,
+        "-max": np.maximum, "-min": np.minimum, "-gt": np.greater, "-lt": np.less,
+    }
+    tokens = [arg for arg in args if arg != "-force"]
+    stack, affine = [], None
+    for token in tokens[:-1]:
+        if token in operators:
+            b, a = stack.pop(), stack.pop()
+            stack.append(operators[token](a, b))
+        elif _is_number(token):
+            stack.append(float(token))
+        else:
+            data, img_affine = _load(token)
+            affine = img_affine if affine is None else affine
+            stack.append(data.astype(np.float32))
+    result = np.asarray(stack[-1], dtype=np.float32)
+    if np.all(np.mod(result, 1) == 0):
+        result = result.astype(np.int16)
+    _save(result, affine, tokens[-1])
+
+
+def mrgrid(args):
+    """mrgrid <input> regrid -template <template> -interp nearest <output>"""
+    positional, options = _parse_mrtrix(args)
+    data, affine = _load(positional[0])
+    template = nib.load(options["-template"][0])
+    ijk = np.indices(template.shape[:3]).reshape(3, -1).T
+    values = _sample(data, affine, nib.affines.apply_affine(template.affine, ijk))
+    _save(values.reshape(template.shape[:3]).astype(data.dtype), template.affine, positional[-1])
+
+
+def mrtransform(args):
+    """mrtransform [options] <input> <output>: applies an identity transform"""
+    positional, _ = _parse_mrtrix(args)
+    data, affine = _load(positional[0])
+    _save(data, affine, positional[-1])
+
+
+def transformconvert(args):
+    """transformconvert <input> <format> <output>: writes an identity transform"""
+    positional, _ = _parse_mrtrix(args)
+    np.savetxt(positional[-1], np.eye(4)[:3])
+
+
+def tckgen(args):
+    """tckgen <fod> <output> -select <n> -seeds <cap> -seed_gmwmi <roi> ...: random walks from the seed ROI.
+    Reports progress like tckgen (unless -quiet), writes streamlines as they are selected (so a killed
+    run leaves a truncated file behind), and stops early if the seed cap runs out."""
+    positional, options = _parse_mrtrix(args)
+    out_file = positional[1]
+    n_select = int(options.get("-select", [1000])[0])
+    max_seeds = int(options.get("-seeds", [0])[0])
+    acceptance = float(os.getenv("FSUB_FAKE_TCKGEN_ACCEPTANCE", "0.2"))
+    rng = np.random.default_rng(int(os.getenv("MRTRIX_RNG_SEED", "0")))
+
+    n_generated = int(np.ceil(n_select / acceptance))
+    if max_seeds > 0 and max_seeds < n_generated:
+        n_generated = max_seeds
+        n_select = int(max_seeds * acceptance)
+
+    seed_roi = options.get("-seed_gmwmi", options.get("-seed_image", [None]))[0]
+    starts = np.zeros((max(n_select, 0), 3))
+    if seed_roi != None:
+        data, affine = _load(seed_roi)
+        seed_voxels = np.argwhere(data > 0)
+        if len(seed_voxels) > 0:
+            picks = seed_voxels[rng.integers(len(seed_voxels), size=n_select)]
+            starts = nib.affines.apply_affine(affine, picks)
+    steps = rng.normal(size=(n_select, 30, 3)) + rng.normal(size=(n_select, 1, 3))
+    steps /= np.linalg.norm(steps, axis=2, keepdims=True)
+    streamlines = starts[:, None] + np.cumsum(steps, axis=1)
+
+    # As tckgen does, write the header first and fill in the counts once tracking is done
+    header = "mrtrix tracks\ncount: {:010d}\ntotal_count: {:010d}\ndatatype: Float32LE\n"
+    offset = len(header.format(0, 0)) + len("file: . 0000000000\nEND\n")
+    header += f"file: . {offset:010d}\nEND\n"
+    delimiter = np.full((1, 3), np.nan, dtype="<f4")
+    delay = _delay("tckgen")
+    with open(out_file, "wb") as f:
+        f.write(header.format(0, 0).encode("latin-1"))
+        f.flush()
+        # Report progress over the configured delay, as tckgen does on stderr
+        for step in range(1, 11):
+            time.sleep(delay / 10)
+            for streamline in streamlines[n_select * (step - 1) // 10 : n_select * step // 10]:
+                f.write(streamline.astype("<f4").tobytes() + delimiter.tobytes())
+            f.flush()
+            if "-quiet" in options:
+                continue
+            generated = n_generated * step // 10
+            sys.stderr.write(
+                f"\rtckgen: [{step * 10:3d}%] {generated:8d} seeds, {generated:8d} streamlines, {n_select * step // 10:8d} selected"
+            )
+            sys.stderr.flush()
+        f.write(np.full(3, np.inf, dtype="<f4").tobytes())
+        f.seek(0)
+        f.write(header.format(n_select, n_generated).encode("latin-1"))
+    if "-quiet" not in options:
+        sys.stderr.write("\n")
+
+
+def tckedit(args):
+    """tckedit <inputs...> <output> [-include mask] [-exclude mask] [-mask mask]
+    [-tck_weights_in file -tck_weights_out file]: concatenates, filters and splits at the mask"""
+    positional, options = _parse_mrtrix(args)
+    streamlines, total_count = [], 0
+    for tck_file in positional[:-1]:
+        file_streamlines, header = _read_tck(tck_file)
+        streamlines += file_streamlines
+        total_count += int(header.get("total_count", len(file_streamlines)))
+    keep = np.ones(len(streamlines), dtype=bool)
+    for option, keep_if in [("-include", True), ("-exclude", False)]:
+        for mask_file in options.get(option, []):
+            data, affine = _load(mask_file)
+            keep &= [np.any(_sample(data, affine, s) > 0) == keep_if for s in streamlines]
+    # Split each streamline into its parts inside the mask (of at least 2 points), keeping all of them.
+    # This is our reading of tckedit -mask, not checked against MRtrix; fsub_extractor's own
+    # truncation (mask_streamlines) keeps only the longest part, so the two are not expected to match.
+    weights = None
+    if "-tck_weights_in" in options:
+        weights = _read_weights(options["-tck_weights_in"][0])
+    for mask_file in options.get("-mask", []):
+        data, affine = _load(mask_file)
+        pieces, piece_keep, piece_weights = [], [], []
+        for i, streamline in enumerate(streamlines):
+            inside = np.concatenate([[False], _sample(data, affine, streamline) > 0, [False]])
+            edges = np.flatnonzero(np.diff(inside.astype(np.int8)))
+            for start, end in zip(edges[::2], edges[1::2]):
+                if end - start >= 2:
+                    pieces += [streamline[start:end]]
+                    piece_keep += [keep[i]]
+                    if weights is not None:
+                        piece_weights += [weights[i]]
+        streamlines, keep = pieces, np.array(piece_keep, dtype=bool)
+        if weights is not None:
+            weights = np.array(piece_weights)
+    _write_tck(positional[-1], [s for s, k in zip(streamlines, keep) if k], total_count=total_count)
+
+    if weights is not None:
+        np.savetxt(options["-tck_weights_out"][0], weights[keep], fmt="%g")
+
+
+def tck2connectome(args):
+    """tck2connectome <tracks> <nodes> <connectome> -out_assignments <file>: assigns endpoints to the node voxel they are in"""
+    positional, options = _parse_mrtrix(args)
+    streamlines, _ = _read_tck(positional[0])
+    nodes, affine = _load(positional[1])
+    nodes = np.rint(nodes).astype(np.int64)
+    n_nodes = max(int(nodes.max()), 1)
+
+    endpoints = np.array([[s[0], s[-1]] for s in streamlines]).reshape(-1, 3)
+    assignments = _sample(nodes, affine, endpoints).reshape(-1, 2) if len(streamlines) else np.zeros((0, 2), int)
+    if "-out_assignments" in options:
+        with open(options["-out_assignments"][0], "w") as f:
+            f.write("# fake tck2connectome assignments\n")
+            for a, b in assignments:
+                f.write(f"{a} {b}\n")
+
+    weights = np.ones(len(assignments))
+    if "-tck_weights_in" in options:
+        weights = _read_weights(options["-tck_weights_in"][0])
+    connectome = np.zeros((n_nodes, n_nodes))
+    for (a, b), weight in zip(assignments, weights):
+        if a > 0 and b > 0:
+            connectome[a - 1, b - 1] += weight
+            if a != b:
+                connectome[b - 1, a - 1] += weight
+    np.savetxt(positional[2], np.triu(connectome), fmt="%g")
+
+
+def connectome2tck(args):
+    """connectome2tck <tracks> <assignments> <output> -nodes a,b -exclusive -files single:
+    keeps streamlines with both endpoints among the nodes (not unassigned at both ends, and not self-connections)"""
+    positional, options = _parse_mrtrix(args)
+    streamlines, _ = _read_tck(positional[0])
+    assignments = np.loadtxt(positional[1], comments="#", dtype=np.int64, ndmin=2)
+    nodes = [int(node) for node in options["-nodes"][0].split(",")]
+
+    keep = np.isin(assignments, nodes).all(axis=1) if "-exclusive" in options else np.isin(assignments, nodes).any(axis=1)
+    keep &= assignments.max(axis=1) > 0
+    if "-keep_self" not in options:
+        keep &= assignments[:, 0] != assignments[:, 1]
+    _write_tck(positional[2], [s for s, k in zip(streamlines, keep) if k])
+
+    if "-tck_weights_in" in options:
+        weights = _read_weights(options["-tck_weights_in"][0])
+        prefix = options["-prefix_tck_weights_out"][0]
+        out_weights = prefix if prefix.endswith(".csv") else prefix + ".csv"
+        np.savetxt(out_weights, weights[keep][None], delimiter=" ", fmt="%g")
+
+
+def tcksample(args):
+    """tcksample <tracks> <image> <output> -stat_tck mean: mean image value along each streamline"""
+    positional, _ = _parse_mrtrix(args)
+    streamlines, _ = _read_tck(positional[0])
+    data, affine = _load(positional[1])
+    means = [float(_sample(data, affine, s).mean()) for s in streamlines]
+    with open(positional[2], "w") as f:
+        f.write("# fake tcksample\n")
+        f.write(",".join(f"{mean:g}" for mean in means) + "\n")
+
+
+def _read_weights(weights_file):
+    """Reads SIFT2-style weights (whitespace or comma separated, '#' comments)"""
+    with open(weights_file) as f:
+        text = " ".join(line for line in f if not line.startswith("#"))
+    return np.array(text.replace(",", " ").split(), dtype=np.float64)
+
+
+### FreeSurfer stand-ins
+
+
+def _subjects_dir():
+    return os.getenv("SUBJECTS_DIR", ".")
+
+
+def mri_vol2surf(args):
+    """mri_vol2surf --src <vol> --out <surf.mgz> --regheader <subject> --hemi <hemi>: samples the volume at white surface vertices"""
+    from fsub_extractor.utils.surface_utils import load_surface_geometry
+
+    options = _parse_freesurfer(args)
+    subject, hemi = options["--regheader"][0], options["--hemi"][0]
+    geometry = load_surface_geometry(_subjects_dir(), subject, hemi)
+    tkr2scanner = geometry["affine"] @ np.linalg.inv(geometry["vox2ras_tkr"])
+    data, affine = _load(options["--src"][0])
+    values = _sample(data, affine, nib.affines.apply_affine(tkr2scanner, geometry["vertices"]))
+    nib.save(
+        nib.MGHImage(values.astype(np.float32).reshape(-1, 1, 1), np.eye(4)), options["--out"][0]
+    )
+
+
+def mri_label2vol(args):
+    """mri_label2vol --label <label> --o <out> --subject <subject> --hemi <hemi> --proj frac <start> <stop> <delta>"""
+    from fsub_extractor.utils.surface_utils import surf2vol_native
+
+    options = _parse_freesurfer(args, flags=("--identity",))
+    surf2vol_native(
+        options["--label"][0],
+        _subjects_dir(),
+        options["--subject"][0],
+        options["--hemi"][0],
+        options["--o"][0],
+        options["--proj"][1:4],
+    )
+
+
+def mri_surf2vol(args):
+    """mri_surf2vol --surfval <roi> --fill-projfrac <start> <stop> <delta> ... --o <out>, or
+    mri_surf2vol --mkmask --hemi <hemi> --surf <surf> ... --o <out>"""
+    from fsub_extractor.utils.surface_utils import load_surface_geometry, surf2vol_native
+
+    options = _parse_freesurfer(args, flags=("--mkmask",))
+    subject, hemi = options["--subject"][0], options["--hemi"][0]
+    out_file = options["--o"][0]
+    if "--surfval" in options:
+        surf2vol_native(
+            options["--surfval"][0],
+            _subjects_dir(),
+            subject,
+            hemi,
+            out_file,
+            options["--fill-projfrac"][:3],
+        )
+        return
+
+    geometry = load_surface_geometry(_subjects_dir(), subject, hemi)
+    vertices = geometry["pial_vertices" if options["--surf"][0] == "pial" else "vertices"]
+    shape = tuple(int(dim) for dim in geometry["shape"])
+    ijk, inside = _world_to_voxel(vertices, geometry["vox2ras_tkr"], shape)
+    mask = np.zeros(shape, dtype=np.uint8)
+    mask[tuple(ijk[inside].T)] = 1
+    _save(mask, geometry["affine"], out_file)
+
+
+PROGRAMS = {
+    "5ttgen": fivettgen,
+    "5tt2gmwmi": fivett2gmwmi,
+    "mrthreshold": mrthreshold,
+    "mrcalc": mrcalc,
+    "mrgrid": mrgrid,
+    "mrtransform": mrtransform,
+    "transformconvert": transformconvert,
+    "tckgen": tckgen,
+    "tckedit": tckedit,
+    "tck2connectome": tck2connectome,
+    "connectome2tck": connectome2tck,
+    "tcksample": tcksample,
+    "mri_vol2surf": mri_vol2surf,
+    "mri_label2vol": mri_label2vol,
+    "mri_surf2vol": mri_surf2vol,
+}
+
+
+def _delay(program):
+    """Seconds a program should take (see module docstring)"""
+    key = "FSUB_FAKE_DELAY_" + "".join(c if c.isalnum() else "_" for c in program.upper())
+    return float(os.getenv(key, os.getenv("FSUB_FAKE_DELAY", "0")))
+
+
+def main(argv):
+    program, args = argv[1], argv[2:]
+    if args in (["--version"], ["-version"]):
+        print(f"== {program} (fsub_extractor fake toolchain) ==")
+        return
+    start = time.time()
+    if program != "tckgen":
+        time.sleep(_delay(program))
+    PROGRAMS[program](args)
+    log_file = os.getenv("FSUB_FAKE_LOG")
+    if log_file:
+        with open(log_file, "a") as f:
+            f.write(f"{program}\t{start:.6f}\t{time.time():.6f}\t{os.getpid()}\n")
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,279 @@
+import os
+import os.path as op
+import tempfile
+import numpy as np
+import nibabel as nib
+
+# Synthetic data is written once per parameter set and reused across benchmark runs
+DATA_DIR = os.getenv("FSUB_BENCH_DATA", op.join(tempfile.gettempdir(), "fsub_bench"))
+
+# Tractogram sizes to benchmark, e.g. FSUB_BENCH_STREAMLINES=1000000,5000000,20000000
+STREAMLINE_COUNTS = [
+    int(n) for n in os.getenv("FSUB_BENCH_STREAMLINES", "1000000").split(",")
+]
+
+# Grid shared by tractograms, atlases and scalar maps: 2 mm voxels covering +/- 90 mm
+GRID_SHAPE = (90, 90, 90)
+GRID_AFFINE = np.array(
+    [[2.0, 0, 0, -90], [0, 2.0, 0, -90], [0, 0, 2.0, -90], [0, 0, 0, 1]]
+)
+
+
+def data_path(name):
+    """Path of a synthetic file in the benchmark data directory"""
+    os.makedirs(DATA_DIR, exist_ok=True)
+    return op.join(DATA_DIR, name)
+
+
+def synthetic_tck(n_streamlines, max_points=80, chunk_size=50000, seed=0):
+    """Writes a .tck file of smooth random-walk streamlines with 20 to max_points points (1 mm steps)
+    Parameters
+    ==========
+    n_streamlines: int
+            Number of streamlines
+    max_points: int
+            Maximum number of points per streamline
+    chunk_size: int
+            Streamlines generated at a time (bounds memory use for very large tractograms)
+    seed: int
+            Random seed
+
+    Outputs
+    =======
+    tck_file: str
+            Path to the .tck file (reused if it already exists)
+    """
+
+    tck_file = data_path(f"n-{n_streamlines}_seed-{seed}_tractogram.tck")
+    if op.exists(tck_file):
+        return tck_file
+
+    rng = np.random.default_rng(seed)
+    header = f"mrtrix tracks\ncount: {n_streamlines}\ndatatype: Float32LE\n"
+    # The data offset is part of the header, so pad it to a fixed width
+    offset = len(header) + len("file: . 0000000000\nEND\n")
+    header += f"file: . {offset:010d}\nEND\n"
+
+    tmp_file = tck_file + ".tmp"
+    with open(tmp_file, "wb") as f:
+        f.write(header.encode("latin-1"))
+        for start in range(0, n_streamlines, chunk_size):
+            n = min(chunk_size, n_streamlines - start)
+            directions = rng.normal(size=(n, 1, 3))
+            steps = directions + 0.3 * np.cumsum(rng.normal(size=(n, max_points, 3)), axis=1) / np.sqrt(
+                np.arange(1, max_points + 1)
+            )[None, :, None]
+            steps /= np.linalg.norm(steps, axis=2, keepdims=True)
+            points = rng.uniform(-60, 60, size=(n, 1, 3)) + np.cumsum(steps, axis=1)
+
+            # Add a NaN delimiter after each streamline's last point, and drop the points past it
+            lengths = rng.integers(20, max_points + 1, size=n)
+            points = np.concatenate([points, np.zeros((n, 1, 3))], axis=1)
+            row = np.arange(max_points + 1)[None, :]
+            points[row == lengths[:, None]] = np.nan
+            f.write(points[row <= lengths[:, None]].astype("<f4").tobytes())
+        f.write(np.full(3, np.inf, dtype="<f4").tobytes())
+    os.replace(tmp_file, tck_file)
+
+    return tck_file
+
+
+def synthetic_sift2_weights(n_streamlines, seed=0):
+    """Writes a SIFT2-like weights file (one positive weight per line, after a comment line)
+
+    Outputs
+    =======
+    weights_file: str
+            Path to the weights file (.csv)
+    """
+
+    weights_file = data_path(f"n-{n_streamlines}_seed-{seed}_sift2weights.csv")
+    if op.exists(weights_file):
+        return weights_file
+
+    rng = np.random.default_rng(seed)
+    weights = rng.lognormal(mean=-0.5, sigma=0.5, size=n_streamlines)
+    np.savetxt(weights_file, weights, fmt="%.9g", header="command_history: tcksift2 (synthetic)")
+
+    return weights_file
+
+
+def synthetic_atlas(n_rois=100, seed=0):
+    """Writes an atlas-like image with n_rois labels (Voronoi parcels inside a 70 mm sphere)
+
+    Outputs
+    =======
+    atlas_file: str
+            Path to the atlas image (.nii.gz)
+    """
+
+    atlas_file = data_path(f"nroi-{n_rois}_seed-{seed}_atlas.nii.gz")
+    if op.exists(atlas_file):
+        return atlas_file
+
+    rng = np.random.default_rng(seed)
+    ijk = np.indices(GRID_SHAPE).reshape(3, -1).T
+    xyz = nib.affines.apply_affine(GRID_AFFINE, ijk)
+    centers = rng.uniform(-60, 60, size=(n_rois, 3))
+    labels = np.zeros(len(xyz), dtype=np.int16)
+    in_brain = np.linalg.norm(xyz, axis=1) < 70
+    # Nearest parcel center, computed in blocks to bound memory
+    brain_idx = np.flatnonzero(in_brain)
+    for block in np.array_split(brain_idx, 64):
+        distances = np.linalg.norm(xyz[block, None] - centers[None], axis=2)
+        labels[block] = distances.argmin(axis=1) + 1
+    nib.save(nib.Nifti1Image(labels.reshape(GRID_SHAPE), GRID_AFFINE), atlas_file)
+
+    return atlas_file
+
+
+def synthetic_roi_pair(seed=0):
+    """Writes an image with two box-shaped ROIs (values 1 and 2) and a binary GM/WM interface mask
+
+    Outputs
+    =======
+    rois_file: str
+            Path to the two-ROI image (.nii.gz)
+    gmwmi_file: str
+            Path to the binary interface mask (.nii.gz)
+    """
+
+    rois_file = data_path(f"seed-{seed}_rois.nii.gz")
+    gmwmi_file = data_path(f"seed-{seed}_gmwmi.nii.gz")
+    if op.exists(rois_file) and op.exists(gmwmi_file):
+        return rois_file, gmwmi_file
+
+    rois = np.zeros(GRID_SHAPE, dtype=np.uint8)
+    rois[20:35, 40:50, 40:50] = 1
+    rois[55:70, 40:50, 40:50] = 2
+    nib.save(nib.Nifti1Image(rois, GRID_AFFINE), rois_file)
+
+    radius = np.linalg.norm(
+        nib.affines.apply_affine(GRID_AFFINE, np.indices(GRID_SHAPE).reshape(3, -1).T),
+        axis=1,
+    ).reshape(GRID_SHAPE)
+    gmwmi = ((radius > 50) & (radius < 60)).astype(np.uint8)
+    nib.save(nib.Nifti1Image(gmwmi, GRID_AFFINE), gmwmi_file)
+
+    return rois_file, gmwmi_file
+
+
+def synthetic_scalar(seed=0):
+    """Writes a smooth float32 scalar map (e.g., FA-like values in 0-1)
+
+    Outputs
+    =======
+    scalar_file: str
+            Path to the scalar image (.nii.gz)
+    """
+
+    scalar_file = data_path(f"seed-{seed}_scalar.nii.gz")
+    if op.exists(scalar_file):
+        return scalar_file
+
+    rng = np.random.default_rng(seed)
+    i, j, k = np.indices(GRID_SHAPE) / GRID_SHAPE[0]
+    frequencies = rng.uniform(1, 4, size=3)
+    scalar = 0.5 + 0.25 * np.sin(2 * np.pi * frequencies[0] * i) * np.cos(
+        2 * np.pi * frequencies[1] * j
+    ) + 0.2 * np.sin(2 * np.pi * frequencies[2] * k)
+    nib.save(nib.Nifti1Image(scalar.astype(np.float32), GRID_AFFINE), scalar_file)
+
+    return scalar_file
+
+
+def _icosphere(n_subdivisions):
+    """Vertices and faces of a unit icosphere"""
+    t = (1 + np.sqrt(5)) / 2
+    vertices = np.array(
+        [
+            [-1, t, 0], [1, t, 0], [-1, -t, 0], [1, -t, 0],
+            [0, -1, t], [0, 1, t], [0, -1, -t], [0, 1, -t],
+            [t, 0, -1], [t, 0, 1], [-t, 0, -1], [-t, 0, 1],
+        ],
+        dtype=np.float64,
+    )
+    faces = np.array(
+        [
+            [0, 11, 5], [0, 5, 1], [0, 1, 7], [0, 7, 10], [0, 10, 11],
+            [1, 5, 9], [5, 11, 4], [11, 10, 2], [10, 7, 6], [7, 1, 8],
+            [3, 9, 4], [3, 4, 2], [3, 2, 6], [3, 6, 8], [3, 8, 9],
+            [4, 9, 5], [2, 4, 11], [6, 2, 10], [8, 6, 7], [9, 8, 1],
+        ]
+    )
+    for _ in range(n_subdivisions):
+        # Split each triangle in four, sharing midpoints between neighbouring triangles
+        edges = np.sort(np.concatenate([faces[:, [0, 1]], faces[:, [1, 2]], faces[:, [2, 0]]]), axis=1)
+        unique_edges, edge_index = np.unique(edges, axis=0, return_inverse=True)
+        midpoints = vertices[unique_edges].mean(axis=1)
+        mid = edge_index.reshape(3, -1).T + len(vertices)
+        vertices = np.concatenate([vertices, midpoints])
+        a, b, c = faces.T
+        ab, bc, ca = mid.T
+        faces = np.concatenate(
+            [
+                np.stack([a, ab, ca], axis=1),
+                np.stack([b, bc, ab], axis=1),
+                np.stack([c, ca, bc], axis=1),
+                np.stack([ab, bc, ca], axis=1),
+            ]
+        )
+    vertices /= np.linalg.norm(vertices, axis=1, keepdims=True)
+    return vertices, faces.astype(np.int32)
+
+
+def synthetic_fs_subject(n_subdivisions=7, subject="sub-bench"):
+    """Writes a FreeSurfer-like subject: spherical lh/rh white and pial surfaces
+    (10 * 4**n_subdivisions + 2 vertices each; 7 gives fsaverage's 163842), thickness, a
+    conformed 256^3 orig.mgz, and lh / rh labels of about 2% of vertices
+
+    Outputs
+    =======
+    fs_dir: str
+            FreeSurfer subjects directory
+    subject: str
+            Subject name
+    label_file: str
+            Path to the lh .label ROI (the rh ROI is the same path with 'rh.')
+    """
+
+    fs_dir = data_path(f"fs_ico-{n_subdivisions}")
+    subject_dir = op.join(fs_dir, subject)
+    label_file = op.join(subject_dir, "label", "lh.bench.label")
+    if op.exists(label_file):
+        return fs_dir, subject, label_file
+
+    for folder in ["surf", "mri", "label"]:
+        os.makedirs(op.join(subject_dir, folder), exist_ok=True)
+    sphere, faces = _icosphere(n_subdivisions)
+    for hemi, x_center in [("lh", -30), ("rh", 30)]:
+        center = np.array([x_center, 0, 0])
+        nib.freesurfer.write_geometry(
+            op.join(subject_dir, "surf", f"{hemi}.white"), 35 * sphere + center, faces
+        )
+        nib.freesurfer.write_geometry(
+            op.join(subject_dir, "surf", f"{hemi}.pial"), 38 * sphere + center, faces
+        )
+        nib.freesurfer.write_morph_data(
+            op.join(subject_dir, "surf", f"{hemi}.thickness"),
+            np.full(len(sphere), 3, dtype=np.float32),
+        )
+
+    conformed = np.array(
+        [[-1.0, 0, 0, 128], [0, 0, 1, -128], [0, -1, 0, 128], [0, 0, 0, 1]]
+    )
+    nib.save(
+        nib.MGHImage(np.zeros((256, 256, 256), dtype=np.uint8), conformed),
+        op.join(subject_dir, "mri", "orig.mgz"),
+    )
+
+    # Labels: a cap at the top of each hemisphere's sphere
+    label_vertices = np.flatnonzero(sphere[:, 2] > 0.96)
+    for hemi, x_center in [("lh", -30), ("rh", 30)]:
+        coords = 35 * sphere[label_vertices] + np.array([x_center, 0, 0])
+        with open(label_file.replace("lh.", f"{hemi}."), "w") as f:
+            f.write(f"#!ascii label, synthetic benchmark ROI\n{len(label_vertices)}\n")
+            for vertex, (x, y, z) in zip(label_vertices, coords):
+                f.write(f"{vertex} {x:.3f} {y:.3f} {z:.3f} 0.000000\n")
+
+    return fs_dir, subject, label_file
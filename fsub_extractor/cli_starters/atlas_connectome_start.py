@@ -0,0 +1,166 @@
+import argparse
+import os.path as op
+from os import getcwd
+from pathlib import Path
+from fsub_extractor.functions.atlas_connectome import atlas_connectome
+
+# Add input arguments
+def get_parser():
+
+    parser = argparse.ArgumentParser(
+        description="Computes the full node-by-node connectome (streamline counts, mean streamline lengths, and summed SIFT2 weights) of a tract file for an atlas or a list of ROIs, assigning streamlines with a single pass over the tract file."
+    )
+    parser.add_argument(
+        "--subject",
+        help="Subject name.",
+        required=True,
+        metavar=("sub-XXX"),
+    )
+    parser.add_argument(
+        "--tract",
+        help="Path to tract file (.tck or .trk). Should be in the same space as the atlas or ROIs.",
+        type=validate_file,
+        required=True,
+        metavar=("/PATH/TO/TRACT.trk|.tck"),
+        action=CheckExt({".trk", ".tck"}),
+    )
+    nodes = parser.add_mutually_exclusive_group(required=True)
+    nodes.add_argument(
+        "--atlas",
+        help="Atlas-like image with each node labelled by a different integer (1 to N), e.g. all projected ROIs of a subject.",
+        type=validate_file,
+        metavar=("/PATH/TO/ATLAS.nii.gz|.mif"),
+        action=CheckExt({".nii.gz", ".nii", ".mif"}),
+    )
+    nodes.add_argument(
+        "--rois",
+        help="Comma delimited list (no spaces) of ROI masks (.nii.gz) on the same grid, e.g. ROIs projected by 'project_rois'. The ROIs become nodes 1 to N in the order given.",
+        metavar=("/PATH/TO/ROI1.nii.gz,/PATH/TO/ROI2.nii.gz..."),
+    )
+    parser.add_argument(
+        "--node-names",
+        "--node_names",
+        help="Comma delimited list (no spaces) of node names, saved with the connectome.",
+        metavar=("NAME1,NAME2..."),
+    )
+    parser.add_argument(
+        "--search-dist",
+        "--search_dist",
+        help="Distance in mm to search from streamlines for ROIs (float). Default is 2.0 mm. Ignored if --search-type is 'end' or 'all'.",
+        type=check_positive_float,
+        default=2.0,
+        metavar=("DISTANCE"),
+    )
+    parser.add_argument(
+        "--search-type",
+        "--search_type",
+        choices=["forward", "radial", "reverse", "end", "all"],
+        help="Method of searching for streamlines (see documentation for MRTrix3 'tck2connectome'). Default is radial.",
+        default="radial",
+    )
+    parser.add_argument(
+        "--sift2-weights",
+        "--sift2_weights",
+        help="Path to SIFT2 weights file corresponding to input tract. If supplied, the summed weight of every node pair is saved as well. The parsed weights are cached as a .npy file next to it, which later runs read instead.",
+        type=validate_file,
+        metavar=("/PATH/TO/SIFT2_WEIGHTS.csv|.txt"),
+        action=CheckExt({".csv", ".txt"}),
+    )
+    parser.add_argument(
+        "--save-text",
+        "--save_text",
+        help="Also save each full matrix as a .csv file, in the layout of MRtrix3 'tck2connectome' (upper triangular). By default only the compact .npz file of connected node pairs is saved.",
+        default=False,
+        action="store_true",
+    )
+    parser.add_argument(
+        "--out-dir",
+        "--out_dir",
+        help="Directory where outputs will be stored (a subject-folder will be created there if it does not exist). Default is current directory.",
+        type=op.abspath,
+        default=getcwd(),
+        metavar=("/PATH/TO/OUTDIR/"),
+    )
+    parser.add_argument(
+        "--out-prefix",
+        "--out_prefix",
+        help="Prefix for all output files. Default is no prefix.",
+        type=str,
+        default="",
+        metavar=("PREFIX"),
+    )
+    parser.add_argument(
+        "--overwrite",
+        help="Whether to overwrite outputs. Default is to overwrite.",
+        default=True,
+        action=argparse.BooleanOptionalAction,
+    )
+    parser.add_argument(
+        "--profile",
+        help="Directory to save Python-side profiles of each stage to: cProfile call statistics (.pstats) and the largest memory allocations (_memory.txt), plus a summary table printed at the end. Profiling slows down the Python portions. Default is not to profile.",
+        type=op.abspath,
+        metavar=("/PATH/TO/PROFILEDIR/"),
+    )
+
+    return parser
+
+
+# Check that files exist
+def validate_file(arg):
+    if (file := Path(arg)).is_file():
+        return op.abspath(file)
+    else:
+        raise FileNotFoundError(arg)
+
+
+# Function for checking file extensions
+def CheckExt(choices):
+    class Act(argparse.Action):
+        def __call__(self, parser, namespace, fname, option_string=None):
+            file_has_valid_ext = False
+            for choice in choices:
+                len_ext = len(choice)
+                if fname[(-1 * len_ext) :] == choice:
+                    file_has_valid_ext = True
+                    break
+
+            if file_has_valid_ext == False:
+                option_string = "({})".format(option_string) if option_string else ""
+                parser.error(
+                    "file doesn't end with one of {}{}".format(choices, option_string)
+                )
+            else:
+                setattr(namespace, self.dest, fname)
+
+    return Act
+
+
+# Check for positive values
+def check_positive_float(value):
+    value = float(value)
+    if value <= 0:
+        raise argparse.ArgumentTypeError("%s is not positive" % value)
+    return value
+
+
+def main():
+
+    # Parse arguments and run the main code
+    parser = get_parser()
+    args = parser.parse_args()
+
+    main = atlas_connectome(
+        subject=args.subject,
+        tract=args.tract,
+        out_dir=args.out_dir,
+        out_prefix=args.out_prefix,
+        overwrite=args.overwrite,
+        atlas=args.atlas,
+        rois=args.rois,
+        node_names=args.node_names,
+        search_dist=str(args.search_dist),
+        search_type=str(args.search_type),
+        sift2_weights=args.sift2_weights,
+        save_text=args.save_text,
+        profile_dir=args.profile,
+    )
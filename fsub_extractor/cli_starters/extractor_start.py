@@ -91,6 +91,13 @@ def get_parser():
         default="-1,0,0.05",
         metavar=("START,STOP,DELTA"),
     )
+    parser.add_argument(
+        "--projection-method",
+        "--projection_method",
+        choices=["native", "freesurfer"],
+        help="How to project surface ROIs (.label, .gii, .mgz) into white matter. 'native' does the projection in Python and does not need FreeSurfer binaries; 'freesurfer' uses mri_label2vol / mri_surf2vol. Volumetric ROIs (.nii.gz) always use mri_vol2surf. Default is native.",
+        default="native",
+    )
     parser.add_argument(
         "--fivett",
         help="Path to 5TT image (.nii.gz or .mif). Skips making it from FreeSurfer inputs. This is used if you opt to intersect ROIs with the GMWMI, and/or an FSuB is being generated (--generate).",
@@ -141,6 +148,47 @@ def get_parser():
         default=True,
         action=argparse.BooleanOptionalAction,
     )
+    parser.add_argument(
+        "--log-dir",
+        "--log_dir",
+        help="Directory to save the output of each external command (MRtrix, FreeSurfer) to, one log file per command. Default is to print command output to the console.",
+        type=op.abspath,
+        metavar=("/PATH/TO/LOGDIR/"),
+    )
+    parser.add_argument(
+        "--profile",
+        help="Directory to save Python-side profiles of each stage to: cProfile call statistics (.pstats) and the largest memory allocations (_memory.txt), plus a summary table printed at the end. Profiling slows down the Python portions. Default is not to profile.",
+        type=op.abspath,
+        metavar=("/PATH/TO/PROFILEDIR/"),
+    )
+    parser.add_argument(
+        "--trx",
+        help="Also save the sub-bundle as a TRX file (next to the .tck), which can be memory-mapped when loaded and holds the SIFT2 weights and ROI assignments of each extracted streamline. Needs the trx-python package.",
+        default=False,
+        action="store_true",
+    )
+    parser.add_argument(
+        "--trx-float16",
+        "--trx_float16",
+        help="Store TRX streamline points as float16, which halves the file size (about 0.06 mm precision at 100 mm from the origin).",
+        default=False,
+        action="store_true",
+    )
+    parser.add_argument(
+        "--assignments-text",
+        "--assignments_text",
+        help="Also keep tck2connectome's streamline assignments as text (one line per streamline of the whole tractogram). By default only the compact binary copy (_desc-assignments.npz) is kept.",
+        default=False,
+        action="store_true",
+    )
+    parser.add_argument(
+        "--dry-run",
+        "--dry_run",
+        "--plan",
+        help="Print the processing plan (stages, programs and their versions, which outputs already exist, and rough runtime/memory estimates) and exit without running anything.",
+        default=False,
+        action="store_true",
+    )
 
     # Streamline masking arguments
     mask_group = parser.add_argument_group("Options for Streamline Masking")
@@ -163,7 +211,7 @@ def get_parser():
     mask_group.add_argument(
         "--streamline-mask",
         "--streamline_mask",
-        help="Path to streamline mask (.nii.gz or .mif). If specified, streamlines exiting this mask will be truncated. Must be in DWI space.",
+        help="Path to streamline mask (.nii.gz or .mif). If specified, streamlines exiting this mask will be truncated. With a .nii.gz mask, each streamline keeps its longest part inside the mask; .mif masks are applied by tckedit instead. Must be in DWI space.",
         type=validate_file,
         metavar=("/PATH/TO/STREAMLINE_MASK.nii.gz|.mif"),
         action=CheckExt({".nii.gz", ".mif"}),
@@ -213,7 +261,7 @@ def get_parser():
     ext_args.add_argument(
         "--sift2-weights",
         "--sift2_weights",
-        help="Path to SIFT2 weights file corresponding to input tract. If supplied, the sum of weights will be output with streamline extraction.",
+        help="Path to SIFT2 weights file corresponding to input tract. If supplied, the sum of weights will be output with streamline extraction. The parsed weights are cached as a .npy file next to it, which later runs read instead.",
         type=validate_file,
         metavar=("/PATH/TO/SIFT2_WEIGHTS.csv|.txt"),
         action=CheckExt({".csv", ".txt"}),
@@ -245,6 +293,49 @@ def get_parser():
         action=CheckExt({".txt"}),
     )
 
+    gen_args.add_argument(
+        "--n-shards",
+        "--n_shards",
+        help="Number of independent tckgen processes to split the streamlines of each seeding direction across. Shards run concurrently and are merged. Default is 1.",
+        type=check_positive_int,
+        metavar=("K"),
+        default=1,
+    )
+    gen_args.add_argument(
+        "--nthreads",
+        help="Total number of threads shared by all tckgen processes. Default is all available CPUs.",
+        type=check_positive_int,
+        metavar=("N"),
+    )
+    gen_args.add_argument(
+        "--tckgen-seed",
+        "--tckgen_seed",
+        help="Random seed for tckgen (each shard and seeding direction is offset from it). Default is unseeded.",
+        type=int,
+        metavar=("SEED"),
+    )
+
+    gen_args.add_argument(
+        "--max-seeds",
+        "--max_seeds",
+        help="Maximum number of seeds tckgen may attempt in total. Generation stops early with fewer streamlines than requested if this runs out (useful for poorly connected ROIs). Default is no limit.",
+        type=check_positive_int,
+        metavar=("N"),
+    )
+    gen_args.add_argument(
+        "--time-limit",
+        "--time_limit",
+        help="Seconds after which unfinished tckgen processes are stopped. The streamlines they completed are kept. Default is no limit.",
+        type=check_positive_float,
+        metavar=("SECONDS"),
+    )
+    gen_args.add_argument(
+        "--pial-exclusion",
+        "--pial_exclusion",
+        help="Stop streamlines that reach the pial surface, using a mask of the surface that is built once per subject and reused. Compare the acceptance rates in the _tckgen-stats.tsv outputs to see whether it helps for your data.",
+        action="store_true",
+    )
+
     # Visualization arguments
     viz_args = parser.add_argument_group("Options for Visualization")
     viz_args.add_argument(
@@ -339,6 +430,34 @@ def get_parser():
         help="Camera angle for visualization. Default is 'saggital.'",
         default="sagittal",
     )
+    viz_args.add_argument(
+        "--viz-max-points",
+        "--viz_max_points",
+        help="Maximum number of streamline points drawn for the original bundle. Larger bundles are compressed and subsampled to fit. Default is 1000000.",
+        type=check_positive_int,
+        default=1000000,
+        metavar=("N_POINTS"),
+    )
+    viz_args.add_argument(
+        "--viz-centroids",
+        "--viz_centroids",
+        help="Draw QuickBundles centroids of the original bundle instead of a subsample when it exceeds --viz-max-points.",
+        default=False,
+        action="store_true",
+    )
+    viz_args.add_argument(
+        "--viz-views",
+        "--viz_views",
+        help="Comma delimited list (no spaces) of camera views to save from one built scene, among lh, rh, axial, and coronal. Overrides --camera-angle. Each view is saved as its own image unless --viz-mosaic is used.",
+        metavar=("VIEW1,VIEW2..."),
+    )
+    viz_args.add_argument(
+        "--viz-mosaic",
+        "--viz_mosaic",
+        help="Tile all --viz-views into a single image.",
+        default=False,
+        action="store_true",
+    )
 
     return parser
 
@@ -417,6 +536,7 @@ def main():
         fs_dir=args.fs_dir,
         # fs_license=args.fs_license,
         projfrac_params=args.projfrac_params,
+        projection_method=args.projection_method,
         fivett=args.fivett,
         gmwmi_thresh=args.gmwmi_thresh,
         skip_fivett_registration=args.skip_fivett_registration,
@@ -436,6 +556,11 @@ def main():
         wmfod=args.wmfod,
         n_streamlines=args.n_streamlines,
         tckgen_params=args.tckgen_params,
+        n_shards=args.n_shards,
+        nthreads=args.nthreads,
+        tckgen_seed=args.tckgen_seed,
+        max_seeds=args.max_seeds,
+        time_limit=args.time_limit,
         make_viz=args.make_viz,
         interactive_viz=args.interactive_viz,
         img_viz=args.img_viz,
@@ -448,4 +573,15 @@ def main():
         axial_offset=args.axial_offset,
         saggital_offset=args.saggital_offset,
         camera_angle=args.camera_angle,
+        viz_max_points=args.viz_max_points,
+        viz_centroids=args.viz_centroids,
+        viz_views=args.viz_views,
+        viz_mosaic=args.viz_mosaic,
+        log_dir=args.log_dir,
+        dry_run=args.dry_run,
+        profile_dir=args.profile,
+        trx=args.trx or args.trx_float16,
+        trx_float16=args.trx_float16,
+        assignments_text=args.assignments_text,
+        pial_exclusion=args.pial_exclusion,
     )
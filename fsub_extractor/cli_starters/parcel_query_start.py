@@ -0,0 +1,122 @@
+import argparse
+import os.path as op
+from pathlib import Path
+from fsub_extractor.utils.streamline_utils import extract_parcel_bundle
+
+# Add input arguments
+def get_parser():
+
+    parser = argparse.ArgumentParser(
+        description="Extracts the streamlines between parcels of an atlas from a parcel index made by 'atlas_connectome', by index lookup rather than a pass over the whole tract file."
+    )
+    parser.add_argument(
+        "--index",
+        help="Path to parcel index (_desc-parcelindex.npz) made by 'atlas_connectome'.",
+        type=validate_file,
+        required=True,
+        metavar=("/PATH/TO/PARCELINDEX.npz"),
+        action=CheckExt({".npz"}),
+    )
+    parser.add_argument(
+        "--nodes",
+        help="Comma delimited list (no spaces) of node labels. Without --to-nodes, streamlines with both ends among these nodes are extracted (include 0 to also keep streamlines with one unassigned end).",
+        type=node_list,
+        required=True,
+        metavar=("NODE1,NODE2..."),
+    )
+    parser.add_argument(
+        "--to-nodes",
+        "--to_nodes",
+        help="Comma delimited list (no spaces) of node labels. If given, streamlines with one end among --nodes and the other among these nodes are extracted.",
+        type=node_list,
+        metavar=("NODE1,NODE2..."),
+    )
+    parser.add_argument(
+        "--tract",
+        help="Path to the tract file (.tck) the index was made from. Default is the path recorded in the index.",
+        type=validate_file,
+        metavar=("/PATH/TO/TRACT.tck"),
+        action=CheckExt({".tck"}),
+    )
+    parser.add_argument(
+        "--out-file",
+        "--out_file",
+        help="Path to output tract file (.tck).",
+        type=op.abspath,
+        required=True,
+        metavar=("/PATH/TO/OUT.tck"),
+    )
+    parser.add_argument(
+        "--keep-self",
+        "--keep_self",
+        help="Also extract streamlines with both ends in the same node.",
+        default=False,
+        action="store_true",
+    )
+    parser.add_argument(
+        "--overwrite",
+        help="Whether to overwrite outputs. Default is to overwrite.",
+        default=True,
+        action=argparse.BooleanOptionalAction,
+    )
+
+    return parser
+
+
+# Check that files exist
+def validate_file(arg):
+    if (file := Path(arg)).is_file():
+        return op.abspath(file)
+    else:
+        raise FileNotFoundError(arg)
+
+
+# Function for checking file extensions
+def CheckExt(choices):
+    class Act(argparse.Action):
+        def __call__(self, parser, namespace, fname, option_string=None):
+            file_has_valid_ext = False
+            for choice in choices:
+                len_ext = len(choice)
+                if fname[(-1 * len_ext) :] == choice:
+                    file_has_valid_ext = True
+                    break
+
+            if file_has_valid_ext == False:
+                option_string = "({})".format(option_string) if option_string else ""
+                parser.error(
+                    "file doesn't end with one of {}{}".format(choices, option_string)
+                )
+            else:
+                setattr(namespace, self.dest, fname)
+
+    return Act
+
+
+# Parse a comma delimited list of node labels
+def node_list(arg):
+    try:
+        return [int(node) for node in arg.split(",")]
+    except ValueError:
+        raise argparse.ArgumentTypeError("%s is not a list of node labels" % arg)
+
+
+def main():
+
+    # Parse arguments and run the main code
+    parser = get_parser()
+    args = parser.parse_args()
+
+    if op.splitext(args.out_file)[-1] != ".tck":
+        parser.error("--out-file should be a .tck file.")
+
+    out_file, n_streamlines = extract_parcel_bundle(
+        args.index,
+        args.out_file,
+        args.nodes,
+        to_nodes=args.to_nodes,
+        tck_file=args.tract,
+        keep_self=args.keep_self,
+        overwrite=args.overwrite,
+    )
+    print(f"\n Extracted {n_streamlines} streamlines to {out_file} \n")
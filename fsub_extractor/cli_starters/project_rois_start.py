@@ -0,0 +1,120 @@
+import argparse
+import os
+import os.path as op
+from fsub_extractor.utils.froi_utils import project_rois_batch
+
+# Add input arguments
+def get_parser():
+
+    parser = argparse.ArgumentParser(
+        description="Projects many surface ROIs (.label, .gii, .mgz) into white matter in a single pass, producing one labelled volume (or a 4D stack)."
+    )
+    parser.add_argument(
+        "--subject",
+        help="Subject name. This must match the subject name in the FreeSurfer folder.",
+        required=True,
+        metavar=("sub-XXX"),
+    )
+    parser.add_argument(
+        "--rois",
+        help="Comma delimited list (no spaces) of paths to surface ROI files (.label, .gii, or .mgz).",
+        required=True,
+        metavar=("/PATH/TO/ROI1.label,/PATH/TO/ROI2.label..."),
+    )
+    parser.add_argument(
+        "--roi-names",
+        "--roi_names",
+        help="Comma delimited list (no spaces) of names for the ROIs. Default is roi1,roi2,...",
+        metavar=("ROI1,ROI2..."),
+    )
+    parser.add_argument(
+        "--hemis",
+        help="Comma delimited list (no spaces) of hemispheres ('lh' or 'rh') for each ROI. A single hemisphere applies to all ROIs.",
+        required=True,
+        metavar=("lh,rh..."),
+    )
+    parser.add_argument(
+        "--fs-dir",
+        "--fs_dir",
+        help="Path to FreeSurfer subjects directory. It should have a folder in it with your subject name. If not specified, will be inferred from environment (e.g., `echo $SUBJECTS_DIR`).",
+        type=op.abspath,
+        default=os.getenv("SUBJECTS_DIR"),
+        metavar=("/PATH/TO/FreeSurfer/SUBJECTSDIR/"),
+    )
+    parser.add_argument(
+        "--projfrac-params",
+        "--projfrac_params",
+        help="Comma delimited list (no spaces) of projfrac parameters. Provided as start,stop,delta. Default is --projfrac-params='-1,0,0.05'. Start must be negative to project into white matter.",
+        default="-1,0,0.05",
+        metavar=("START,STOP,DELTA"),
+    )
+    parser.add_argument(
+        "--atlas-name",
+        "--atlas_name",
+        help="Label for the projected ROI volume in file names. Default is rois.",
+        default="rois",
+    )
+    parser.add_argument(
+        "--stack",
+        help="Save a 4D volume with one binary ROI per volume, instead of a 3D volume where ROI N has value N. Use this if ROIs overlap.",
+        default=False,
+        action="store_true",
+    )
+    parser.add_argument(
+        "--out-dir",
+        "--out_dir",
+        help="Directory where outputs will be stored (a subject-folder will be created there if it does not exist).",
+        type=op.abspath,
+        default=os.getcwd(),
+        metavar=("/PATH/TO/OUTDIR/"),
+    )
+    parser.add_argument(
+        "--overwrite",
+        help="Whether to overwrite outputs. Default is to overwrite.",
+        default=True,
+        action=argparse.BooleanOptionalAction,
+    )
+
+    return parser
+
+
+def main():
+
+    # Parse arguments and run the main code
+    parser = get_parser()
+    args = parser.parse_args()
+
+    rois = [op.abspath(roi) for roi in args.rois.split(",")]
+    if args.roi_names == None:
+        roi_names = [f"roi{i + 1}" for i in range(len(rois))]
+    else:
+        roi_names = args.roi_names.split(",")
+    hemis = args.hemis.split(",")
+    if len(hemis) == 1:
+        hemis = hemis * len(rois)
+    if len(hemis) != len(rois):
+        parser.error("--hemis must have one entry, or one entry per ROI.")
+    projfrac_params = args.projfrac_params.split(",")
+    if len(projfrac_params) != 3:
+        parser.error("--projfrac-params should be provided as start,stop,delta.")
+
+    # Create output directories
+    anat_out_dir = op.join(args.out_dir, args.subject, "anat")
+    func_out_dir = op.join(args.out_dir, args.subject, "func")
+    os.makedirs(anat_out_dir, exist_ok=True)
+    os.makedirs(func_out_dir, exist_ok=True)
+
+    # Run function
+    main = project_rois_batch(
+        rois_in=rois,
+        roi_names=roi_names,
+        hemis=hemis,
+        fs_dir=args.fs_dir,
+        subject=args.subject,
+        outdir=func_out_dir,
+        atlas_name=args.atlas_name,
+        projfrac_params=projfrac_params,
+        stack=args.stack,
+        cache_dir=anat_out_dir,
+        overwrite=args.overwrite,
+    )
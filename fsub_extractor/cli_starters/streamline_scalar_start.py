@@ -84,6 +84,18 @@ def get_parser():
         default=True,
         action=argparse.BooleanOptionalAction,
     )
+    parser.add_argument(
+        "--profile",
+        help="Directory to save Python-side profiles of each stage to: cProfile call statistics (.pstats) and the largest memory allocations (_memory.txt), plus a summary table printed at the end. Profiling slows down the Python portions. Default is not to profile.",
+        type=op.abspath,
+        metavar=("/PATH/TO/PROFILEDIR/"),
+    )
+    parser.add_argument(
+        "--trx",
+        help="Also save the tract as a TRX file (streamline_means.trx) with the per-streamline mean of every scalar attached. Needs the trx-python package.",
+        default=False,
+        action="store_true",
+    )
 
     return parser
 
@@ -143,4 +155,6 @@ def main():
         out_prefix=args.out_prefix,
         overwrite=args.overwrite,
         n_points=args.n_points,
+        profile_dir=args.profile,
+        trx=args.trx,
     )
@@ -0,0 +1,134 @@
+import argparse
+import csv
+import os
+import os.path as op
+from fsub_extractor.utils.fury_viz import CAMERA_VIEWS, render_sub_bundles_batch
+
+# Add input arguments
+def get_parser():
+
+    parser = argparse.ArgumentParser(
+        description="Renders sub-bundle QC images for many subjects offscreen, reusing one renderer per process."
+    )
+    parser.add_argument(
+        "--manifest",
+        help="Tab-separated file with one row per image set. Required columns: fsub_bundle, ref_anat, roi1, out_prefix. Optional columns: orig_bundle, roi2. Relative paths are taken relative to the manifest. Images are saved to {out_prefix}_view-{view}.png.",
+        type=op.abspath,
+        required=True,
+        metavar=("/PATH/TO/MANIFEST.tsv"),
+    )
+    parser.add_argument(
+        "--views",
+        help="Comma delimited list (no spaces) of camera views to render for every row. Default is lh,rh,axial.",
+        default="lh,rh,axial",
+        metavar=("VIEW1,VIEW2..."),
+    )
+    parser.add_argument(
+        "--n-procs",
+        "--n_procs",
+        help="Number of rendering processes. Default is 1.",
+        type=check_positive_int,
+        default=1,
+    )
+    parser.add_argument(
+        "--size",
+        help="Image size in pixels, as width,height. Default is 1200,900.",
+        default="1200,900",
+        metavar=("WIDTH,HEIGHT"),
+    )
+    parser.add_argument(
+        "--mosaic",
+        help="Tile all views of a row into a single image, {out_prefix}_view-mosaic.png.",
+        default=False,
+        action="store_true",
+    )
+    parser.add_argument(
+        "--show-anat",
+        "--show_anat",
+        help="Whether to show anatomical image slices.",
+        default=False,
+        action="store_true",
+    )
+    parser.add_argument(
+        "--orig-max-points",
+        "--orig_max_points",
+        help="Maximum number of streamline points drawn for each original bundle. Larger bundles are compressed and subsampled to fit. Default is 1000000.",
+        type=check_positive_int,
+        default=1000000,
+        metavar=("N_POINTS"),
+    )
+    parser.add_argument(
+        "--overwrite",
+        help="Whether to overwrite existing images. Default is to overwrite.",
+        default=True,
+        action=argparse.BooleanOptionalAction,
+    )
+    parser.add_argument(
+        "--profile",
+        help="Directory to save Python-side profiles of building and rendering each row to: cProfile call statistics (.pstats) and the largest memory allocations (_memory.txt), plus a summary table. With --n-procs above 1, each worker saves to its own subfolder. Default is not to profile.",
+        type=op.abspath,
+        metavar=("/PATH/TO/PROFILEDIR/"),
+    )
+
+    return parser
+
+
+def check_positive_int(value):
+    value = int(value)
+    if value <= 0:
+        raise argparse.ArgumentTypeError("%s is not positive" % value)
+    return value
+
+
+def main():
+
+    # Parse arguments and run the main code
+    parser = get_parser()
+    args = parser.parse_args()
+
+    views = args.views.split(",")
+    for view in views:
+        if view not in CAMERA_VIEWS:
+            parser.error(
+                f"Unknown view {view}. Views must be among {', '.join(CAMERA_VIEWS)}."
+            )
+    size = [int(dim) for dim in args.size.split(",")]
+    if len(size) != 2:
+        parser.error("--size should be provided as width,height.")
+
+    manifest_dir = op.dirname(args.manifest)
+    with open(args.manifest, newline="") as f:
+        rows = list(csv.DictReader(f, delimiter="\t"))
+
+    jobs = []
+    for row in rows:
+        job = {"show_anat": args.show_anat, "orig_max_points": args.orig_max_points}
+        for column in ["fsub_bundle", "ref_anat", "roi1", "out_prefix", "orig_bundle", "roi2"]:
+            value = row.get(column)
+            if value in [None, ""]:
+                if column in ["fsub_bundle", "ref_anat", "roi1", "out_prefix"]:
+                    raise Exception(f"Manifest row {row} is missing {column}.")
+                continue
+            value = op.join(manifest_dir, value)
+            if column == "out_prefix":
+                job["fname_base"] = value
+            else:
+                job[column] = value
+        out_views = ["mosaic"] if args.mosaic else views
+        if args.overwrite == False and all(
+            op.exists(f"{job['fname_base']}_view-{view}.png") for view in out_views
+        ):
+            print(f"Images for {job['fname_base']} exist, skipping.")
+            continue
+        os.makedirs(op.dirname(job["fname_base"]), exist_ok=True)
+        jobs += [job]
+
+    # Run function
+    render_sub_bundles_batch(
+        jobs,
+        views=views,
+        n_procs=args.n_procs,
+        size=tuple(size),
+        mosaic=args.mosaic,
+        profile_dir=args.profile,
+    )
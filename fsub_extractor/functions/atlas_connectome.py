@@ -0,0 +1,240 @@
+import os
+import os.path as op
+import numpy as np
+import nibabel as nib
+from fsub_extractor.utils.system_utils import (
+    run_command,
+    overwrite_check,
+    find_program,
+    set_profile_dir,
+    profile_stage,
+    print_profile_summary,
+)
+from fsub_extractor.utils.froi_utils import label_rois
+from fsub_extractor.utils.streamline_utils import (
+    trk_to_tck,
+    endpoint_voxel_map,
+    assign_endpoints,
+    read_assignments,
+    save_assignments,
+    build_parcel_index,
+    load_sift2_weights,
+    tck_streamline_lengths,
+    connectome_edges,
+    save_connectome,
+)
+
+
+def atlas_connectome(
+    subject,
+    tract,
+    out_dir,
+    out_prefix,
+    overwrite,
+    atlas=None,
+    rois=None,
+    node_names=None,
+    search_dist="2.0",
+    search_type="radial",
+    sift2_weights=None,
+    save_text=False,
+    profile_dir=None,
+):
+
+    """Creates the full node-by-node connectome of a tractogram for an atlas of any number of ROIs,
+    assigning streamlines to nodes with a single tck2connectome run (or, for search_type "end",
+    with the cached endpoint voxels of the tractogram; see endpoint_voxel_map)
+    Parameters
+    ==========
+    subject name: str
+        Subject name
+    tract: str
+        Path to tract input (.tck or .trk)
+    out_dir: str
+        Path to output directory
+    out_prefix: str
+        What to prepend to output names
+    overwrite: bool
+        Whether to overwrite existing files
+    atlas: str
+        Path to atlas-like image, with each node labelled by a different integer (1 to N)
+    rois: str
+        Comma-delimited paths of ROI masks (.nii.gz) to use as nodes 1 to N instead of an atlas
+    node_names: str
+        Comma-delimited names of the nodes
+    search_dist: str
+        How far to search ahead of streamlines for ROIs, in mm
+    search_type: str
+        Method of searching for streamlines (forward, reverse, radial, end, or all)
+    sift2_weights: str
+        Path to SIFT2 weights file of the tractogram
+    save_text: bool
+        Whether to also save each matrix as text, in tck2connectome's layout
+    profile_dir: str
+        If given, profile each stage and save the profiles here (see profile_stage)
+
+    Outputs
+    =======
+    Function saves out:
+        _desc-atlas.nii.gz file with the merged ROIs (if rois are given)
+        _desc-assignments.npz file with the node assignments of each streamline (see read_assignments)
+        _desc-parcelindex.npz file with the streamlines of every node pair (see query_parcel_index)
+        _desc-connectome.npz file with the streamline count, mean length (mm) and summed SIFT2 weight
+        (if SIFT2 weights are given) of every connected node pair (see load_connectome)
+        _desc-{measure}_connectome.csv files with each full matrix (if save_text is True)
+    """
+
+    ### Check for assertion errors ###
+    if (atlas == None) == (rois == None):
+        raise Exception("Exactly one of an atlas or a list of ROIs must be given.")
+    if op.exists(tract) == False:
+        raise Exception(f"Tract file {tract} is not found on the system.")
+    if tract[-4:] not in [".trk", ".tck"]:
+        raise Exception(f"Tract file {tract} is not of a supported file type.")
+    if rois != None:
+        roi_list = [op.abspath(roi) for roi in rois.split(",")]
+        for roi in roi_list:
+            if op.exists(roi) == False:
+                raise Exception(f"ROI {roi} not found on the system.")
+    elif op.exists(atlas) == False:
+        raise Exception(f"Atlas {atlas} not found on the system.")
+    if sift2_weights != None and op.exists(sift2_weights) == False:
+        raise Exception(f"SIFT2 weights file {sift2_weights} not found on the system.")
+    if op.isdir(out_dir) == False:
+        raise Exception(f"Output directory {out_dir} not found on the system.")
+    # Profile the Python side of each stage if requested
+    if profile_dir != None:
+        set_profile_dir(profile_dir)
+
+    ### Prepare output directories ###
+    # Add an underscore to separate prefix from file names if a prefix is specified
+    if len(out_prefix) > 0:
+        if out_prefix[-1] != "_":
+            out_prefix += "_"
+    dwi_out_dir = op.join(out_dir, subject, "dwi")
+    os.makedirs(dwi_out_dir, exist_ok=True)
+    outpath_base = op.join(dwi_out_dir, f"{subject}_{out_prefix}")
+
+    # Convert tract to .tck if needed
+    if tract[-4:] == ".trk":
+        print("\n Converting .trk to .tck \n")
+        with profile_stage("trk_conversion"):
+            tck_file = trk_to_tck(tract, dwi_out_dir, overwrite=overwrite)
+    else:
+        tck_file = tract
+
+    # Merge the ROIs into one atlas, numbered in the order given
+    if rois != None:
+        print("\n Merging ROIs into an atlas \n")
+        with profile_stage("roi_labelling"):
+            atlas = label_rois(roi_list, outpath_base + "desc-atlas.nii.gz", overwrite=overwrite)
+
+    def check_nodes(n_nodes, node_names):
+        if n_nodes < 1:
+            raise Exception(f"Atlas {atlas} has no labelled voxels.")
+        if node_names == None:
+            return None
+        node_names = node_names.split(",")
+        if len(node_names) != n_nodes:
+            raise Exception(
+                f"Number of node names ({len(node_names)}) does not match the number of nodes ({n_nodes})."
+            )
+        return node_names
+
+    # nibabel cannot read .mif, so the node count of a .mif atlas comes from tck2connectome below
+    n_nodes = None
+    if atlas[-4:] != ".mif":
+        n_nodes = int(np.asanyarray(nib.load(atlas).dataobj).max())
+        node_names = check_nodes(n_nodes, node_names)
+
+    ### Assign every streamline to nodes
+    print("\n Assigning streamlines to nodes \n")
+    if overwrite == False:
+        overwrite_check(outpath_base + "desc-assignments.npz")
+    if search_type == "end" and atlas[-4:] != ".mif":
+        # Endpoint voxels are cached per tractogram and grid, so new atlases skip the tractogram
+        with profile_stage("assignments"):
+            assignments = assign_endpoints(
+                endpoint_voxel_map(tck_file, atlas, cache_dir=dwi_out_dir), atlas
+            )
+    else:
+        # A single tck2connectome run
+        tck2connectome = find_program("tck2connectome")
+        tck2connectome_connectome_out = outpath_base + "desc-tck2connectome.txt"
+        tck2connectome_assignments_out = outpath_base + "desc-assignments.txt"
+        cmd_tck2connectome = [
+            tck2connectome,
+            tck_file,
+            atlas,
+            tck2connectome_connectome_out,
+            "-out_assignments",
+            tck2connectome_assignments_out,
+        ]
+        if search_type == "end" or search_type == "all":
+            cmd_tck2connectome += [f"-assignment_{search_type}_voxels"]
+        else:
+            cmd_tck2connectome += [f"-assignment_{search_type}_search", search_dist]
+        if overwrite:
+            cmd_tck2connectome += ["-force"]
+        else:
+            overwrite_check(tck2connectome_connectome_out)
+            overwrite_check(tck2connectome_assignments_out)
+        run_command(cmd_tck2connectome)
+
+        with profile_stage("assignments"):
+            assignments = read_assignments(tck2connectome_assignments_out)
+            if n_nodes == None:
+                n_nodes = np.loadtxt(tck2connectome_connectome_out, ndmin=2).shape[0]
+            # Every measure is computed from the assignments, so the text outputs are not kept
+            os.remove(tck2connectome_assignments_out)
+            os.remove(tck2connectome_connectome_out)
+    if atlas[-4:] == ".mif":
+        node_names = check_nodes(n_nodes, node_names)
+    save_assignments(assignments, outpath_base + "desc-assignments.npz", overwrite=overwrite)
+    # Streamline lists per node pair, for querying sub-bundles later (see extract_parcel_bundle)
+    with profile_stage("parcel_index"):
+        build_parcel_index(
+            assignments,
+            outpath_base + "desc-parcelindex.npz",
+            tck_file=tck_file,
+            overwrite=overwrite,
+        )
+
+    ### Summarize every connected node pair
+    with profile_stage("streamline_lengths"):
+        lengths = tck_streamline_lengths(tck_file)
+    weights = None
+    if sift2_weights != None:
+        with profile_stage("sift2_weights"):
+            weights = load_sift2_weights(sift2_weights)
+    with profile_stage("connectome"):
+        edges = connectome_edges(assignments, weights=weights, lengths=lengths)
+        connectome_out = save_connectome(
+            edges,
+            n_nodes,
+            outpath_base + "desc-connectome.npz",
+            node_names=node_names,
+            overwrite=overwrite,
+        )
+
+    if save_text:
+        edge_rows = edges["edges"][:, 0] - 1
+        edge_cols = edges["edges"][:, 1] - 1
+        for measure in ["count", "sift2_weight", "mean_length"]:
+            if measure not in edges:
+                continue
+            text_out = outpath_base + f"desc-{measure.replace('_', '')}_connectome.csv"
+            if overwrite == False:
+                overwrite_check(text_out)
+            matrix = np.zeros((n_nodes, n_nodes))
+            matrix[edge_rows, edge_cols] = edges[measure]
+            np.savetxt(text_out, matrix, fmt="%.9g", delimiter=",")
+
+    print(
+        f"\n {len(edges['count'])} connected node pairs among {n_nodes} nodes ({edges['count'].sum()} of {len(assignments)} streamlines) \n"
+    )
+    print("\n The connectome is located at " + connectome_out + ".\n")
+
+    print_profile_summary()
+
+    print("\n DONE \n")
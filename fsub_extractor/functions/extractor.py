@@ -1,10 +1,18 @@
 import os.path as op
+import threading
 import warnings
+from concurrent.futures import ThreadPoolExecutor
 from numpy import unique
 from fsub_extractor.utils.anat_utils import *
 from fsub_extractor.utils.system_utils import *
 from fsub_extractor.utils.froi_utils import *
 from fsub_extractor.utils.streamline_utils import *
+from fsub_extractor.functions.planner import (
+    plan_extractor,
+    missing_programs,
+    missing_inputs,
+    print_plan,
+)
 
 
 def extractor(
@@ -20,6 +28,7 @@ def extractor(
     fs_dir,
     # fs_license,
     projfrac_params,
+    projection_method,
     fivett,
     gmwmi_thresh,
     skip_fivett_registration,
@@ -39,6 +48,11 @@ def extractor(
     wmfod,
     n_streamlines,
     tckgen_params,
+    n_shards,
+    nthreads,
+    tckgen_seed,
+    max_seeds,
+    time_limit,
     make_viz,
     interactive_viz,
     img_viz,
@@ -51,6 +65,17 @@ def extractor(
     axial_offset,
     saggital_offset,
     camera_angle,
+    viz_max_points=1000000,
+    viz_centroids=False,
+    viz_views=None,
+    viz_mosaic=False,
+    log_dir=None,
+    dry_run=False,
+    profile_dir=None,
+    trx=False,
+    trx_float16=False,
+    assignments_text=False,
+    pial_exclusion=False,
 ):
     # Force start log outputs on new line
     print("\n")
@@ -92,9 +117,18 @@ def extractor(
     if hemi != None:
         hemi_list = hemi.split(",")
 
-    # If ROIs are to be projected or 5TT/GMWMI created, make sure FreeSurfer directory exists
-    if skip_roi_projection == False or (
-        fivett == None and (skip_gmwmi_intersection == False or generate == True)
+    # The pial exclusion mask only applies to streamline generation
+    if pial_exclusion and generate == False:
+        warnings.warn(
+            "--pial-exclusion only applies with --generate, so it will be ignored."
+        )
+        pial_exclusion = False
+
+    # If ROIs are to be projected, 5TT/GMWMI created or the pial surface masked, make sure FreeSurfer directory exists
+    if (
+        skip_roi_projection == False
+        or (fivett == None and (skip_gmwmi_intersection == False or generate == True))
+        or pial_exclusion
     ):
         if op.isfile(op.join(fs_dir, subject, "surf", "lh.white")) == False:
             raise Exception(
@@ -155,8 +189,63 @@ def extractor(
 
     # XX. Make sure FS license is valid [TODO: HOW??]
 
+    # Build the processing plan, and make sure every program it needs is installed
+    plan = plan_extractor(
+        subject=subject,
+        tract=tract,
+        generate=generate,
+        tract_name=tract_name,
+        roi1=roi1,
+        roi1_name=roi1_name,
+        roi2=roi2,
+        roi2_name=roi2_name,
+        hemi_list=hemi.split(",") if hemi != None else ["lh"],
+        fs_dir=fs_dir,
+        projection_method=projection_method,
+        fivett=fivett,
+        skip_fivett_registration=skip_fivett_registration,
+        skip_roi_projection=skip_roi_projection,
+        skip_gmwmi_intersection=skip_gmwmi_intersection,
+        out_dir=out_dir,
+        reg=reg,
+        reg_type=reg_type,
+        reg_invert=reg_invert,
+        exclude_mask=exclude_mask,
+        include_mask=include_mask,
+        sift2_weights=sift2_weights,
+        wmfod=wmfod,
+        n_streamlines=n_streamlines,
+        nthreads=nthreads,
+        make_viz=make_viz,
+        search_type=search_type,
+        streamline_mask=streamline_mask,
+        pial_exclusion=pial_exclusion,
+        n_shards=n_shards,
+    )
+    if dry_run:
+        print_plan(plan)
+        return plan
+    missing = missing_programs(plan)
+    if len(missing) > 0:
+        raise Exception(
+            f"Programs needed for this run could not be found in PATH: {', '.join(missing)}. Use --dry-run to see the full plan."
+        )
+    missing = missing_inputs(plan)
+    if len(missing) > 0:
+        raise Exception(
+            f"Input files needed for this run could not be found: {', '.join(missing)}. Use --dry-run to see the full plan."
+        )
+
     ### Pre-checks are over, begin the processing!
 
+    # Save the output of each external command to its own log file if requested
+    if log_dir != None:
+        set_command_log_dir(log_dir)
+
+    # Profile the Python side of each stage if requested
+    if profile_dir != None:
+        set_profile_dir(profile_dir)
+
     # Make output folders if they do not exist, and define the naming convention
     anat_out_dir = op.join(out_dir, subject, "anat")
     dwi_out_dir = op.join(out_dir, subject, "dwi")
@@ -206,104 +295,67 @@ def extractor(
 
     if skip_gmwmi_intersection == False or generate == True:
         print("\n Running GMWMI creation workflow \n")
-        (fivett, gmwmi, gmwmi_bin) = anat_to_gmwmi(
-            op.join(fs_dir, subject),
-            anat_out_dir,
-            threshold=gmwmi_thresh,
-            subject=subject,
-            fivett=fivett,
-            space_label=anat_space_label,
-            overwrite=overwrite,
-        )
+        with profile_stage("gmwmi"):
+            (fivett, gmwmi, gmwmi_bin) = anat_to_gmwmi(
+                op.join(fs_dir, subject),
+                anat_out_dir,
+                threshold=gmwmi_thresh,
+                subject=subject,
+                fivett=fivett,
+                space_label=anat_space_label,
+                overwrite=overwrite,
+            )
 
     # Register 5TT / GMWMI to DWI space if needed
     if skip_fivett_registration == False and reg != None:
         print("\n Registering 5TT and GMWMI to DWI space \n")
-        fivett = register_to_dwi(
-            fivett,
-            op.join(out_dir, subject, "anat", f"{subject}_space-DWI_desc-5tt.nii.gz"),
-            reg,
-            invert=reg_invert,
-            overwrite=True,
-        )
-        gmwmi = register_to_dwi(
-            gmwmi,
-            gmwmi.replace("space-FS", "space-DWI"),
-            reg,
-            invert=reg_invert,
-            overwrite=True,
-        )
-        gmwmi_bin = register_to_dwi(
-            gmwmi_bin,
-            gmwmi_bin.replace("space-FS", "space-DWI"),
-            reg,
-            invert=reg_invert,
-            interp="nearest",
-            overwrite=True,
-        )
+        with profile_stage("anat_registration"):
+            fivett = register_to_dwi(
+                fivett,
+                op.join(out_dir, subject, "anat", f"{subject}_space-DWI_desc-5tt.nii.gz"),
+                reg,
+                invert=reg_invert,
+                overwrite=True,
+            )
+            gmwmi = register_to_dwi(
+                gmwmi,
+                gmwmi.replace("space-FS", "space-DWI"),
+                reg,
+                invert=reg_invert,
+                overwrite=True,
+            )
+            gmwmi_bin = register_to_dwi(
+                gmwmi_bin,
+                gmwmi_bin.replace("space-FS", "space-DWI"),
+                reg,
+                invert=reg_invert,
+                interp="nearest",
+                overwrite=True,
+            )
 
     ### Project the ROI(s) into the white matter and intersect with GMWMI ###
-    if skip_roi_projection == False:
-        print(f"\n Projecting {roi1_name} into white matter \n")
-        roi1_projected = project_roi(
-            roi_in=roi1,
-            roi_name=roi1_name,
-            fs_dir=fs_dir,
-            subject=subject,
-            hemi=hemi_list[0],
-            outdir=func_out_dir,
-            projfrac_params=projfrac_params_list,
-            overwrite=overwrite,
-        )
-    else:
-        print(f"\n Skipping {roi1_name} projection \n")
-        roi1_projected = roi1
-    if reg != None:
-        registed_roi_name = roi1_projected.replace("space-FS", "space-DWI")
-        roi1_projected = register_to_dwi(
-            roi1_projected,
-            registed_roi_name,
-            reg,
-            invert=reg_invert,
-            interp="nearest",
-            overwrite=True,
-        )
-    if skip_gmwmi_intersection == False:
-        print(f"\n Intersecting {roi1_name} with GMWMI \n")
-        roi1_projected = intersect_gmwmi(
-            roi_in=roi1_projected,
-            roi_name=roi1_name,
-            gmwmi=gmwmi_bin,
-            outpath_base=op.join(func_out_dir, subject),
-            overwrite=overwrite,
-        )
-
-    ### Process ROI2 the same way if specified ###
-    if two_rois == False:
-        rois_atlas_in = roi1_projected
-        rois_name = roi1_name
-        roi2_projected = None
-    else:
-        rois_name = f"{roi1_name}-{roi2_name}"
+    with profile_stage(f"roi_{roi1_name}"):
         if skip_roi_projection == False:
-            print(f"\n Projecting {roi2_name} into white matter \n")
-            roi2_projected = project_roi(
-                roi_in=roi2,
-                roi_name=roi2_name,
+            print(f"\n Projecting {roi1_name} into white matter \n")
+            roi1_projected = project_roi(
+                roi_in=roi1,
+                roi_name=roi1_name,
                 fs_dir=fs_dir,
                 subject=subject,
-                hemi=hemi_list[-1],
+                hemi=hemi_list[0],
                 outdir=func_out_dir,
                 projfrac_params=projfrac_params_list,
+                method=projection_method,
+                cache_dir=anat_out_dir,
                 overwrite=overwrite,
             )
         else:
-            print(f"\n Skipping {roi2_name} projection \n")
-            roi2_projected = roi2
+            print(f"\n Skipping {roi1_name} projection \n")
+            roi1_projected = roi1
         if reg != None:
-            registed_roi_name = roi2_projected.replace("space-FS", "space-DWI")
-            roi2_projected = register_to_dwi(
-                roi2_projected,
+            registed_roi_name = roi1_projected.replace("space-FS", "space-DWI")
+            roi1_projected = register_to_dwi(
+                roi1_projected,
                 registed_roi_name,
                 reg,
                 invert=reg_invert,
@@ -311,50 +363,120 @@ def extractor(
                 overwrite=True,
             )
         if skip_gmwmi_intersection == False:
-            print(f"\n Intersecting {roi2_name} with GMWMI \n")
-            roi2_projected = intersect_gmwmi(
-                roi_in=roi2_projected,
-                roi_name=roi2_name,
+            print(f"\n Intersecting {roi1_name} with GMWMI \n")
+            roi1_projected = intersect_gmwmi(
+                roi_in=roi1_projected,
+                roi_name=roi1_name,
                 gmwmi=gmwmi_bin,
                 outpath_base=op.join(func_out_dir, subject),
                 overwrite=overwrite,
             )
 
+    ### Process ROI2 the same way if specified ###
+    if two_rois == False:
+        rois_atlas_in = roi1_projected
+        rois_name = roi1_name
+        roi2_projected = None
+    else:
+        rois_name = f"{roi1_name}-{roi2_name}"
+        with profile_stage(f"roi_{roi2_name}"):
+            if skip_roi_projection == False:
+                print(f"\n Projecting {roi2_name} into white matter \n")
+                roi2_projected = project_roi(
+                    roi_in=roi2,
+                    roi_name=roi2_name,
+                    fs_dir=fs_dir,
+                    subject=subject,
+                    hemi=hemi_list[-1],
+                    outdir=func_out_dir,
+                    projfrac_params=projfrac_params_list,
+                    method=projection_method,
+                    cache_dir=anat_out_dir,
+                    overwrite=overwrite,
+                )
+            else:
+                print(f"\n Skipping {roi2_name} projection \n")
+                roi2_projected = roi2
+            if reg != None:
+                registed_roi_name = roi2_projected.replace("space-FS", "space-DWI")
+                roi2_projected = register_to_dwi(
+                    roi2_projected,
+                    registed_roi_name,
+                    reg,
+                    invert=reg_invert,
+                    interp="nearest",
+                    overwrite=True,
+                )
+            if skip_gmwmi_intersection == False:
+                print(f"\n Intersecting {roi2_name} with GMWMI \n")
+                roi2_projected = intersect_gmwmi(
+                    roi_in=roi2_projected,
+                    roi_name=roi2_name,
+                    gmwmi=gmwmi_bin,
+                    outpath_base=op.join(func_out_dir, subject),
+                    overwrite=overwrite,
+                )
+
         ### Merge ROIS ###
         print("\n Merging ROIs \n")
-        rois_atlas_in = merge_rois(
-            roi1=roi1_projected,
-            roi2=roi2_projected,
-            out_file=op.join(
-                func_out_dir, f"{subject}_rec-merged_desc-{roi1_name}{roi2_name}.nii.gz"
-            ),
-            overwrite=overwrite,
-        )
+        with profile_stage("roi_merging"):
+            rois_atlas_in = merge_rois(
+                roi1=roi1_projected,
+                roi2=roi2_projected,
+                out_file=op.join(
+                    func_out_dir, f"{subject}_rec-merged_desc-{roi1_name}{roi2_name}.nii.gz"
+                ),
+                overwrite=overwrite,
+            )
+
+    # Streamlines already loaded in this process, handed to visualization instead of re-reading files
+    orig_streamlines = None
+    fsub_streamlines = None
 
     ### Extract FSuB from tractogram
     if generate == False:
         ### Convert .trk to .tck if needed ###
         if op.splitext(tract)[-1] == ".trk":
             print("\n Converting .trk to .tck \n")
-            tck_file = trk_to_tck(tract, dwi_out_dir, overwrite=overwrite)
+            with profile_stage("trk_conversion"):
+                if make_viz:
+                    # Keep the loaded streamlines so visualization does not parse them again
+                    tck_file, orig_streamlines = trk_to_tck(
+                        tract, dwi_out_dir, overwrite=overwrite, return_streamlines=True
+                    )
+                else:
+                    tck_file = trk_to_tck(tract, dwi_out_dir, overwrite=overwrite)
         else:
             tck_file = tract
 
         ### Run MRtrix Tract Extraction ###
         print("\n Extracting the sub-bundle \n")
-        fsub_bundle = extract_tck_mrtrix(
-            tck_file,
-            rois_atlas_in,
-            outpath_base=op.join(dwi_out_dir, f"{subject}_{tract_name}_{rois_name}"),
-            two_rois=two_rois,
-            search_dist=search_dist,
-            search_type=search_type,
-            sift2_weights=sift2_weights,
-            exclude_mask=exclude_mask,
-            include_mask=include_mask,
-            streamline_mask=streamline_mask,
-            overwrite=overwrite,
-        )
+        with profile_stage("extraction"):
+            extracted = extract_tck_mrtrix(
+                tck_file,
+                rois_atlas_in,
+                outpath_base=op.join(dwi_out_dir, f"{subject}_{tract_name}_{rois_name}"),
+                two_rois=two_rois,
+                search_dist=search_dist,
+                search_type=search_type,
+                sift2_weights=sift2_weights,
+                exclude_mask=exclude_mask,
+                include_mask=include_mask,
+                streamline_mask=streamline_mask,
+                overwrite=overwrite,
+                trx=trx,
+                trx_float16=trx_float16,
+                assignments_text=assignments_text,
+                endpoint_cache_dir=dwi_out_dir,
+                return_streamlines=make_viz,
+            )
+        if make_viz:
+            # Hand the sub-bundle and the scanned tractogram to visualization instead of re-reading them
+            fsub_bundle, fsub_streamlines, tck_offsets = extracted
+            if orig_streamlines is None:
+                orig_streamlines = tck_offsets
+        else:
+            fsub_bundle = extracted
 
         print("\n The extracted tract is located at " + fsub_bundle + ".\n")
 
@@ -362,142 +484,197 @@ def extractor(
     else:
         tck_file = None  # No original streamline object (for visualization function)
 
-        ### Make a outer surface exclusion mask to make tractography more efficient (not sure if this helps, so not including now)
-        if False:
+        ### Make an outer surface exclusion mask, so streamlines leaving the brain are stopped early
+        pial_surf = None
+        if pial_exclusion:
             print(f"\n Getting pial surface")
-            pial_surf = get_pial_surf(
-                subject,
-                fs_dir,
-                surf_name="pial",
-                anat_out_dir=anat_out_dir,
-                overwrite=overwrite,
-            )
-
-            # Register pial surface if necessary
-            if reg != None:
-                pial_surf = register_to_dwi(
-                    pial_surf,
-                    pial_surf.replace("space-FS", "space-DWI"),
-                    reg,
-                    invert=reg_invert,
-                    overwrite=True,
+            with profile_stage("pial_exclusion"):
+                pial_surf = get_pial_surf(
+                    subject,
+                    fs_dir,
+                    surf_name="pial",
+                    anat_out_dir=anat_out_dir,
+                    method=projection_method,
+                    overwrite=overwrite,
                 )
 
-        print(f"\n Generating Sub-bundles \n")
+                # Register pial surface if necessary, reusing the registered mask if it is up to date
+                if reg != None:
+                    pial_surf_dwi = pial_surf.replace("space-FS", "space-DWI")
+                    if is_up_to_date(pial_surf_dwi, [pial_surf, reg]) == False:
+                        register_to_dwi(
+                            pial_surf,
+                            pial_surf_dwi,
+                            reg,
+                            invert=reg_invert,
+                            interp="nearest",
+                            overwrite=True,
+                        )
+                    pial_surf = pial_surf_dwi
 
-        if two_rois:
-            # Seed half of streamlines from each seed ROI
-            n_streamlines = int(n_streamlines / 2)
+        print(f"\n Generating Sub-bundles \n")
 
-            fsub_1_name = f"{subject}_space-DWI_from-{roi1_name}_to-{roi2_name}_desc-{tract_name}_fsub.tck"
-            fsub_2_name = f"{subject}_space-DWI_from-{roi2_name}_to-{roi1_name}_desc-{tract_name}_fsub.tck"
+        with profile_stage("generation"):
+            if nthreads == None:
+                nthreads = os.cpu_count() or 1
 
-            # Generate FSuB from 2nd ROI
-            fsub_gen_2 = generate_tck_mrtrix(
-                roi_begin=roi2_projected,
-                roi_end=roi1_projected,
+            # Options shared by both seeding directions
+            generate_kwargs = dict(
                 wmfod=wmfod,
                 fivett=fivett,
-                n_streamlines=n_streamlines,
-                outfile=op.join(dwi_out_dir, fsub_2_name),
-                # pial_exclusion_mask=pial_surf,
-                pial_exclusion_mask=None,
+                pial_exclusion_mask=pial_surf,
                 exclude_mask=exclude_mask,
                 include_mask=include_mask,
                 streamline_mask=streamline_mask,
                 tckgen_params=tckgen_params,
+                n_shards=n_shards,
+                time_limit=time_limit,
                 overwrite=overwrite,
             )
-        else:
-            fsub_1_name = (
-                f"{subject}_space-DWI_from-{roi1_name}_desc-{tract_name}_fsub.tck"
-            )
-            fsub_2_name = None
-
-        # Generate FSuB from 1st ROI
-        fsub_gen_1 = generate_tck_mrtrix(
-            roi_begin=roi1_projected,
-            roi_end=roi2_projected,
-            wmfod=wmfod,
-            fivett=fivett,
-            n_streamlines=n_streamlines,
-            outfile=op.join(dwi_out_dir, fsub_1_name),
-            # pial_exclusion_mask=pial_surf,
-            pial_exclusion_mask=None,
-            exclude_mask=exclude_mask,
-            include_mask=include_mask,
-            streamline_mask=streamline_mask,
-            tckgen_params=tckgen_params,
-            overwrite=overwrite,
-        )
 
-        if two_rois:
-            # Merge the tracks
-            fsub_bundle = op.join(
-                dwi_out_dir,
-                f"{subject}_space-DWI_from-{roi1_name}_to-{roi2_name}_desc-{tract_name}_desc-merged_fsub.tck",
-            )
-            tckedit = find_program("tckedit")
-            cmd_tckedit = [
-                tckedit,
-                fsub_gen_1,
-                fsub_gen_2,
-                fsub_bundle,
-            ]
-            run_command(cmd_tckedit)
-        else:
-            fsub_bundle = fsub_gen_1
+            if two_rois:
+                # Seed half of streamlines from each seed ROI
+                n_streamlines = int(n_streamlines / 2)
+                if max_seeds != None:
+                    max_seeds = max(1, max_seeds // 2)
+
+                fsub_1_name = f"{subject}_space-DWI_from-{roi1_name}_to-{roi2_name}_desc-{tract_name}_fsub.tck"
+                fsub_2_name = f"{subject}_space-DWI_from-{roi2_name}_to-{roi1_name}_desc-{tract_name}_fsub.tck"
+
+                # Generate FSuBs from both ROIs at the same time, splitting the thread budget.
+                # If one direction fails, the other is stopped instead of running to the end.
+                cancel_event = threading.Event()
+
+                def generate_or_cancel(**kwargs):
+                    try:
+                        return generate_tck_mrtrix(cancel_event=cancel_event, **kwargs)
+                    except CommandCancelledError:
+                        raise
+                    except BaseException:
+                        cancel_event.set()
+                        raise
+
+                with ThreadPoolExecutor(max_workers=2) as executor:
+                    future_gen_1 = executor.submit(
+                        generate_or_cancel,
+                        roi_begin=roi1_projected,
+                        roi_end=roi2_projected,
+                        n_streamlines=n_streamlines,
+                        outfile=op.join(dwi_out_dir, fsub_1_name),
+                        nthreads=max(1, nthreads // 2),
+                        seed=tckgen_seed,
+                        max_seeds=max_seeds,
+                        **generate_kwargs,
+                    )
+                    future_gen_2 = executor.submit(
+                        generate_or_cancel,
+                        roi_begin=roi2_projected,
+                        roi_end=roi1_projected,
+                        n_streamlines=n_streamlines,
+                        outfile=op.join(dwi_out_dir, fsub_2_name),
+                        nthreads=max(1, nthreads // 2),
+                        seed=None if tckgen_seed == None else tckgen_seed + n_shards,
+                        max_seeds=max_seeds,
+                        **generate_kwargs,
+                    )
+                    raise_first_error([future_gen_1.exception(), future_gen_2.exception()])
+                    fsub_gen_1 = future_gen_1.result()
+                    fsub_gen_2 = future_gen_2.result()
+            else:
+                fsub_1_name = (
+                    f"{subject}_space-DWI_from-{roi1_name}_desc-{tract_name}_fsub.tck"
+                )
+                fsub_2_name = None
+
+                # Generate FSuB from 1st ROI
+                fsub_gen_1 = generate_tck_mrtrix(
+                    roi_begin=roi1_projected,
+                    roi_end=roi2_projected,
+                    n_streamlines=n_streamlines,
+                    outfile=op.join(dwi_out_dir, fsub_1_name),
+                    nthreads=nthreads,
+                    seed=tckgen_seed,
+                    max_seeds=max_seeds,
+                    **generate_kwargs,
+                )
+
+            if two_rois:
+                # Merge the tracks
+                fsub_bundle = op.join(
+                    dwi_out_dir,
+                    f"{subject}_space-DWI_from-{roi1_name}_to-{roi2_name}_desc-{tract_name}_desc-merged_fsub.tck",
+                )
+                merge_tck_files([fsub_gen_1, fsub_gen_2], fsub_bundle, overwrite=overwrite)
+            else:
+                fsub_bundle = fsub_gen_1
+
+            if trx:
+                tck_to_trx(
+                    fsub_bundle,
+                    op.splitext(fsub_bundle)[0] + ".trx",
+                    roi1_projected,
+                    float16=trx_float16,
+                    overwrite=overwrite,
+                )
 
         print("\n The generated tract is located at " + fsub_bundle + ".\n")
 
     ### Visualize the outputs if requested ####
     if make_viz:
-        from fsub_extractor.utils.fury_viz import visualize_sub_bundles
-
-        # Convert color strings to lists
-        orig_color_list = [float(color) for color in orig_color.split(",")]
-        fsub_color_list = [float(color) for color in fsub_color.split(",")]
-        roi1_color_list = [float(color) for color in roi1_color.split(",")]
-        roi2_color_list = [float(color) for color in roi2_color.split(",")]
-
-        # Set reference / background image if it is specified
-        if img_viz == None:
-            ref_anat = gmwmi
-            show_anat = False
-        else:
-            ref_anat = img_viz
-            show_anat = True
+        with profile_stage("visualization"):
+            from fsub_extractor.utils.fury_viz import visualize_sub_bundles
+
+            # Convert color strings to lists
+            orig_color_list = [float(color) for color in orig_color.split(",")]
+            fsub_color_list = [float(color) for color in fsub_color.split(",")]
+            roi1_color_list = [float(color) for color in roi1_color.split(",")]
+            roi2_color_list = [float(color) for color in roi2_color.split(",")]
+
+            # Set reference / background image if it is specified
+            if img_viz == None:
+                ref_anat = gmwmi
+                show_anat = False
+            else:
+                ref_anat = img_viz
+                show_anat = True
+
+            # Make a picture for each hemisphere passed in, if sagittal view
+            if hemi == None:
+                hemi_list = ["lh"]
+            else:
+                hemi_list = hemi.split(
+                    ","
+                )  # TODO: redundant to define twice, already defined above if not skip projection
+
+            visualize_sub_bundles(
+                orig_bundle=tck_file if orig_streamlines is None else orig_streamlines,
+                fsub_bundle=fsub_bundle if fsub_streamlines is None else fsub_streamlines,
+                ref_anat=ref_anat,
+                fname=op.join(
+                    dwi_out_dir,
+                    f"{subject}_hemi-{hemi_list[0]}_{tract_name}_{rois_name}_desc-visualization.png",
+                ),
+                roi1=roi1_projected,
+                roi2=roi2_projected,
+                orig_color=orig_color_list,
+                fsub_color=fsub_color_list,
+                roi1_color=roi1_color_list,
+                roi2_color=roi2_color_list,
+                roi_opacity=roi_opacity,
+                fsub_linewidth=fsub_linewidth,
+                interactive=interactive_viz,
+                show_anat=show_anat,
+                axial_offset=axial_offset,
+                sagittal_offset=saggital_offset,
+                camera_angle=camera_angle,
+                hemi=hemi_list[0],
+                orig_max_points=viz_max_points,
+                orig_centroids=viz_centroids,
+                views=None if viz_views == None else viz_views.split(","),
+                mosaic=viz_mosaic,
+                roi_mesh_cache_dir=func_out_dir,
+            )
 
-        # Make a picture for each hemisphere passed in, if sagittal view
-        if hemi == None:
-            hemi_list = ["lh"]
-        else:
-            hemi_list = hemi.split(
-                ","
-            )  # TODO: redundant to define twice, already defined above if not skip projection
-
-        visualize_sub_bundles(
-            orig_bundle=tck_file,
-            fsub_bundle=fsub_bundle,
-            ref_anat=ref_anat,
-            fname=op.join(
-                dwi_out_dir,
-                f"{subject}_hemi-{hemi_list[0]}_{tract_name}_{rois_name}_desc-visualization.png",
-            ),
-            roi1=roi1_projected,
-            roi2=roi2_projected,
-            orig_color=orig_color_list,
-            fsub_color=fsub_color_list,
-            roi1_color=roi1_color_list,
-            roi2_color=roi2_color_list,
-            roi_opacity=roi_opacity,
-            fsub_linewidth=fsub_linewidth,
-            interactive=interactive_viz,
-            show_anat=show_anat,
-            axial_offset=axial_offset,
-            saggital_offset=saggital_offset,
-            camera_angle=camera_angle,
-            hemi=hemi_list[0],
-        )
+    print_profile_summary()
 
     print("\n DONE! \n")
@@ -0,0 +1,391 @@
+import os
+import os.path as op
+from fsub_extractor.utils.system_utils import find_program, probe_program_version
+from fsub_extractor.utils.streamline_utils import read_tck_header
+
+# Rough throughput figures used for runtime / memory estimates
+_MB = 1024**2
+_TCK_MB_PER_SECOND = 100  # MRtrix reading a tractogram and assigning streamlines
+_TCKGEN_ATTEMPTS_PER_THREAD_SECOND = 200  # iFOD2 with ACT and backtracking
+_TCKGEN_ASSUMED_ACCEPTANCE = 0.05  # fraction of attempted streamlines that are selected
+_VIZ_BYTES_PER_TCK_BYTE = 4  # DIPY + VTK copies of the rendered streamlines
+
+
+def plan_extractor(
+    subject,
+    tract,
+    generate,
+    tract_name,
+    roi1,
+    roi1_name,
+    roi2,
+    roi2_name,
+    hemi_list,
+    fs_dir,
+    projection_method,
+    fivett,
+    skip_fivett_registration,
+    skip_roi_projection,
+    skip_gmwmi_intersection,
+    out_dir,
+    reg,
+    reg_type,
+    reg_invert,
+    exclude_mask,
+    include_mask,
+    sift2_weights,
+    wmfod,
+    n_streamlines,
+    nthreads,
+    make_viz,
+    search_type="radial",
+    streamline_mask=None,
+    pial_exclusion=False,
+    n_shards=1,
+):
+    """Lists the stages the extractor workflow will run for a set of inputs, without running anything.
+    Arguments match those of extractor() after its input checks.
+
+    Outputs
+    =======
+    plan: list
+            One dict per stage, with the stage 'name', the external 'programs' it needs, the input
+            files it reads that no earlier stage makes ('inputs'), the 'outputs' it writes, and rough
+            'seconds' and 'memory_mb' estimates
+    """
+
+    anat_out_dir = op.join(out_dir, subject, "anat")
+    dwi_out_dir = op.join(out_dir, subject, "dwi")
+    func_out_dir = op.join(out_dir, subject, "func")
+    two_rois = roi2 != None
+    if nthreads == None:
+        nthreads = os.cpu_count() or 1
+
+    plan = []
+
+    def add_stage(name, programs, outputs, seconds=1, memory_mb=100, inputs=None):
+        plan.append(
+            {
+                "name": name,
+                "programs": programs,
+                "inputs": [] if inputs == None else inputs,
+                "outputs": outputs,
+                "seconds": seconds,
+                "memory_mb": memory_mb,
+            }
+        )
+
+    # Registration
+    if reg != None and reg_type != "mrtrix":
+        direction = "from-DWI_to-FS" if reg_invert else "from-FS_to-DWI"
+        add_stage(
+            "Convert registration",
+            ["transformconvert"],
+            [op.join(anat_out_dir, f"{subject}_{direction}_mode-image_desc-MRTrix_xfm.txt")],
+        )
+
+    # 5TT / GMWMI
+    anat_space_label = "DWI" if skip_fivett_registration else "FS"
+    fivett_existing = op.join(anat_out_dir, f"{subject}_space-FS_desc-5tt.nii.gz")
+    if skip_gmwmi_intersection == False or generate:
+        if fivett == None and op.exists(fivett_existing) == False:
+            add_stage(
+                "Create 5TT image",
+                ["5ttgen"],
+                [op.join(anat_out_dir, f"{subject}_space-{anat_space_label}_desc-5tt.nii.gz")],
+                seconds=600,
+                memory_mb=2000,
+            )
+        gmwmi = op.join(anat_out_dir, f"{subject}_space-{anat_space_label}_desc-gmwmi.nii.gz")
+        add_stage(
+            "Create GMWMI",
+            ["5tt2gmwmi", "mrthreshold"],
+            [gmwmi, gmwmi.replace("_desc-gmwmi", "_rec-binarized_desc-gmwmi")],
+            seconds=30,
+            memory_mb=500,
+        )
+        if skip_fivett_registration == False and reg != None:
+            add_stage(
+                "Register 5TT and GMWMI to DWI",
+                ["mrtransform"],
+                [
+                    op.join(anat_out_dir, f"{subject}_space-DWI_desc-5tt.nii.gz"),
+                    gmwmi.replace("space-FS", "space-DWI"),
+                ],
+                seconds=30,
+            )
+
+    # ROIs
+    rois = [(roi1, roi1_name, hemi_list[0])]
+    if two_rois:
+        rois += [(roi2, roi2_name, hemi_list[-1])]
+    for roi, roi_name, hemi in rois:
+        if skip_roi_projection == False:
+            programs = []
+            if roi[-7:] == ".nii.gz":
+                programs += ["mri_vol2surf"]
+            if projection_method == "freesurfer":
+                programs += ["mri_label2vol" if roi[-6:] == ".label" else "mri_surf2vol"]
+            rec = "label2vol" if roi[-6:] == ".label" else "surf2vol"
+            roi_projected = op.join(
+                func_out_dir, f"{subject}_rec-{rec}_space-FS_desc-{roi_name}.nii.gz"
+            )
+            add_stage(
+                f"Project {roi_name} ({hemi}) into white matter",
+                programs,
+                [roi_projected],
+                seconds=5,
+                memory_mb=_volume_mb(op.join(fs_dir, subject, "mri", "orig.mgz")) + 200,
+            )
+        else:
+            roi_projected = roi
+        if reg != None:
+            add_stage(
+                f"Register {roi_name} to DWI",
+                ["mrtransform"],
+                [roi_projected.replace("space-FS", "space-DWI")],
+                seconds=10,
+            )
+        if skip_gmwmi_intersection == False:
+            add_stage(
+                f"Intersect {roi_name} with GMWMI",
+                ["mrgrid", "mrcalc"],
+                [op.join(func_out_dir, f"{subject}_rec-intersected_desc-{roi_name}.nii.gz")],
+                seconds=10,
+            )
+    if two_rois:
+        add_stage(
+            "Merge ROIs",
+            ["mrcalc"],
+            [op.join(func_out_dir, f"{subject}_rec-merged_desc-{roi1_name}{roi2_name}.nii.gz")],
+            seconds=10,
+        )
+    rois_name = f"{roi1_name}-{roi2_name}" if two_rois else roi1_name
+
+    # Streamlines
+    tract_mb = 0
+    if generate == False:
+        # A missing tractogram is reported with the plan (see missing_inputs), not raised here
+        if op.exists(tract):
+            tract_mb = op.getsize(tract) / _MB
+        extraction_inputs = [tract]
+        if op.splitext(tract)[-1] == ".trk":
+            add_stage(
+                "Convert .trk to .tck",
+                [],
+                [op.join(dwi_out_dir, op.basename(tract).replace(".trk", ".tck"))],
+                seconds=tract_mb / _TCK_MB_PER_SECOND,
+                memory_mb=3 * tract_mb,
+                inputs=[tract],
+            )
+            extraction_inputs = []
+        outpath_base = op.join(dwi_out_dir, f"{subject}_{tract_name}_{rois_name}")
+        # End-voxel assignment is done in Python, from endpoint voxels cached per tractogram
+        programs = [] if search_type == "end" else ["tck2connectome"]
+        outputs = [
+            outpath_base + "_desc-connectome.txt",
+            outpath_base + "_desc-assignments.npz",
+            outpath_base + "_desc-fsub.tck",
+        ]
+        masks = [mask for mask in [exclude_mask, include_mask, streamline_mask] if mask != None]
+        if len(masks) > 0:
+            # Masks are applied in Python, except .mif masks (by tckedit)
+            if any(mask[-4:] == ".mif" for mask in masks):
+                programs += ["tckedit"]
+            outputs += [outpath_base + "_desc-fsub_desc-masked.tck"]
+        extraction_inputs += masks
+        if sift2_weights != None:
+            extraction_inputs += [sift2_weights]
+        add_stage(
+            f"Extract sub-bundle from {_tract_description(tract)}",
+            programs,
+            outputs,
+            seconds=2 * tract_mb / _TCK_MB_PER_SECOND,
+            memory_mb=500 + (200 if sift2_weights != None else 0),
+            inputs=extraction_inputs,
+        )
+        fsub_bundle = outputs[-1]
+    else:
+        if pial_exclusion:
+            # The mask is built once per subject and reused while the surfaces are unchanged
+            pial_mask = op.join(anat_out_dir, f"{subject}_surf-pial_hemi-combined_space-FS.nii.gz")
+            if op.exists(pial_mask) == False:
+                add_stage(
+                    "Create pial exclusion mask",
+                    ["mri_surf2vol", "mrcalc"] if projection_method == "freesurfer" else [],
+                    [pial_mask],
+                    seconds=10,
+                    memory_mb=_volume_mb(op.join(fs_dir, subject, "mri", "orig.mgz")) + 200,
+                )
+            if reg != None and op.exists(pial_mask.replace("space-FS", "space-DWI")) == False:
+                add_stage(
+                    "Register pial exclusion mask to DWI",
+                    ["mrtransform"],
+                    [pial_mask.replace("space-FS", "space-DWI")],
+                    seconds=10,
+                )
+        attempts = n_streamlines / _TCKGEN_ASSUMED_ACCEPTANCE
+        programs = ["tckgen"]
+        if two_rois:
+            fsub_bundle = op.join(
+                dwi_out_dir,
+                f"{subject}_space-DWI_from-{roi1_name}_to-{roi2_name}_desc-{tract_name}_desc-merged_fsub.tck",
+            )
+            programs += ["tckedit"]
+        else:
+            fsub_bundle = op.join(
+                dwi_out_dir,
+                f"{subject}_space-DWI_from-{roi1_name}_desc-{tract_name}_fsub.tck",
+            )
+        # Shards are merged with tckedit (as are the two seeding directions)
+        if n_shards > 1 and "tckedit" not in programs:
+            programs += ["tckedit"]
+        add_stage(
+            f"Generate {n_streamlines} streamlines (assuming {_TCKGEN_ASSUMED_ACCEPTANCE:.0%} acceptance)",
+            programs,
+            [fsub_bundle],
+            seconds=attempts / (_TCKGEN_ATTEMPTS_PER_THREAD_SECOND * nthreads),
+            memory_mb=_volume_mb(wmfod) + 500,
+            inputs=[wmfod],
+        )
+
+    # Visualization
+    if make_viz:
+        add_stage(
+            "Render visualization",
+            [],
+            [
+                op.join(
+                    dwi_out_dir,
+                    f"{subject}_hemi-{hemi_list[0]}_{tract_name}_{rois_name}_desc-visualization.png",
+                )
+            ],
+            seconds=10 + tract_mb / 20,
+            memory_mb=500 + _VIZ_BYTES_PER_TCK_BYTE * tract_mb,
+        )
+
+    return plan
+
+
+def missing_programs(plan):
+    """Lists external programs needed by a plan that are not on PATH
+    Parameters
+    ==========
+    plan: list
+            Plan, as returned by plan_extractor
+
+    Outputs
+    =======
+    missing: list
+            Names of programs that could not be found
+    """
+
+    missing = []
+    for program in sorted({program for stage in plan for program in stage["programs"]}):
+        try:
+            find_program(program)
+        except Exception:
+            missing += [program]
+
+    return missing
+
+
+def missing_inputs(plan):
+    """Lists input files read by a plan that do not exist
+    Parameters
+    ==========
+    plan: list
+            Plan, as returned by plan_extractor
+
+    Outputs
+    =======
+    missing: list
+            Paths of input files that could not be found
+    """
+
+    missing = []
+    for stage in plan:
+        for input_file in stage["inputs"]:
+            if op.exists(input_file) == False and input_file not in missing:
+                missing += [input_file]
+
+    return missing
+
+
+def print_plan(plan):
+    """Prints a plan's stages, tool versions, existing outputs, and resource estimates
+    Parameters
+    ==========
+    plan: list
+            Plan, as returned by plan_extractor
+
+    Outputs
+    =======
+    None
+    """
+
+    print("\n######## Processing Plan (dry run) ########")
+    for i, stage in enumerate(plan):
+        print(
+            f"\n {i + 1}. {stage['name']} (~{_format_seconds(stage['seconds'])}, ~{stage['memory_mb']:.0f} MB)"
+        )
+        for program in stage["programs"]:
+            print(f"      uses {program}: {probe_program_version(program)}")
+        for input_file in stage["inputs"]:
+            status = "exists" if op.exists(input_file) else "MISSING"
+            print(f"      reads [{status}] {input_file}")
+        for output in stage["outputs"]:
+            status = "exists" if op.exists(output) else "to be made"
+            print(f"      [{status}] {output}")
+
+    total_seconds = sum(stage["seconds"] for stage in plan)
+    peak_memory = max([stage["memory_mb"] for stage in plan] + [0])
+    print(
+        f"\n Estimated total runtime: ~{_format_seconds(total_seconds)}; peak memory: ~{peak_memory:.0f} MB"
+    )
+    missing = missing_programs(plan)
+    if len(missing) > 0:
+        print(f" MISSING PROGRAMS: {', '.join(missing)}")
+    missing = missing_inputs(plan)
+    if len(missing) > 0:
+        print(f" MISSING INPUTS: {', '.join(missing)}")
+    print("###########################################\n")
+
+    return None
+
+
+def _volume_mb(img):
+    """Estimates the in-memory (float32) size of an image from its header, in MB"""
+    if img == None or op.exists(img) == False:
+        return 0
+    try:
+        import nibabel as nib
+
+        shape = nib.load(img).shape
+    except Exception:
+        return op.getsize(img) / _MB
+    n_voxels = 1
+    for dim in shape:
+        n_voxels *= dim
+    return 4 * n_voxels / _MB
+
+
+def _tract_description(tract):
+    """Describes a tractogram by its streamline count (from the .tck header) and size"""
+    if op.exists(tract) == False:
+        return "missing tractogram"
+    size = f"{op.getsize(tract) / _MB:.0f} MB"
+    if tract[-4:] == ".tck":
+        count = read_tck_header(tract).get("count")
+        if count != None:
+            return f"{int(count)} streamlines, {size}"
+    return size
+
+
+def _format_seconds(seconds):
+    """Formats a duration as seconds, minutes or hours"""
+    if seconds < 60:
+        return f"{seconds:.0f} s"
+    if seconds < 3600:
+        return f"{seconds / 60:.0f} min"
+    return f"{seconds / 3600:.1f} h"
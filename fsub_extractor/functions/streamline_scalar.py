@@ -11,8 +11,11 @@ from fsub_extractor.utils.system_utils import (
     run_command,
     overwrite_check,
     find_program,
+    set_profile_dir,
+    profile_stage,
+    print_profile_summary,
 )
-from fsub_extractor.utils.streamline_utils import trk_to_tck
+from fsub_extractor.utils.streamline_utils import trk_to_tck, tck_to_trx
 
 
 def streamline_scalar(
@@ -26,6 +29,8 @@ def streamline_scalar(
     out_prefix,
     overwrite,
     n_points=100,
+    profile_dir=None,
+    trx=False,
 ):
 
     """Creates scalar statistics on tract files
@@ -47,6 +52,10 @@ def streamline_scalar(
         What to prepend to output names
     overwrite: bool
         Whether to overwrite existing files
+    profile_dir: str
+        If given, profile each stage and save the profiles here (see profile_stage)
+    trx: bool
+        Whether to also save the tract as TRX, with each scalar's per-streamline means attached
 
     Outputs
     =======
@@ -54,6 +63,7 @@ def streamline_scalar(
         _profile.png file for each scalar with a graph of the tract profile
         _stats.txt file with summary stats for each scalar
         _streamline_means.csv file with per-streamline metrics for each scalar
+        streamline_means.trx file with the tract and all per-streamline metrics (if trx is True)
     """
 
     ### Split string of scalars to lists
@@ -75,10 +85,14 @@ def streamline_scalar(
         raise Exception(f"Tract file {tract} is not found on the system.")
     if tract[-4:] not in [".trk", ".tck"]:
         raise Exception(f"Tract file {tract} is not of a supported file type.")
+    # Profile the Python side of each stage if requested
+    if profile_dir != None:
+        set_profile_dir(profile_dir)
     # Convert tract to .tck if needed
     if tract[-4:] == ".trk":
         print("\n Converting .trk to .tck \n")
-        tck_file = trk_to_tck(tract, out_dir, overwrite=overwrite)
+        with profile_stage("trk_conversion"):
+            tck_file = trk_to_tck(tract, out_dir, overwrite=overwrite)
     else:
         tck_file = tract
     # Make sure number of points for tract profile is not negative
@@ -108,7 +122,8 @@ def streamline_scalar(
     func_out_base = op.join(func_out_dir, out_prefix)
 
     ### Reorient streamlines so beginning of each streamline are at the same end
-    tract_loaded = load_tractogram(tract, scalar_path_list[0]).streamlines
+    with profile_stage("tract_loading"):
+        tract_loaded = load_tractogram(tract, scalar_path_list[0]).streamlines
     # TODO: See if we need to reorient streamlines, and how
     # trk_ref_img, ref_affine = load_nifti(trk_ref)
     # roi_begin_img = load_nifti_data(roi_begin)
@@ -121,23 +136,26 @@ def streamline_scalar(
 
     # Calculate bundle weights and the profile
     # weights_bundle = dsa.gaussian_weights(oriented_bundle)
-    weights_bundle = dsa.gaussian_weights(tract_loaded, n_points=n_points)
+    with profile_stage("bundle_weights"):
+        weights_bundle = dsa.gaussian_weights(tract_loaded, n_points=n_points)
 
+    streamline_means = {}
     for scalar_path, scalar_name in zip(scalar_path_list, scalar_name_list):
 
         print(f"\n Processing scalar {scalar_path} under name {scalar_name} \n")
 
         # Calculate tract profile
         print(f"\n Calculating tract profile for {scalar_name} \n")
-        scalar_img, scalar_affine = load_nifti(scalar_path)
-        profile_bundle = dsa.afq_profile(
-            scalar_img,
-            tract_loaded,
-            scalar_affine,
-            weights=weights_bundle,
-            n_points=n_points,
-            orient_by=tract_loaded[0],
-        )
+        with profile_stage(f"profile_{scalar_name}"):
+            scalar_img, scalar_affine = load_nifti(scalar_path)
+            profile_bundle = dsa.afq_profile(
+                scalar_img,
+                tract_loaded,
+                scalar_affine,
+                weights=weights_bundle,
+                n_points=n_points,
+                orient_by=tract_loaded[0],
+            )
         # Save out plot
         plt.plot(profile_bundle)
         plt.ylabel(scalar_name)
@@ -150,29 +168,32 @@ def streamline_scalar(
         ### Calculate tract average scalar
         # Start by finding average per streamline with 'tcksample'
         print(f"\n Calculating tract-average summary stats for {scalar_name} \n")
-        tcksample = find_program("tcksample")
-        tcksample_out = dwi_out_base + scalar_name + "_streamline_means.csv"
-
-        cmd_tcksample = [
-            tcksample,
-            tck_file,
-            scalar_path,
-            tcksample_out,
-            "-stat_tck",
-            "mean",
-            "-precise",
-        ]
-        if overwrite == False:
-            overwrite_check(tcksample_out)
-        else:
-            cmd_tcksample += ["-force"]
-        run_command(cmd_tcksample)
-
-        # Load per-streamline averages, average across streamlines to get whole track mean
-        streamline_avgs = pd.read_csv(tcksample_out, skiprows=1)
-        streamline_avgs_num = [
-            float(avg.removesuffix(".1")) for avg in streamline_avgs.columns
-        ]
+        with profile_stage(f"streamline_means_{scalar_name}"):
+            tcksample = find_program("tcksample")
+            tcksample_out = dwi_out_base + scalar_name + "_streamline_means.csv"
+
+            cmd_tcksample = [
+                tcksample,
+                tck_file,
+                scalar_path,
+                tcksample_out,
+                "-stat_tck",
+                "mean",
+                "-precise",
+            ]
+            if overwrite == False:
+                overwrite_check(tcksample_out)
+            else:
+                cmd_tcksample += ["-force"]
+            run_command(cmd_tcksample)
+
+            # Load per-streamline averages, average across streamlines to get whole track mean
+            # (read without a header row, since repeated values would get renamed as duplicate column names)
+            streamline_avgs = pd.read_csv(tcksample_out, skiprows=1, header=None)
+            streamline_avgs_num = [float(avg) for avg in streamline_avgs.values.ravel()]
+        streamline_means[f"mean_{scalar_name}"] = np.array(
+            streamline_avgs_num, dtype=np.float32
+        )
         # Calculate summary stats across streamlines
         tract_avg = np.mean(streamline_avgs_num)
         tract_std = np.std(streamline_avgs_num)
@@ -187,4 +208,15 @@ def streamline_scalar(
         stats_outfile_object.write(stats_string)
         stats_outfile_object.close()
 
+    if trx:
+        tck_to_trx(
+            tck_file,
+            dwi_out_base + "streamline_means.trx",
+            scalar_path_list[0],
+            data_per_streamline=streamline_means,
+            overwrite=overwrite,
+        )
+
+    print_profile_summary()
+
     print("\n DONE \n")
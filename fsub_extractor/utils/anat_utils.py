@@ -1,6 +1,7 @@
 import os.path as op
 import os
 from fsub_extractor.utils.system_utils import *
+from fsub_extractor.utils.surface_utils import surface_mask_native
 
 
 def anat_to_gmwmi(
@@ -116,6 +117,7 @@ def binarize_image(img, outfile, threshold=0, comparison="gt", overwrite=True):
     Function returns path to binarized image
     outfile is the binarized image
     """
+
     mrthreshold = find_program("mrthreshold")
     cmd_mrthreshold = [
         mrthreshold,
@@ -142,10 +144,13 @@ def get_pial_surf(
     fs_dir,
     surf_name="pial",
     anat_out_dir=os.getcwd(),
+    method="native",
     overwrite=True,
 ):
 
-    """Returns volumetric mask of pial surface
+    """Returns volumetric mask of pial surface. The mask only depends on the subject's
+    FreeSurfer surfaces, so it is built once (both hemispheres at the same time) and reused
+    for as long as it is newer than the surfaces and orig.mgz.
 
     Parameters
     ==========
@@ -153,6 +158,14 @@ def get_pial_surf(
             Subject name as found in FreeSurfer subjects directory
     fs_dir: str
             Path to FreeSurfer subjects directory
+    surf_name: str
+            Surface to make a mask of
+    anat_out_dir: str
+            Path to output directory. Also holds the surface geometry cache.
+    method: str
+            "native" to rasterize the (cached) surface in Python, or "freesurfer" to use mri_surf2vol
+    overwrite: bool
+            Whether to allow overwriting outputs
 
     Outputs
     =======
@@ -160,12 +173,35 @@ def get_pial_surf(
     outfile is the binarized image
     """
 
+    outpath_merged = op.join(
+        anat_out_dir, f"{subject}_surf-{surf_name}_hemi-combined_space-FS.nii.gz"
+    )
+    sources = [
+        op.join(fs_dir, subject, "surf", f"{hemi}.{surf_name}") for hemi in ["lh", "rh"]
+    ] + [op.join(fs_dir, subject, "mri", "orig.mgz")]
+    if is_up_to_date(outpath_merged, sources):
+        print(f"\n Reusing {surf_name} surface mask {outpath_merged} \n")
+        return outpath_merged
+    if overwrite == False:
+        overwrite_check(outpath_merged)
+
+    if method == "native":
+        return surface_mask_native(
+            fs_dir,
+            subject,
+            outpath_merged,
+            surf_name=surf_name,
+            cache_dir=anat_out_dir,
+        )
+
     ### Tell FreeSurfer where subject data is
     os.environ["SUBJECTS_DIR"] = fs_dir
 
     ### Define the mri_surf2surf command, recreat pial surface in each hemisphere
     mri_surf2vol = find_program("mri_surf2vol")
 
+    outpaths_hemi = []
+    cmds_mri_surf2vol = []
     for hemi in ["lh", "rh"]:
         outpath_hemi = op.join(
             anat_out_dir, f"{subject}_surf-{surf_name}_hemi-{hemi}_space-FS.nii.gz"
@@ -191,24 +227,23 @@ def get_pial_surf(
         if overwrite == False:
             overwrite_check(outpath_hemi)
 
-        run_command(cmd_mri_surf2vol)
+        outpaths_hemi += [outpath_hemi]
+        cmds_mri_surf2vol += [cmd_mri_surf2vol]
+
+    # The hemispheres are independent, so run them at the same time
+    run_commands_parallel(cmds_mri_surf2vol, max_workers=2)
 
     ### Merge the images into one mask
-    outpath_merged = op.join(
-        anat_out_dir, f"{subject}_surf-{surf_name}_hemi-combined_space-FS.nii.gz"
-    )
     mrcalc = find_program("mrcalc")
     cmd_mrcalc = [
         mrcalc,
-        outpath_hemi,
-        outpath_hemi.replace("hemi-rh", "hemi-lh"),
+        outpaths_hemi[0],
+        outpaths_hemi[1],
         "-max",
         outpath_merged,
     ]
     if overwrite:
         cmd_mrcalc += ["-force"]
-    else:
-        overwrite_check(outpath_merged)
 
     run_command(cmd_mrcalc)
 
@@ -1,6 +1,8 @@
 import os.path as op
 import os
+import warnings
 from fsub_extractor.utils.system_utils import *
+from fsub_extractor.utils.surface_utils import surf2vol_native, surf2vol_native_batch
 
 
 def project_roi(
@@ -11,6 +13,8 @@ def project_roi(
     hemi,
     outdir,
     projfrac_params=[-1, 0, 0.05],
+    method="native",
+    cache_dir=None,
     overwrite=True,
 ):
     """Makes volumetric file of ROI mapped on white matter surface
@@ -31,6 +35,12 @@ def project_roi(
             List containing strings of ['start','stop','delta'] parameters for projfrac
     outdir: str
             Path to output directory, including output prefix
+    method: str
+            "native" to project surface ROIs in Python (no FreeSurfer binaries needed),
+            or "freesurfer" to use mri_label2vol / mri_surf2vol.
+            Volumetric (.nii.gz) ROIs always need mri_vol2surf.
+    cache_dir: str
+            Directory for the subject's surface geometry cache (native method only)
     overwrite: bool
             Whether to allow overwriting outputs
 
@@ -78,6 +88,18 @@ def project_roi(
         roi_projected = op.join(
             outdir, f"{subject}_rec-label2vol_space-FS_desc-{roi_name}.nii.gz"
         )
+        if overwrite == False:
+            overwrite_check(roi_projected)
+        if method == "native":
+            return surf2vol_native(
+                roi_surf,
+                fs_dir,
+                subject,
+                hemi,
+                roi_projected,
+                projfrac_params,
+                cache_dir=cache_dir,
+            )
         mri_label2vol = find_program("mri_label2vol")
         cmd_mri_label2vol = [
             mri_label2vol,
@@ -106,6 +128,18 @@ def project_roi(
         roi_projected = op.join(
             outdir, f"{subject}_rec-surf2vol_space-FS_desc-{roi_name}.nii.gz"
         )
+        if overwrite == False:
+            overwrite_check(roi_projected)
+        if method == "native":
+            return surf2vol_native(
+                roi_surf,
+                fs_dir,
+                subject,
+                hemi,
+                roi_projected,
+                projfrac_params,
+                cache_dir=cache_dir,
+            )
         mri_surf2vol = find_program("mri_surf2vol")
 
         cmd_mri_surf2vol = [
@@ -135,6 +169,92 @@ def project_roi(
     return roi_projected
 
 
+def project_rois_batch(
+    rois_in,
+    roi_names,
+    hemis,
+    fs_dir,
+    subject,
+    outdir,
+    atlas_name="rois",
+    projfrac_params=[-1, 0, 0.05],
+    stack=False,
+    cache_dir=None,
+    overwrite=True,
+):
+    """Makes one labelled volumetric file of many surface ROIs mapped into white matter
+
+    Parameters
+    ==========
+    rois_in: list
+            Paths to input surface ROI files (.mgz, .label, .gii). Should be binary (1 in ROI, 0 elsewhere).
+    roi_names: list
+            Names of the ROIs, written to the label table
+    hemis: list
+            Hemisphere corresponding to each ROI ('lh' or 'rh')
+    fs_dir: str
+            Path to FreeSurfer subjects folder
+    subject: str
+            Subject name. Must match folder name in fs_dir.
+    outdir: str
+            Path to output directory
+    atlas_name: str
+            What to call the labelled volume in filename
+    projfrac_params: list
+            List containing strings of ['start','stop','delta'] parameters for projfrac
+    stack: bool
+            Save a 4D volume with one binary ROI per volume instead of a 3D labelled volume
+    cache_dir: str
+            Directory for the subject's surface geometry cache
+    overwrite: bool
+            Whether to allow overwriting outputs
+
+    Outputs
+    =======
+    Function returns paths to the projected ROI volume and its label table.
+    Image is saved out to "outdir/{subject}_rec-surf2vol_space-FS_desc-{atlas_name}.nii.gz"
+    Label table is saved out to "outdir/{subject}_rec-surf2vol_space-FS_desc-{atlas_name}_labels.tsv"
+    """
+
+    for roi_in in rois_in:
+        if roi_in[-7:] == ".nii.gz":
+            raise Exception(
+                f"Batch projection only supports surface ROIs (.mgz, .label, .gii), but got {roi_in}."
+            )
+    if len(roi_names) != len(rois_in):
+        raise Exception("Number of ROIs and ROI names do not match.")
+
+    rois_projected = op.join(
+        outdir, f"{subject}_rec-surf2vol_space-FS_desc-{atlas_name}.nii.gz"
+    )
+    labels_out = op.join(
+        outdir, f"{subject}_rec-surf2vol_space-FS_desc-{atlas_name}_labels.tsv"
+    )
+    if overwrite == False:
+        overwrite_check(rois_projected)
+        overwrite_check(labels_out)
+
+    print(f"Projecting {len(rois_in)} surface ROIs")
+    surf2vol_native_batch(
+        rois_in,
+        hemis,
+        fs_dir,
+        subject,
+        rois_projected,
+        projfrac_params,
+        stack=stack,
+        cache_dir=cache_dir,
+    )
+
+    # Volume index (stack) or label value (labelled volume) of each ROI
+    with open(labels_out, "w") as f:
+        f.write("index\tname\themi\n")
+        for roi_index, (roi_name, hemi) in enumerate(zip(roi_names, hemis)):
+            f.write(f"{roi_index if stack else roi_index + 1}\t{roi_name}\t{hemi}\n")
+
+    return rois_projected, labels_out
+
+
 def intersect_gmwmi(roi_in, roi_name, gmwmi, outpath_base, overwrite=True):
     """Intersects an input ROI file with the GMWMI
 
@@ -227,7 +347,7 @@ def merge_rois(roi1, roi2, out_file, overwrite=True):
 
     # Abort if file already exists and overwriting not allowed
     if overwrite == False:
-        overwrite_check(labelled_roi2)
+        overwrite_check(roi2_mult2)
         overwrite_check(out_file)
     else:
         cmd_mrcalc_mult += ["-force"]
@@ -239,6 +359,47 @@ def merge_rois(roi1, roi2, out_file, overwrite=True):
     return out_file
 
 
+def label_rois(rois, out_file, overwrite=True):
+    """Creates an atlas-like file from any number of ROI masks, in which ROI i (counting from 1)
+        has the value i. Where ROIs overlap, the later ROI is kept.
+    Parameters
+    ==========
+    rois: list
+            Abspaths to the ROI mask files (.nii.gz), all on the same grid
+    out_file: str
+            Abspath of filename to save output atlas file
+    overwrite: bool
+            Whether to allow overwriting outputs
+
+    Outputs
+    =======
+    out_file: str
+            Abspath of output file created by this function
+
+    """
+    import numpy as np
+    import nibabel as nib
+
+    if overwrite == False:
+        overwrite_check(out_file)
+
+    first = nib.load(rois[0])
+    labels = np.zeros(first.shape[:3], dtype=np.uint16 if len(rois) < 2**16 else np.uint32)
+    for label, roi in enumerate(rois, start=1):
+        roi_img = nib.load(roi)
+        if roi_img.shape[:3] != first.shape[:3] or np.allclose(roi_img.affine, first.affine) == False:
+            raise Exception(f"ROI {roi} is not on the same grid as {rois[0]}.")
+        mask = np.asanyarray(roi_img.dataobj).reshape(labels.shape) > 0
+        if (labels[mask] > 0).any():
+            warnings.warn(
+                f"ROI {roi} overlaps earlier ROIs, which lose the overlapping voxels."
+            )
+        labels[mask] = label
+    nib.save(nib.Nifti1Image(labels, first.affine), out_file)
+
+    return out_file
+
+
 def register_to_dwi(
     roi_in, out_file, mrtrix_xfm, invert=False, interp="cubic", overwrite=True
 ):
@@ -285,7 +446,7 @@ def register_to_dwi(
         cmd_mrtransform += ["-inverse"]
 
     if overwrite == False:
-        overwrite_check(outpath)
+        overwrite_check(out_file)
     else:
         cmd_mrtransform += ["-force"]
 
@@ -1,15 +1,216 @@
 from dipy.io.streamline import load_tck
 from dipy.io.image import load_nifti
 from fury import actor, window, colormap as cmap
+from fsub_extractor.utils.streamline_utils import (
+    decimate_streamlines,
+    read_tck_streamlines,
+)
+from fury.io import save_image
+from fury.utils import (
+    get_actor_from_primitive,
+    get_polydata_normals,
+    get_polydata_triangles,
+    get_polydata_vertices,
+)
+from fury.lib import RenderWindow, WindowToImageFilter, numpy_support
+from fsub_extractor.utils.system_utils import (
+    set_profile_dir,
+    profile_stage,
+    print_profile_summary,
+)
 from os.path import exists
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import multiprocessing
+import os
 import nibabel as nib
 import numpy as np
 
 
-def visualize_sub_bundles(
+# Camera presets: direction from the scene center to the camera, and the view-up vector
+CAMERA_VIEWS = {
+    "lh": ((-1, 0, 0), (0, 0, 1)),
+    "rh": ((1, 0, 0), (0, 0, 1)),
+    "axial": ((0, 0, 1), (0, 1, 0)),
+    "coronal": ((0, 1, 0), (0, 0, 1)),
+}
+
+
+def set_camera_view(scene, view):
+    """Points a scene's camera at its actors from one of the CAMERA_VIEWS presets.
+    Parameters
+    ==========
+    scene: fury Scene
+    view: 'lh' or 'rh' (sagittal, from that side), 'axial' (from above), or 'coronal' (from the front)
+
+    Outputs
+    =======
+    None
+    """
+    direction, view_up = CAMERA_VIEWS[view]
+    scene.reset_camera()
+    cam = scene.GetActiveCamera()
+    focal_point = np.array(cam.GetFocalPoint())
+    cam.SetPosition(*(focal_point + cam.GetDistance() * np.array(direction)))
+    cam.SetViewUp(*view_up)
+    scene.reset_camera()
+
+
+# ROI meshes already built in this process, keyed like the on-disk cache
+_ROI_MESH_CACHE = {}
+
+
+def roi_mesh(roi_file, roi_val=None, cache_dir=None):
+    """Makes (or reloads) the surface mesh of a volumetric ROI. Marching cubes is only run on the
+    ROI's bounding box, and meshes are cached in memory and, optionally, on disk under the hash of the ROI file.
+    Parameters
+    ==========
+    roi_file: str
+            Path to ROI image (.nii.gz)
+    roi_val: int
+            ROI value to mesh (default = all nonzero voxels)
+    cache_dir: str
+            Directory for cached meshes (default = in-memory caching only)
+
+    Outputs
+    =======
+    mesh: dict
+            'vertices' (n, 3) float32 in RAS mm, 'faces' (m, 3) int32 and 'normals' (n, 3) float32
+    """
+
+    sha1 = hashlib.sha1()
+    with open(roi_file, "rb") as f:
+        for block in iter(lambda: f.read(2**20), b""):
+            sha1.update(block)
+    key = sha1.hexdigest()[:16] + ("" if roi_val == None else f"-{roi_val}")
+    if key in _ROI_MESH_CACHE:
+        return _ROI_MESH_CACHE[key]
+    cache_file = None
+    if cache_dir != None:
+        cache_file = os.path.join(cache_dir, f"desc-{key}_roimesh.npz")
+        if exists(cache_file):
+            with np.load(cache_file) as cached:
+                mesh = {name: cached[name] for name in cached.files}
+            _ROI_MESH_CACHE[key] = mesh
+            return mesh
+
+    roi_data, affine = load_nifti(roi_file)
+    roi_mask = roi_data > 0 if roi_val == None else roi_data == roi_val
+    ijk = np.argwhere(roi_mask)
+    if len(ijk) == 0:
+        raise Exception(f"ROI {roi_file} is empty.")
+
+    # Crop to the bounding box (with a 1-voxel margin, so the surface closes) and shift the affine to match
+    lo = np.maximum(ijk.min(axis=0) - 1, 0)
+    hi = ijk.max(axis=0) + 2
+    cropped = roi_mask[lo[0] : hi[0], lo[1] : hi[1], lo[2] : hi[2]]
+    cropped_affine = affine.copy()
+    cropped_affine[:3, 3] = affine[:3, :3] @ lo + affine[:3, 3]
+
+    contour = actor.contour_from_roi(cropped, cropped_affine)
+    polydata = contour.GetMapper().GetInputAlgorithm()
+    polydata.Update()
+    polydata = polydata.GetOutput()
+    mesh = {
+        "vertices": get_polydata_vertices(polydata).astype(np.float32),
+        "faces": get_polydata_triangles(polydata).astype(np.int32),
+        "normals": get_polydata_normals(polydata).astype(np.float32),
+    }
+
+    _ROI_MESH_CACHE[key] = mesh
+    if cache_file != None:
+        os.makedirs(cache_dir, exist_ok=True)
+        np.savez(cache_file, **mesh)
+
+    return mesh
+
+
+def roi_mesh_actor(roi_file, color, opacity=1, roi_val=None, cache_dir=None):
+    """Makes a fury actor for a volumetric ROI from its cached mesh (see roi_mesh)
+    Parameters
+    ==========
+    roi_file: path to roi file (.nii.gz)
+    color: color to plot roi as ([R,G,B])
+    opacity: how opaque to make the roi ([0-1], default = 1)
+    roi_val: roi value (default = all nonzero voxels)
+    cache_dir: directory for cached meshes (default = in-memory caching only)
+
+    Outputs
+    =======
+    roi_actor to be added to a fury scene
+    """
+
+    mesh = roi_mesh(roi_file, roi_val=roi_val, cache_dir=cache_dir)
+    roi_actor = get_actor_from_primitive(
+        mesh["vertices"], mesh["faces"], normals=mesh["normals"], backface_culling=False
+    )
+    roi_actor.GetMapper().ScalarVisibilityOff()
+    roi_actor.GetProperty().SetColor(*color)
+    roi_actor.GetProperty().SetOpacity(opacity)
+
+    return roi_actor
+
+
+# Axis of the image array that each slice view cuts across
+_SLICE_AXES = {"sagittal": 0, "coronal": 1, "axial": 2}
+
+
+def anatomy_sample(img, step=4):
+    """Reads a strided subsample of an image's nonzero voxels, for picking display intensity windows
+    Parameters
+    ==========
+    img: nibabel image
+    step: keep every step-th voxel along each axis (default = 4)
+
+    Outputs
+    =======
+    sample: 1D float32 array of nonzero voxel values
+    """
+    sample = np.asarray(img.dataobj[::step, ::step, ::step], dtype=np.float32)
+    sample = sample[sample > 0]
+    if sample.size == 0:
+        raise Exception("Reference anatomy has no nonzero voxels to display.")
+    return sample
+
+
+def anatomy_slice_actor(img, view="axial", offset=0, value_range=None):
+    """Makes a slice actor from a single slice of an image, read through nibabel's array proxy
+    so the rest of the volume is never loaded.
+    Parameters
+    ==========
+    img: nibabel image
+    view: 'axial' (default), 'sagittal' or 'coronal'
+    offset: how far off center the slice should be plotted ([-1,1]). 0 (center) is default.
+    value_range: display intensity window ((min, max), default = range of the slice)
+
+    Outputs
+    =======
+    slice_actor to be added to a fury scene
+    """
+    axis = _SLICE_AXES[view]
+    n_slices = img.shape[axis]
+    index = n_slices // 2 + int((n_slices - (n_slices // 2)) * offset)
+    index = min(max(index, 0), n_slices - 1)
+
+    slicer = [slice(None)] * 3
+    slicer[axis] = slice(index, index + 1)
+    data = np.asarray(img.dataobj[tuple(slicer)], dtype=np.float32)
+
+    # Move the affine's origin to the slice, so the one-slice array lands in the right place
+    affine = img.affine.copy()
+    affine[:3, 3] += affine[:3, axis] * index
+
+    slice_actor = actor.slicer(data, affine, value_range)
+    display = [None, None, None]
+    display[axis] = 0
+    slice_actor.display(*display)
+
+    return slice_actor
+
+
+def build_sub_bundle_actors(
     fsub_bundle,
     ref_anat,
-    fname,
     roi1,
     orig_bundle=None,
     roi2=None,
@@ -19,48 +220,28 @@ def visualize_sub_bundles(
     roi2_color=[1, 0.2, 1],
     roi_opacity=0.7,
     fsub_linewidth=3.0,
-    interactive=False,
     show_anat=False,
     axial_offset=0,
     sagittal_offset=0,
-    camera_angle="sagittal",
-    hemi="lh",
+    orig_max_points=1000000,
+    orig_centroids=False,
+    roi_mesh_cache_dir=None,
 ):
-    """Takes in tck and nifti files and makes a fury visualization
-
-    Parameters
-    ==========
-    fsub_bundle: Sub bundle output (.tck)
-    ref_anat: Reference anatomy (.nii.gz)
-    fig_path = Path to save the figure
-    fname = filename (.png)
-    roi1: ROI that was used to create sub bundle file (.nii.gz)
-    orig_bundle (Optional): Original bundle (.tck)
-    roi2 (Optional): Second ROI that was used to create pairwise sub-bundle (.nii.gz)
-    orig_color (Optional): Color for original bundle ([R,G,B])
-    fsub_color (Optional): Color for fsub bundle ([R,G,B])
-    roi1_color (Optional): Color for ROI1 ([R,G,B])
-    roi2_color (Optional): Color for ROI2 ([R,G,B])
-    Interactive (Optional): Make interactive fury visualization (True) or save out screenshot (default = False)
-    show_anat (Optional): Whether to overlay anatomy on the figure (default = False)
-    axial_offset (Optional): Where to display axial slice (-1,1) where -1 is bottom of image and 1 is top.
-        (default = 0, which is the middle of the image)
-    sagittal_offset (Optional): Where to display sagittal slice (-1,1) where -1 is left of image and 1 is right.
-        (default = 0, which is the middle of the image)
-    camera_angle (Optional): Angle for screenshot ('saggital' (default) or 'axial')
-    hemi (Optional): For sagittal picture, what hemisphere to view from. Accepts either 'lh' or 'rh'.
+    """Makes the fury actors shown by visualize_sub_bundles (see there for parameters)
 
     Outputs
     =======
-    Function saves out image to the out_dir
+    actors: list of fury actors, ready to be added to a scene
     """
 
     # Load in reference anatomy
     reference_anatomy = nib.load(ref_anat)
 
-    # Load in streamlines
-    fsub_streamlines = load_tck(fsub_bundle, reference_anatomy)
-    fsub_streamlines = fsub_streamlines.streamlines
+    # Load in streamlines, unless they were handed over already in memory
+    if isinstance(fsub_bundle, str):
+        fsub_streamlines = read_tck_streamlines(fsub_bundle)
+    else:
+        fsub_streamlines = fsub_bundle
 
     # Repeat the color matrix for each streamline (fsub)
     n_fsub_streamlines = len(fsub_streamlines)
@@ -72,79 +253,170 @@ def visualize_sub_bundles(
         fsub_streamlines, fsub_color, linewidth=fsub_linewidth
     )
 
-    # Load in ROI(s)
-    roi1_data, affine, img = load_nifti(roi1, return_img=True)
-    roi1_mask = roi1_data > 0
-    roi1_actor = actor.contour_from_roi(roi1_mask, affine, roi1_color, roi_opacity)
+    # Make ROI(s) from cached meshes
+    roi1_actor = roi_mesh_actor(
+        roi1, roi1_color, roi_opacity, cache_dir=roi_mesh_cache_dir
+    )
 
-    # Add actors to scene
-    figure = window.Scene()
-    figure.add(fsub_streamlines_actor)
-    figure.add(roi1_actor)
+    actors = [fsub_streamlines_actor, roi1_actor]
 
     # Load in original streamlines if specified (e.g., extractor workflow, not generator)
-    if orig_bundle != None:
-        orig_streamlines = load_tck(orig_bundle, reference_anatomy)
-        orig_streamlines = orig_streamlines.streamlines
+    if orig_bundle is not None:
+        # Only context is needed from the original bundle, so decimate it to the point budget
+        orig_streamlines, lod = decimate_streamlines(
+            orig_bundle, max_points=orig_max_points, centroids=orig_centroids
+        )
 
         # Repeat the color matrix for each streamline (orig)
         n_orig_streamlines = len(orig_streamlines)
         orig_color = np.array([orig_color])
         orig_color = np.repeat(orig_color, n_orig_streamlines, axis=0)
 
-        # Make the streamline actor (orig) and add to figure
-        orig_streamlines_actor = actor.line(orig_streamlines, orig_color, opacity=0.1)
-        figure.add(orig_streamlines_actor)
+        # Make the streamline actor (orig); centroids are few, so draw them more opaque
+        orig_opacity = 0.4 if lod == "centroids" else 0.1
+        orig_streamlines_actor = actor.line(
+            orig_streamlines, orig_color, opacity=orig_opacity
+        )
+        actors.append(orig_streamlines_actor)
 
     if roi2 is not None:
-        roi2_data, affine, img = load_nifti(roi2, return_img=True)
-        roi2_mask = roi2_data > 0
-        roi2_actor = actor.contour_from_roi(roi2_mask, affine, roi2_color, roi_opacity)
-        figure.add(roi2_actor)
+        roi2_actor = roi_mesh_actor(
+            roi2, roi2_color, roi_opacity, cache_dir=roi_mesh_cache_dir
+        )
+        actors.append(roi2_actor)
 
     if show_anat:
-        data = reference_anatomy.get_data()
-        affine = reference_anatomy.affine
-
-        # restrict values for visualization
-        mean, std = data[data > 0].mean(), data[data > 0].std()
+        # restrict values for visualization, using a subsample of the anatomy
+        sample = anatomy_sample(reference_anatomy)
+        mean, std = sample.mean(), sample.std()
         value_range = (mean - 0.5 * std, mean + 1.5 * std)
 
-        # make slice actor
-        slice_actor = actor.slicer(data, affine, value_range)
+        # make axial and sagittal slice actors, reading only those slices
+        actors.append(
+            anatomy_slice_actor(reference_anatomy, "axial", axial_offset, value_range)
+        )
+        actors.append(
+            anatomy_slice_actor(
+                reference_anatomy, "sagittal", sagittal_offset, value_range
+            )
+        )
 
-        # calculate where to display the image based on the offset
-        axial_offset = (
-            slice_actor.shape[1] - (slice_actor.shape[1] // 2)
-        ) * axial_offset
-        slice_actor.display(None, None, slice_actor.shape[1] // 2 + int(axial_offset))
-        figure.add(slice_actor)
+    return actors
 
-        # add to figure
-        figure.add(slice_actor)
 
-        # make a copy to make a sagittal slice
-        sagittal_actor = slice_actor.copy()
+def visualize_sub_bundles(
+    fsub_bundle,
+    ref_anat,
+    fname,
+    roi1,
+    orig_bundle=None,
+    roi2=None,
+    orig_color=[0.8, 0.8, 0],
+    fsub_color=[0.2, 0.6, 1],
+    roi1_color=[0.2, 1, 1],
+    roi2_color=[1, 0.2, 1],
+    roi_opacity=0.7,
+    fsub_linewidth=3.0,
+    interactive=False,
+    show_anat=False,
+    axial_offset=0,
+    sagittal_offset=0,
+    camera_angle="sagittal",
+    hemi="lh",
+    orig_max_points=1000000,
+    orig_centroids=False,
+    views=None,
+    mosaic=False,
+    roi_mesh_cache_dir=None,
+):
+    """Takes in tck and nifti files and makes a fury visualization
 
-        # calculate where to display the image based on the offset
-        sagittal_offset = (
-            sagittal_actor.shape[0] - (sagittal_actor.shape[0] // 2)
-        ) * sagittal_offset
-        sagittal_actor.display(
-            sagittal_actor.shape[0] // 2 + int(sagittal_offset), None, None
-        )
-        figure.add(sagittal_actor)
+    Parameters
+    ==========
+    fsub_bundle: Sub bundle output (.tck), or its streamlines if already loaded
+    ref_anat: Reference anatomy (.nii.gz)
+    fig_path = Path to save the figure
+    fname = filename (.png)
+    roi1: ROI that was used to create sub bundle file (.nii.gz)
+    orig_bundle (Optional): Original bundle (.tck), or its streamlines if already loaded (e.g., from trk_to_tck),
+        or its (points, starts, ends) if already scanned (e.g., from extract_tck_mrtrix)
+    roi2 (Optional): Second ROI that was used to create pairwise sub-bundle (.nii.gz)
+    orig_color (Optional): Color for original bundle ([R,G,B])
+    fsub_color (Optional): Color for fsub bundle ([R,G,B])
+    roi1_color (Optional): Color for ROI1 ([R,G,B])
+    roi2_color (Optional): Color for ROI2 ([R,G,B])
+    Interactive (Optional): Make interactive fury visualization (True) or save out screenshot (default = False).
+        With views, the images are saved first and the window then opens at the first view.
+    show_anat (Optional): Whether to overlay anatomy on the figure (default = False)
+    axial_offset (Optional): Where to display axial slice (-1,1) where -1 is bottom of image and 1 is top.
+        (default = 0, which is the middle of the image)
+    sagittal_offset (Optional): Where to display sagittal slice (-1,1) where -1 is left of image and 1 is right.
+        (default = 0, which is the middle of the image)
+    camera_angle (Optional): Angle for screenshot ('saggital' (default) or 'axial')
+    hemi (Optional): For sagittal picture, what hemisphere to view from. Accepts either 'lh' or 'rh'.
+    orig_max_points (Optional): Point budget for the original bundle. Larger bundles are compressed and
+        subsampled to fit (default = 1000000)
+    orig_centroids (Optional): Draw QuickBundles centroids of the original bundle when it exceeds the budget
+        (default = False)
+    views (Optional): List of camera views (see CAMERA_VIEWS) to save from one built scene, instead of the single
+        camera_angle / hemi view. Each is saved to fname with a _view-{view} suffix (default = None)
+    mosaic (Optional): With views, tile all views into fname instead of saving separate images (default = False)
+    roi_mesh_cache_dir (Optional): Directory where ROI meshes are cached between renders (default = None, in-memory only)
 
-    cam = figure.GetActiveCamera()
-    cam.SetViewUp(0, 0, 0)
-    if camera_angle == "sagittal":
-        if hemi == "lh":
-            cam.Yaw(270)
-            cam.Roll(90)
+    Outputs
+    =======
+    Function saves out image(s) to the out_dir
+    """
 
-        if hemi == "rh":
-            cam.Yaw(90)
-            cam.Roll(270)
+    actors = build_sub_bundle_actors(
+        fsub_bundle,
+        ref_anat,
+        roi1,
+        orig_bundle=orig_bundle,
+        roi2=roi2,
+        orig_color=orig_color,
+        fsub_color=fsub_color,
+        roi1_color=roi1_color,
+        roi2_color=roi2_color,
+        roi_opacity=roi_opacity,
+        fsub_linewidth=fsub_linewidth,
+        show_anat=show_anat,
+        axial_offset=axial_offset,
+        sagittal_offset=sagittal_offset,
+        orig_max_points=orig_max_points,
+        orig_centroids=orig_centroids,
+        roi_mesh_cache_dir=roi_mesh_cache_dir,
+    )
+
+    # Record several views from the same actors; only the camera changes between them
+    if views != None:
+        renderer = BatchRenderer(size=(1200, 900))
+        if mosaic:
+            renderer.render_mosaic(actors, views, fname)
+        else:
+            renderer.render(
+                actors,
+                {view: fname.replace(".png", f"_view-{view}.png") for view in views},
+            )
+        renderer.close()
+        if interactive:
+            # Explore the same actors, starting from the first view
+            figure = window.Scene()
+            for fig_actor in actors:
+                figure.add(fig_actor)
+            set_camera_view(figure, views[0])
+            window.show(figure)
+        return
+
+    # Add actors to scene
+    figure = window.Scene()
+    for fig_actor in actors:
+        figure.add(fig_actor)
+
+    if camera_angle == "sagittal":
+        set_camera_view(figure, hemi)
+    else:
+        set_camera_view(figure, "axial")
 
     if interactive:
         window.show(figure)
@@ -152,6 +424,179 @@ def visualize_sub_bundles(
     window.record(figure, out_path=(fname), size=(1200, 900))
 
 
+class BatchRenderer:
+    """Offscreen renderer that keeps one scene and render window alive across many images,
+    so rendering a cohort does not pay the VTK/OpenGL start-up cost per subject."""
+
+    def __init__(self, size=(1200, 900)):
+        self.scene = window.Scene()
+        self.render_window = RenderWindow()
+        self.render_window.SetOffScreenRendering(1)
+        self.render_window.AddRenderer(self.scene)
+        self.render_window.SetSize(*size)
+
+    def show(self, actors):
+        """Replaces the actors in the scene"""
+        self.scene.clear()
+        for render_actor in actors:
+            self.scene.add(render_actor)
+
+    def capture(self, view):
+        """Renders the current actors from one camera view (see CAMERA_VIEWS) into an (H, W, 3) array"""
+        set_camera_view(self.scene, view)
+        self.render_window.Render()
+        window_to_image = WindowToImageFilter()
+        window_to_image.SetInput(self.render_window)
+        window_to_image.Update()
+        image = window_to_image.GetOutput()
+        width, height, _ = image.GetDimensions()
+        pixels = numpy_support.vtk_to_numpy(image.GetPointData().GetScalars())
+        # VTK images start at the bottom row
+        return pixels.reshape(height, width, -1)[::-1]
+
+    def render(self, actors, out_files):
+        """Shows actors (replacing the previous ones) and saves one image per camera view.
+        Parameters
+        ==========
+        actors: list of fury actors
+        out_files: dict mapping camera views (see CAMERA_VIEWS) to output paths (.png)
+
+        Outputs
+        =======
+        out_files: list of saved image paths
+        """
+        self.show(actors)
+        for view, out_file in out_files.items():
+            save_image(self.capture(view), out_file)
+
+        return list(out_files.values())
+
+    def render_mosaic(self, actors, views, out_file, n_cols=None):
+        """Shows actors (replacing the previous ones) and saves all camera views tiled into one image.
+        Parameters
+        ==========
+        actors: list of fury actors
+        views: list of camera views (see CAMERA_VIEWS), in reading order
+        out_file: output path (.png)
+        n_cols: number of views per row (default = as square a grid as possible)
+
+        Outputs
+        =======
+        out_file: saved image path
+        """
+        self.show(actors)
+        images = [self.capture(view) for view in views]
+        if n_cols == None:
+            n_cols = int(np.ceil(np.sqrt(len(images))))
+        n_rows = -(-len(images) // n_cols)
+        height, width, n_channels = images[0].shape
+        mosaic = np.zeros((n_rows * height, n_cols * width, n_channels), dtype=np.uint8)
+        for i, image in enumerate(images):
+            row, col = divmod(i, n_cols)
+            mosaic[row * height : (row + 1) * height, col * width : (col + 1) * width] = image
+        save_image(mosaic, out_file)
+
+        return out_file
+
+    def close(self):
+        """Releases the render window's graphics resources"""
+        self.scene.clear()
+        self.render_window.Finalize()
+
+
+# One renderer per batch worker process, and whether the worker profiles its jobs
+_WORKER_RENDERER = None
+_WORKER_PROFILING = False
+
+
+def _init_batch_worker(size, profile_dir=None, worker_subfolder=False):
+    """Sets up software (no-GPU) offscreen OpenGL and the worker's renderer"""
+    global _WORKER_RENDERER, _WORKER_PROFILING
+    os.environ.setdefault("LIBGL_ALWAYS_SOFTWARE", "1")
+    # Keep each worker's software rasterizer single-threaded; the pool provides parallelism
+    os.environ.setdefault("LP_NUM_THREADS", "1")
+    _WORKER_RENDERER = BatchRenderer(size)
+    if profile_dir != None:
+        set_profile_dir(
+            os.path.join(profile_dir, f"worker-{os.getpid()}")
+            if worker_subfolder
+            else profile_dir
+        )
+    _WORKER_PROFILING = profile_dir != None
+
+
+def _render_batch_job(job, views, mosaic):
+    """Builds one subject's actors and renders them from every view"""
+    job = dict(job)
+    fname_base = job.pop("fname_base")
+    with profile_stage(f"actors_{os.path.basename(fname_base)}"):
+        actors = build_sub_bundle_actors(**job)
+    with profile_stage(f"render_{os.path.basename(fname_base)}"):
+        if mosaic:
+            out_files = [
+                _WORKER_RENDERER.render_mosaic(
+                    actors, views, f"{fname_base}_view-mosaic.png"
+                )
+            ]
+        else:
+            out_files = _WORKER_RENDERER.render(
+                actors, {view: f"{fname_base}_view-{view}.png" for view in views}
+            )
+    if _WORKER_PROFILING:
+        # Workers keep their summary table up to date, since they are not told when the batch ends
+        print_profile_summary(verbose=False)
+    return out_files
+
+
+def render_sub_bundles_batch(
+    jobs,
+    views=["lh", "rh", "axial"],
+    n_procs=1,
+    size=(1200, 900),
+    mosaic=False,
+    profile_dir=None,
+):
+    """Renders QC images for many subjects headlessly, reusing one renderer per process.
+
+    Parameters
+    ==========
+    jobs: list of dicts, one per image set. Each holds 'fname_base' (output path without extension)
+        and the arguments of build_sub_bundle_actors (fsub_bundle, ref_anat, roi1, and optionally
+        orig_bundle, roi2, colors, etc.)
+    views (Optional): camera views to save for every job (see CAMERA_VIEWS).
+        Images are saved to {fname_base}_view-{view}.png
+    n_procs (Optional): Number of rendering processes (default = 1)
+    size (Optional): Image size in pixels, per view (default = (1200, 900))
+    mosaic (Optional): Save all views of a job tiled into {fname_base}_view-mosaic.png instead (default = False)
+    profile_dir (Optional): Profile building and rendering each job (see profile_stage) and save the
+        profiles here; with several processes, each worker saves to its own worker-{pid} subfolder
+
+    Outputs
+    =======
+    out_files: list with the saved image paths of each job
+    """
+
+    if n_procs == 1:
+        _init_batch_worker(size, profile_dir)
+        out_files = [_render_batch_job(job, views, mosaic) for job in jobs]
+        if profile_dir != None:
+            print_profile_summary()
+        return out_files
+
+    # Spawn (not fork) so each worker starts its own clean OpenGL context
+    with ProcessPoolExecutor(
+        max_workers=n_procs,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_batch_worker,
+        initargs=(size, profile_dir, True),
+    ) as executor:
+        return list(
+            executor.map(
+                _render_batch_job, jobs, [views] * len(jobs), [mosaic] * len(jobs)
+            )
+        )
+
+
 def define_streamline_actor(tck, reference_anatomy, color,opacity=1):
     """Takes in tck reference anatomy files and outputs a fury streamline actor.
     Parameters
@@ -199,9 +644,7 @@ def define_roi_actor(roi_path, color, opacity=1, roi_val=1):
     roi_actor to be added to a fury scene
     """
     if exists(roi_path):
-        roi_data, affine, img = load_nifti(roi_path, return_img=True)
-        roi_mask = roi_data == roi_val
-        roi_actor = actor.contour_from_roi(roi_mask, affine, color, opacity)
+        roi_actor = roi_mesh_actor(roi_path, color, opacity, roi_val=roi_val)
     else:
         roi_actor = None
     return roi_actor
@@ -224,24 +667,12 @@ def define_slice_actor(reference_anatomy, view="axial", offset=0):
     # read in reference anatomy
     reference_anatomy = nib.load(reference_anatomy)
 
-    data = reference_anatomy.get_fdata()
-    affine = reference_anatomy.affine
-
     # restrict values for visualization
-    mean, std = data[data > 0].mean(), data[data > 0].std()
-    min_val, max_val = data[data > 0].min(), data[data > 0].max()
-    value_range = (min_val, max_val)
+    sample = anatomy_sample(reference_anatomy)
+    value_range = (sample.min(), sample.max())
 
     # make slice actor
-    slice_actor = actor.slicer(data, affine, value_range)
-
-    # calculate where to display the image based on the offset
-    if view == "axial":
-        offset = (slice_actor.shape[1] - (slice_actor.shape[1] // 2)) * offset
-        slice_actor.display(None, None, slice_actor.shape[1] // 2 + int(offset))
-    if view == "sagittal":
-        offset = (slice_actor.shape[0] - (slice_actor.shape[0] // 2)) * offset
-        slice_actor.display(slice_actor.shape[0] // 2 + int(offset), None, None)
+    slice_actor = anatomy_slice_actor(reference_anatomy, view, offset, value_range)
 
     return slice_actor
 
@@ -1,9 +1,14 @@
 import os.path as op
 import os
+import re
+import threading
+import time
+import warnings
+from concurrent.futures import ThreadPoolExecutor
 from fsub_extractor.utils.system_utils import *
 
 
-def trk_to_tck(trk_file, out_dir=os.getcwd(), overwrite=True):
+def trk_to_tck(trk_file, out_dir=os.getcwd(), overwrite=True, return_streamlines=False):
     """Converts a .trk file to .tck using DIPY
     Parameters
     ==========
@@ -15,11 +20,15 @@ def trk_to_tck(trk_file, out_dir=os.getcwd(), overwrite=True):
             Path to output directory
     overwrite: bool
             Whether to allow overwriting outputs
+    return_streamlines: bool
+            Whether to also return the loaded streamlines, so later steps (e.g., visualization) do not reload them
 
     Outputs
     =======
     tck_file: str
             Path to output .tck file
+    streamlines: ArraySequence
+            Streamlines in RAS mm (only if return_streamlines is True)
     """
     from dipy.io.streamline import load_tractogram, save_tractogram
     import nibabel.filebasedimages
@@ -30,9 +39,1204 @@ def trk_to_tck(trk_file, out_dir=os.getcwd(), overwrite=True):
     tck_file = op.join(out_dir, filename)
     save_tractogram(trk_loaded, tck_file)
 
+    if return_streamlines:
+        return tck_file, trk_loaded.streamlines
     return tck_file
 
 
+def read_tck_header(tck_file):
+    """Reads the text header of a .tck file without loading any streamlines
+    Parameters
+    ==========
+    tck_file: str
+            Path to .tck file
+
+    Outputs
+    =======
+    header: dict
+            Header fields (e.g., 'count', 'total_count', 'datatype', 'file'), as strings
+    """
+
+    header = {}
+    with open(tck_file, "rb") as f:
+        if f.readline().strip() != b"mrtrix tracks":
+            raise Exception(f"{tck_file} is not a valid .tck file.")
+        for line in f:
+            line = line.decode("latin-1").strip()
+            if line == "END":
+                break
+            key, _, value = line.partition(":")
+            header[key.strip()] = value.strip()
+
+    return header
+
+
+def tck_acceptance(tck_file):
+    """Reports how many of the streamlines tckgen generated were selected into a .tck file
+    Parameters
+    ==========
+    tck_file: str
+            Path to .tck file written by tckgen
+
+    Outputs
+    =======
+    selected: int
+            Number of streamlines in the file
+    generated: int
+            Number of streamlines generated (accepted or rejected) by tckgen
+    rate: float
+            selected / generated (nan if nothing was generated)
+    """
+
+    header = read_tck_header(tck_file)
+    selected = int(header.get("count", 0))
+    generated = int(header.get("total_count", selected))
+    rate = selected / generated if generated > 0 else float("nan")
+
+    return selected, generated, rate
+
+
+_TCK_DATATYPES = {
+    "Float32LE": "<f4",
+    "Float32BE": ">f4",
+    "Float64LE": "<f8",
+    "Float64BE": ">f8",
+}
+
+
+def _tck_points(tck_file):
+    """Memory-maps the points of a .tck file, including streamline delimiters, as an (n_rows, 3) array"""
+    import numpy as np
+
+    header = read_tck_header(tck_file)
+    datatype = header.get("datatype", "Float32LE")
+    if datatype not in _TCK_DATATYPES:
+        raise Exception(f"Unsupported .tck datatype {datatype} in {tck_file}.")
+    dtype = np.dtype(_TCK_DATATYPES[datatype])
+    offset = int(header["file"].split()[-1])
+    n_rows = (op.getsize(tck_file) - offset) // (3 * dtype.itemsize)
+    return np.memmap(tck_file, dtype=dtype, mode="r", offset=offset, shape=(n_rows, 3))
+
+
+def tck_streamline_offsets(tck_file, chunk_points=2**22):
+    """Memory-maps the points of a .tck file and finds where each streamline starts and ends,
+    scanning the file in chunks rather than loading it
+    Parameters
+    ==========
+    tck_file: str
+            Path to .tck file
+    chunk_points: int
+            Number of points scanned at a time
+
+    Outputs
+    =======
+    points: numpy memmap
+            (n_points, 3) array of all points in the file, including streamline delimiters
+    starts: numpy array
+            Index in points of the first point of each streamline
+    ends: numpy array
+            Index in points one past the last point of each streamline
+    """
+    import numpy as np
+
+    points = _tck_points(tck_file)
+    n_rows = len(points)
+
+    # Streamlines are separated by NaN triplets, and the file ends with an Inf triplet
+    delimiters = []
+    n_valid = n_rows
+    for chunk_start in range(0, n_rows, chunk_points):
+        x = points[chunk_start : chunk_start + chunk_points, 0]
+        delimiters += [np.flatnonzero(np.isnan(x)) + chunk_start]
+        inf_rows = np.flatnonzero(np.isinf(x))
+        if len(inf_rows) > 0:
+            n_valid = chunk_start + inf_rows[0]
+            break
+    ends = np.concatenate(delimiters).astype(np.int64)
+    ends = ends[ends < n_valid]
+    starts = np.concatenate([[0], ends[:-1] + 1])[: len(ends)].astype(np.int64)
+
+    return points, starts, ends
+
+
+def _world_to_flat_voxels(points, affine, shape):
+    """Flat (C-order) index of the voxel each point (in RAS mm) falls in, -1 outside the grid"""
+    import numpy as np
+
+    inverse = np.linalg.inv(affine)
+    voxels = np.zeros(len(points), dtype=np.int64)
+    inside = np.ones(len(points), dtype=bool)
+    stride = 1
+    for axis in [2, 1, 0]:
+        # MRtrix rounds to the nearest voxel center
+        index = np.floor(points @ inverse[axis, :3] + (inverse[axis, 3] + 0.5))
+        # NaN points compare False, so are outside the grid
+        inside &= (index >= 0) & (index < shape[axis])
+        voxels += np.where(inside, index, 0).astype(np.int64) * stride
+        stride *= int(shape[axis])
+    voxels[~inside] = -1
+    return voxels
+
+
+def mask_streamlines(
+    tck_file,
+    starts,
+    ends,
+    exclude_mask=None,
+    include_mask=None,
+    streamline_mask=None,
+    chunk_streamlines=100000,
+):
+    """Applies masks to streamlines of a .tck file, evaluating all points of a chunk of streamlines
+    at once: streamlines with a point in exclude_mask are discarded, streamlines with no point in
+    include_mask are discarded, and the rest are truncated to their longest part inside
+    streamline_mask (discarded if no part of at least 2 points is inside).
+    Truncation is an approximation of tckedit -mask: keeping one part per streamline keeps each
+    output streamline matched to one input streamline (and its SIFT2 weight and assignments),
+    but other parts of a streamline inside the mask are dropped, which tckedit may keep.
+    Parameters
+    ==========
+    tck_file: str
+            Path to .tck file
+    starts: numpy array
+            Rows of the first point of each streamline to mask (see tck_streamline_offsets)
+    ends: numpy array
+            Rows one past the last point of each streamline to mask
+    exclude_mask: str
+            Path to exclusion mask (.nii.gz)
+    include_mask: str
+            Path to inclusion mask (.nii.gz)
+    streamline_mask: str
+            Path to truncation mask (.nii.gz)
+    chunk_streamlines: int
+            Number of streamlines evaluated at a time
+
+    Outputs
+    =======
+    kept: numpy array
+            Boolean mask with one value per input streamline
+    kept_starts: numpy array
+            Rows of the first point of each kept (and truncated) streamline
+    kept_ends: numpy array
+            Rows one past the last point of each kept (and truncated) streamline
+    """
+    import numpy as np
+    import nibabel as nib
+
+    points = _tck_points(tck_file)
+    starts = np.asarray(starts, dtype=np.int64)
+    ends = np.asarray(ends, dtype=np.int64)
+
+    masks = {}
+    for name, mask_file in [
+        ("exclude", exclude_mask),
+        ("include", include_mask),
+        ("truncate", streamline_mask),
+    ]:
+        if mask_file != None:
+            mask_img = nib.load(mask_file)
+            data = np.asanyarray(mask_img.dataobj)
+            data = data.reshape(data.shape[:3] + (-1,))[..., 0]
+            grid = (data.shape, tuple(np.round(mask_img.affine, 6).ravel()))
+            masks[name] = (np.append(data.reshape(-1) > 0, False), mask_img.affine, grid)
+
+    def in_mask(name, xyz, voxels_by_grid):
+        # Masks on the same grid share the voxel lookup. Index -1 (outside the grid) picks the appended False.
+        values, affine, grid = masks[name]
+        if grid not in voxels_by_grid:
+            voxels_by_grid[grid] = _world_to_flat_voxels(xyz, affine, grid[0])
+        return values[voxels_by_grid[grid]]
+
+    kept = ends > starts
+    kept_starts, kept_ends = starts.copy(), ends.copy()
+    for chunk_start in range(0, len(starts), chunk_streamlines):
+        chunk = slice(chunk_start, chunk_start + chunk_streamlines)
+        n_points = ends[chunk] - starts[chunk]
+        n_chunk = len(n_points)
+        owner = np.repeat(np.arange(n_chunk), n_points)
+        rows = np.repeat(starts[chunk] - np.cumsum(n_points) + n_points, n_points)
+        rows += np.arange(n_points.sum())
+        xyz = np.asarray(points[rows], dtype=np.float64)
+        voxels_by_grid = {}
+
+        keep = kept[chunk]
+        if "exclude" in masks:
+            keep &= np.bincount(owner[in_mask("exclude", xyz, voxels_by_grid)], minlength=n_chunk) == 0
+        if "include" in masks:
+            keep &= np.bincount(owner[in_mask("include", xyz, voxels_by_grid)], minlength=n_chunk) > 0
+        if "truncate" in masks:
+            inside = in_mask("truncate", xyz, voxels_by_grid)
+            same_next = np.append(owner[1:] == owner[:-1], False)
+            # Runs of consecutive points inside the mask, within each streamline
+            run_starts = np.flatnonzero(inside & ~np.insert(same_next[:-1] & inside[:-1], 0, False))
+            run_ends = np.flatnonzero(inside & ~(same_next & np.append(inside[1:], False)))
+            run_lengths = run_ends - run_starts + 1
+            long_enough = run_lengths >= 2
+            run_starts, run_ends = run_starts[long_enough], run_ends[long_enough]
+            run_lengths, run_owner = run_lengths[long_enough], owner[run_starts]
+            # The longest run of each streamline (the first one among equally long runs)
+            order = np.lexsort((run_starts, -run_lengths, run_owner))
+            longest = order[np.diff(run_owner[order], prepend=-1) != 0]
+            has_run = np.zeros(n_chunk, dtype=bool)
+            has_run[run_owner[longest]] = True
+            keep &= has_run
+            kept_starts[chunk][run_owner[longest]] = rows[run_starts[longest]]
+            kept_ends[chunk][run_owner[longest]] = rows[run_ends[longest]] + 1
+        kept[chunk] = keep
+
+    return kept, kept_starts[kept], kept_ends[kept]
+
+
+def endpoint_voxel_map(tck_file, reference, cache_dir=None):
+    """Finds the voxel of an image grid that each streamline endpoint falls in, so ROIs on that grid
+    can be evaluated without reading the tractogram again (see assign_endpoints). The map is cached
+    as a .npz file per tractogram and grid, and reused while the tractogram is unchanged.
+    Parameters
+    ==========
+    tck_file: str
+            Path to .tck file
+    reference: str
+            Path to an image (.nii.gz) on the target grid
+    cache_dir: str
+            Directory to store the map in. Default is next to the tractogram.
+
+    Outputs
+    =======
+    endpoint_map: dict
+            "voxels": (n_streamlines, 2) flat (C-order) voxel index of the first and last point of each
+            streamline, -1 outside the grid; "shape" and "affine" of the grid
+    """
+    import hashlib
+    import numpy as np
+    import nibabel as nib
+
+    ref_img = nib.load(reference)
+    shape = np.array(ref_img.shape[:3], dtype=np.int64)
+    affine = ref_img.affine
+    tck_stat = np.array([op.getsize(tck_file), os.stat(tck_file).st_mtime_ns], dtype=np.int64)
+
+    grid_key = hashlib.sha1(shape.tobytes() + np.round(affine, 6).tobytes()).hexdigest()[:10]
+    if cache_dir == None:
+        cache_dir = op.dirname(op.abspath(tck_file))
+    tck_base = op.splitext(op.basename(tck_file))[0]
+    cache_file = op.join(cache_dir, f"{tck_base}_grid-{grid_key}_desc-endpointvoxels.npz")
+    if op.exists(cache_file):
+        with np.load(cache_file) as cached:
+            if np.array_equal(cached["tck_stat"], tck_stat):
+                return {key: cached[key] for key in ["voxels", "shape", "affine"]}
+
+    points, starts, ends = tck_streamline_offsets(tck_file)
+    # Points of empty streamlines are NaN, and so are outside the grid
+    endpoints = np.stack([points[starts], points[ends - 1]], axis=1).reshape(-1, 3)
+    voxels = _world_to_flat_voxels(endpoints, affine, shape)
+    voxels = voxels.astype(np.int32 if shape.prod() < 2**31 else np.int64)
+    endpoint_map = {"voxels": voxels.reshape(-1, 2), "shape": shape, "affine": affine}
+
+    try:
+        with open(cache_file, "wb") as f:
+            np.savez(f, tck_stat=tck_stat, **endpoint_map)
+    except OSError:
+        warnings.warn(f"Could not cache endpoint voxels of {tck_file} in {cache_dir}.")
+    return endpoint_map
+
+
+def assign_endpoints(endpoint_map, atlas):
+    """Assigns each streamline end to the atlas node its voxel is in, as tck2connectome
+    -assignment_end_voxels does, with a single lookup per endpoint
+    Parameters
+    ==========
+    endpoint_map: dict
+            Output of endpoint_voxel_map for the atlas grid
+    atlas: str
+            Path to atlas-like image (.nii.gz), with nodes labelled 1 to N
+
+    Outputs
+    =======
+    assignments: numpy array
+            (n_streamlines, 2) node assignments (see read_assignments)
+    """
+    import numpy as np
+    import nibabel as nib
+
+    atlas_img = nib.load(atlas)
+    if tuple(atlas_img.shape[:3]) != tuple(endpoint_map["shape"]) or np.allclose(
+        atlas_img.affine, endpoint_map["affine"]
+    ) == False:
+        raise Exception(f"Atlas {atlas} is not on the grid of the endpoint voxel map.")
+    labels = np.rint(np.asanyarray(atlas_img.dataobj).reshape(-1)).astype(np.int64)
+
+    voxels = endpoint_map["voxels"]
+    return np.where(voxels >= 0, labels[voxels], 0)
+
+
+def tck_streamline_lengths(tck_file, chunk_points=2**22):
+    """Computes the length (in mm) of every streamline of a .tck file, reading it in chunks
+    Parameters
+    ==========
+    tck_file: str
+            Path to .tck file
+    chunk_points: int
+            Number of points read at a time (whole streamlines are always read together)
+
+    Outputs
+    =======
+    lengths: numpy array
+            float64 length of each streamline
+    """
+    import numpy as np
+
+    points, starts, ends = tck_streamline_offsets(tck_file)
+    lengths = np.zeros(len(starts))
+    first = 0
+    while first < len(starts):
+        # Consecutive streamlines are contiguous in the file, so each chunk is one block of rows
+        last = max(np.searchsorted(ends, starts[first] + chunk_points, side="right"), first + 1)
+        block = np.asarray(points[starts[first] : ends[last - 1]], dtype=np.float64)
+        # Segments across a NaN delimiter count as 0
+        segments = np.nan_to_num(np.linalg.norm(np.diff(block, axis=0), axis=1))
+        cumulative = np.concatenate([[0], np.cumsum(segments)])
+        lengths[first:last] = (
+            cumulative[ends[first:last] - 1 - starts[first]]
+            - cumulative[starts[first:last] - starts[first]]
+        )
+        first = last
+    return lengths
+
+
+def read_tck_streamlines(tck_file, indices=None):
+    """Reads some or all streamlines of a .tck file (in RAS mm), without parsing the rest of the file
+    Parameters
+    ==========
+    tck_file: str
+            Path to .tck file
+    indices: array-like
+            Indices of the streamlines to read. Default is all streamlines.
+
+    Outputs
+    =======
+    streamlines: list
+            One (n_points, 3) float32 array per streamline
+    """
+    import numpy as np
+
+    points, starts, ends = tck_streamline_offsets(tck_file)
+    if indices is None:
+        indices = range(len(starts))
+    return [
+        np.asarray(points[starts[i] : ends[i]], dtype=np.float32) for i in indices
+    ]
+
+
+def write_tck_subset(
+    tck_file,
+    indices,
+    out_file,
+    chunk_streamlines=100000,
+    overwrite=True,
+    offsets=None,
+    total_count=None,
+):
+    """Copies some streamlines of a .tck file into a new .tck file, reading only their bytes
+    (through a memory map) and keeping the input's header fields and point format
+    Parameters
+    ==========
+    tck_file: str
+            Path to input .tck file
+    indices: array-like
+            Indices of the streamlines to copy, in the order to write them
+    out_file: str
+            Path to output .tck file
+    chunk_streamlines: int
+            Number of streamlines copied at a time
+    overwrite: bool
+            Whether to allow overwriting outputs
+    offsets: tuple
+            Known (starts, ends) of the streamlines to copy, as from tck_streamline_offsets but only for
+            the given indices, which spares scanning the input for them. The rows may also be part of
+            each streamline (see mask_streamlines).
+    total_count: int
+            Number of streamlines generated, for the header. Default is that of the input.
+
+    Outputs
+    =======
+    out_file: str
+            Path to output .tck file
+    """
+    import numpy as np
+
+    if overwrite == False:
+        overwrite_check(out_file)
+
+    indices = np.asarray(indices, dtype=np.int64)
+    if offsets == None:
+        points, starts, ends = tck_streamline_offsets(tck_file)
+        starts, ends = starts[indices], ends[indices]
+    else:
+        points = _tck_points(tck_file)
+        starts, ends = [np.asarray(rows, dtype=np.int64) for rows in offsets]
+
+    # Keep every header line except the ones that change; the total count stays that of the input
+    header_lines = []
+    with open(tck_file, "rb") as f:
+        f.readline()
+        for line in f:
+            line = line.decode("latin-1").rstrip("\n")
+            if line.strip() == "END":
+                break
+            if line.split(":")[0].strip() not in ["count", "total_count", "file"]:
+                header_lines += [line]
+    if total_count == None:
+        input_header = read_tck_header(tck_file)
+        total_count = input_header.get("total_count", input_header["count"])
+    header_lines += [f"total_count: {total_count}"]
+    header = "mrtrix tracks\n" + "".join(line + "\n" for line in header_lines)
+    header += f"count: {len(indices)}\n"
+    # The data offset is part of the header, so pad it to a fixed width
+    offset = len(header) + len("file: . 0000000000\nEND\n")
+    header += f"file: . {offset:010d}\nEND\n"
+
+    tmp_file = out_file + ".tmp"
+    with open(tmp_file, "wb") as f:
+        f.write(header.encode("latin-1"))
+        for chunk_start in range(0, len(indices), chunk_streamlines):
+            chunk = slice(chunk_start, chunk_start + chunk_streamlines)
+            # Each streamline's points, followed by a NaN delimiter
+            n_points = ends[chunk] - starts[chunk]
+            streamline = np.repeat(np.arange(len(n_points)), n_points)
+            rows = np.repeat(starts[chunk] - np.cumsum(n_points) + n_points, n_points)
+            rows += np.arange(n_points.sum())
+            block = np.full((n_points.sum() + len(n_points), 3), np.nan, dtype=points.dtype)
+            block[np.arange(n_points.sum()) + streamline] = points[rows]
+            f.write(block.tobytes())
+        f.write(np.full(3, np.inf, dtype=points.dtype).tobytes())
+    os.replace(tmp_file, out_file)
+
+    return out_file
+
+
+def tck_to_trx(
+    tck_file,
+    out_file,
+    reference,
+    data_per_streamline=None,
+    float16=False,
+    overwrite=True,
+):
+    """Saves a .tck file as TRX (an uncompressed zip of arrays that can be memory-mapped when loaded),
+    optionally with per-streamline data such as SIFT2 weights, ROI assignments or scalar means.
+    Needs the trx-python package.
+    Parameters
+    ==========
+    tck_file: str
+            Path to .tck file
+    out_file: str
+            Path to output .trx file
+    reference: str
+            Path to image (.nii.gz) in the same space as the streamlines (sets the TRX grid)
+    data_per_streamline: dict
+            Name -> array with one value (or row of values) per streamline
+    float16: bool
+            Whether to store points as float16 (half the size; about 0.06 mm precision at 100 mm)
+    overwrite: bool
+            Whether to allow overwriting outputs
+
+    Outputs
+    =======
+    out_file: str
+            Path to output .trx file
+    """
+    import numpy as np
+    import nibabel as nib
+    from nibabel.streamlines import ArraySequence
+    from dipy.io.stateful_tractogram import Space, StatefulTractogram
+
+    try:
+        from trx.trx_file_memmap import TrxFile, save as save_trx
+    except ImportError:
+        raise Exception(
+            "Saving TRX files needs the trx-python package (pip install trx-python)."
+        )
+
+    if overwrite == False:
+        overwrite_check(out_file)
+
+    # Drop the streamline delimiters to get contiguous points and offsets, without per-streamline copies
+    points, starts, ends = tck_streamline_offsets(tck_file)
+    n_valid = int(ends[-1]) if len(ends) > 0 else 0
+    keep = np.ones(n_valid, dtype=bool)
+    keep[ends[:-1]] = False
+    # TRX takes the point and per-streamline data types from these arrays
+    streamlines = ArraySequence()
+    streamlines._data = np.asarray(
+        points[:n_valid][keep], dtype=np.float16 if float16 else np.float32
+    )
+    streamlines._offsets = starts - np.arange(len(starts))
+    streamlines._lengths = ends - starts
+
+    data_per_streamline = {} if data_per_streamline == None else data_per_streamline
+    for name, values in data_per_streamline.items():
+        if len(values) != len(starts):
+            raise Exception(
+                f"{name} has {len(values)} values, but {tck_file} has {len(starts)} streamlines."
+            )
+    sft = StatefulTractogram(
+        streamlines,
+        nib.load(reference),
+        Space.RASMM,
+        data_per_streamline={
+            name: np.asarray(values).reshape(
+                len(starts), int(np.prod(np.shape(values)[1:]))
+            )
+            for name, values in data_per_streamline.items()
+        },
+    )
+    trx = TrxFile.from_sft(sft)
+    save_trx(trx, out_file)
+    trx.close()
+
+    return out_file
+
+
+def subsample_streamline_indices(n_streamlines, n_target, method="stratified", seed=0):
+    """Picks which streamlines to keep when thinning a tractogram
+    Parameters
+    ==========
+    n_streamlines: int
+            Number of streamlines in the tractogram
+    n_target: int
+            Number of streamlines to keep
+    method: str
+            'random' (uniform without replacement) or 'stratified' (one random streamline from each of
+            n_target equal blocks of the file, which spreads picks across seeding order / tckgen threads)
+    seed: int
+            Random seed
+
+    Outputs
+    =======
+    indices: numpy array
+            Sorted indices of the kept streamlines
+    """
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    n_target = int(min(max(n_target, 1), n_streamlines))
+    if method == "random":
+        return np.sort(rng.choice(n_streamlines, n_target, replace=False))
+    elif method == "stratified":
+        edges = np.linspace(0, n_streamlines, n_target + 1).astype(np.int64)
+        return edges[:-1] + (rng.random(n_target) * np.diff(edges)).astype(np.int64)
+    else:
+        raise Exception(f"Unknown subsampling method {method}.")
+
+
+def _streamline_source(tractogram):
+    """Gives the per-streamline point counts of a tractogram and a reader for a subset of it.
+    The tractogram can be a .tck path (read through a memory map), the (points, starts, ends) of a .tck
+    file that was already scanned (see tck_streamline_offsets), or streamlines already in memory."""
+    import numpy as np
+
+    if isinstance(tractogram, (str, tuple)):
+        if isinstance(tractogram, str):
+            points, starts, ends = tck_streamline_offsets(tractogram)
+        else:
+            points, starts, ends = tractogram
+        read = lambda indices: [
+            np.asarray(points[starts[i] : ends[i]], dtype=np.float32) for i in indices
+        ]
+        return ends - starts, read
+    lengths = np.array([len(streamline) for streamline in tractogram], dtype=np.int64)
+    read = lambda indices: [
+        np.asarray(tractogram[i], dtype=np.float32) for i in indices
+    ]
+    return lengths, read
+
+
+def decimate_streamlines(
+    tractogram,
+    max_points=1000000,
+    compress_tol=0.5,
+    centroids=False,
+    qb_threshold=10.0,
+    method="stratified",
+    seed=0,
+):
+    """Reduces a tractogram to a level of detail that fits a rendering budget. In order, it tries:
+    the full tractogram; point-compressed streamlines; a subsample of compressed streamlines; and,
+    if requested, QuickBundles centroids of the subsample. Only the streamlines that are kept are read from disk.
+    Parameters
+    ==========
+    tractogram: str, tuple or list
+            Path to .tck file, its (points, starts, ends) if already scanned (see tck_streamline_offsets),
+            or streamlines already in memory (e.g., from trk_to_tck)
+    max_points: int
+            Maximum number of points to return
+    compress_tol: float
+            Maximum deviation (mm) allowed when removing points from streamlines
+    centroids: bool
+            Whether to replace the subsample by QuickBundles centroids when the full tractogram does not fit the budget
+    qb_threshold: float
+            QuickBundles distance threshold (mm)
+    method: str
+            Subsampling method ('stratified' or 'random')
+    seed: int
+            Random seed for subsampling
+
+    Outputs
+    =======
+    streamlines: list
+            Decimated streamlines, as (n_points, 3) float32 arrays in RAS mm
+    lod: str
+            Level of detail used ('full', 'compressed', 'subsampled' or 'centroids')
+    """
+    import numpy as np
+    from dipy.tracking.streamlinespeed import compress_streamlines
+
+    lengths, read = _streamline_source(tractogram)
+    n_streamlines = len(lengths)
+    n_points = int(lengths.sum())
+    if n_points <= max_points:
+        return read(range(n_streamlines)), "full"
+
+    # Estimate how much compression shrinks streamlines from a small sample
+    sample = subsample_streamline_indices(n_streamlines, 1000, "random", seed)
+    sample_points = int(lengths[sample].sum())
+    compressed_points = sum(
+        len(s) for s in compress_streamlines(read(sample), compress_tol)
+    )
+    compression = compressed_points / max(sample_points, 1)
+    if n_points * compression <= max_points:
+        streamlines = compress_streamlines(read(range(n_streamlines)), compress_tol)
+        return streamlines, "compressed"
+
+    points_per_streamline = compression * n_points / n_streamlines
+    indices = subsample_streamline_indices(
+        n_streamlines, max_points / points_per_streamline, method, seed
+    )
+    streamlines = compress_streamlines(read(indices), compress_tol)
+    if centroids == False:
+        return streamlines, "subsampled"
+
+    from dipy.segment.clustering import QuickBundles
+
+    clusters = QuickBundles(threshold=qb_threshold, metric="MDF_12points").cluster(
+        streamlines
+    )
+    return [np.asarray(c, dtype=np.float32) for c in clusters.centroids], "centroids"
+
+
+def _read_number_file(number_file):
+    """Reads all numbers of an MRtrix-style text file (space, comma or newline separated,
+    lines starting with '#' are comments) into a float64 array"""
+    import numpy as np
+
+    with open(number_file) as f:
+        text = f.read()
+    if "#" in text:
+        text = re.sub(r"^#.*$", "", text, flags=re.MULTILINE)
+    if "," in text:
+        text = text.replace(",", " ")
+    return np.fromstring(text, dtype=np.float64, sep=" ")
+
+
+def load_sift2_weights(weights_file):
+    """Loads per-streamline SIFT2 weights as float32. The parsed weights are cached as a binary .npy
+    file next to the text file, so later runs skip parsing it.
+    Parameters
+    ==========
+    weights_file: str
+            Path to SIFT2 weights file (.csv or .txt, as written by tcksift2), or an already-cached .npy
+
+    Outputs
+    =======
+    weights: numpy array
+            One float32 weight per streamline
+    """
+    import numpy as np
+
+    if weights_file[-4:] == ".npy":
+        return np.load(weights_file)
+
+    cache_file = op.splitext(weights_file)[0] + ".npy"
+    if op.exists(cache_file) and op.getmtime(cache_file) >= op.getmtime(weights_file):
+        return np.load(cache_file)
+
+    weights = _read_number_file(weights_file).astype(np.float32)
+    try:
+        np.save(cache_file, weights)
+    except OSError:
+        warnings.warn(f"Could not cache SIFT2 weights next to {weights_file}.")
+    return weights
+
+
+def save_sift2_weights(weights, out_file, overwrite=True):
+    """Saves SIFT2 weights as text (one per line, readable by MRtrix -tck_weights_in)
+    and as a binary .npy file with the same name
+    Parameters
+    ==========
+    weights: numpy array
+            One weight per streamline
+    out_file: str
+            Path to the text file (.csv or .txt)
+    overwrite: bool
+            Whether to allow overwriting outputs
+
+    Outputs
+    =======
+    out_file: str
+            Path to the text file
+    """
+    import numpy as np
+
+    npy_file = op.splitext(out_file)[0] + ".npy"
+    if overwrite == False:
+        overwrite_check(out_file)
+        overwrite_check(npy_file)
+    np.savetxt(out_file, weights, fmt="%.9g")
+    np.save(npy_file, np.asarray(weights, dtype=np.float32))
+
+    return out_file
+
+
+def save_assignments(assignments, out_file, overwrite=True):
+    """Saves streamline-to-node assignments as a compact binary file (.npz). Only streamlines with at
+    least one assigned end are stored (as their indices and node pairs), with uint16 nodes if possible.
+    Parameters
+    ==========
+    assignments: numpy array
+            (n_streamlines, 2) node assignments (see read_assignments)
+    out_file: str
+            Path to output .npz file
+    overwrite: bool
+            Whether to allow overwriting outputs
+
+    Outputs
+    =======
+    out_file: str
+            Path to output .npz file
+    """
+    import numpy as np
+
+    if overwrite == False:
+        overwrite_check(out_file)
+
+    assigned = np.flatnonzero(assignments.max(axis=1) > 0)
+    node_dtype = np.uint16 if assignments.max(initial=0) < 2**16 else np.uint32
+    index_dtype = np.uint32 if len(assignments) < 2**32 else np.uint64
+    with open(out_file, "wb") as f:
+        np.savez(
+            f,
+            n_streamlines=np.int64(len(assignments)),
+            streamlines=assigned.astype(index_dtype),
+            nodes=assignments[assigned].astype(node_dtype),
+        )
+
+    return out_file
+
+
+def read_assignments(assignments_file):
+    """Reads streamline-to-node assignments, either saved by save_assignments (.npz)
+    or written as text by tck2connectome -out_assignments
+    Parameters
+    ==========
+    assignments_file: str
+            Path to assignments file
+
+    Outputs
+    =======
+    assignments: numpy array
+            (n_streamlines, 2) array of the node assigned to each end of each streamline (0 = unassigned)
+    """
+    import numpy as np
+
+    if assignments_file[-4:] == ".npz":
+        with np.load(assignments_file) as saved:
+            assignments = np.zeros((int(saved["n_streamlines"]), 2), dtype=np.int64)
+            assignments[saved["streamlines"]] = saved["nodes"]
+        return assignments
+    return _read_number_file(assignments_file).astype(np.int64).reshape(-1, 2)
+
+
+def build_parcel_index(assignments, out_file, tck_file=None, overwrite=True):
+    """Builds an on-disk index of the streamlines between every pair of parcels (nodes), so the
+    sub-bundle of any parcel pair or set is found by lookup (see query_parcel_index)
+    Parameters
+    ==========
+    assignments: numpy array
+            (n_streamlines, 2) node assignments (see read_assignments)
+    out_file: str
+            Path to output .npz file
+    tck_file: str
+            Path to the tractogram the assignments come from. Its path and the point rows of the
+            indexed streamlines are recorded, so queries copy streamlines without scanning it.
+    overwrite: bool
+            Whether to allow overwriting outputs
+
+    Outputs
+    =======
+    out_file: str
+            Path to output .npz file, holding the sorted node pairs ("edges") with at least one
+            assigned end and, for edge i, the streamline indices streamlines[indptr[i]:indptr[i + 1]]
+            (and their rows in the tractogram, starts and ends, if tck_file is given)
+    """
+    import numpy as np
+
+    if overwrite == False:
+        overwrite_check(out_file)
+
+    n_nodes = max(int(assignments.max(initial=0)), 1)
+    assigned = np.flatnonzero(assignments.max(axis=1) > 0)
+    pairs = np.sort(assignments[assigned], axis=1)
+    keys = pairs[:, 0] * (n_nodes + 1) + pairs[:, 1]
+    # Stable, so streamlines keep their tractogram order within each edge
+    order = np.argsort(keys, kind="stable")
+    edge_keys, edge_starts = np.unique(keys[order], return_index=True)
+
+    saved = {
+        "n_streamlines": np.int64(len(assignments)),
+        "n_nodes": np.int64(n_nodes),
+        "edges": np.stack([edge_keys // (n_nodes + 1), edge_keys % (n_nodes + 1)], axis=1),
+        "indptr": np.append(edge_starts, len(order)).astype(np.int64),
+        "streamlines": assigned[order].astype(
+            np.uint32 if len(assignments) < 2**32 else np.uint64
+        ),
+    }
+    if tck_file != None:
+        _, starts, ends = tck_streamline_offsets(tck_file)
+        if len(starts) != len(assignments):
+            raise Exception(
+                f"{tck_file} has {len(starts)} streamlines, but there are {len(assignments)} assignments."
+            )
+        saved["tck_file"] = np.array(op.abspath(tck_file))
+        saved["tck_size"] = np.int64(op.getsize(tck_file))
+        saved["starts"] = starts[saved["streamlines"]]
+        saved["ends"] = ends[saved["streamlines"]]
+    with open(out_file, "wb") as f:
+        np.savez(f, **saved)
+
+    return out_file
+
+
+def load_parcel_index(index_file):
+    """Loads a parcel index saved by build_parcel_index
+    Outputs
+    =======
+    index: dict
+            Arrays of the index (see build_parcel_index)
+    """
+    import numpy as np
+
+    with np.load(index_file) as saved:
+        return {key: saved[key] for key in saved.files}
+
+
+def query_parcel_index(index, nodes, to_nodes=None, keep_self=False):
+    """Finds the streamlines between parcels by index lookup
+    Parameters
+    ==========
+    index: dict
+            Output of load_parcel_index
+    nodes: list
+            Node indices. Without to_nodes, finds the streamlines with both ends among these nodes,
+            as select_assignments does (include 0 to allow one unassigned end)
+    to_nodes: list
+            Node indices. If given, finds the streamlines with one end among nodes and the other
+            among to_nodes
+    keep_self: bool
+            Whether to keep streamlines with both ends in the same node
+
+    Outputs
+    =======
+    streamlines: numpy array
+            Sorted indices of the streamlines in the tractogram
+    """
+
+    positions = _parcel_index_positions(index, nodes, to_nodes, keep_self)
+    return index["streamlines"][positions].astype("int64")
+
+
+def _parcel_index_positions(index, nodes, to_nodes, keep_self):
+    """Positions in the index arrays of the streamlines found by query_parcel_index, in tractogram order"""
+    import numpy as np
+
+    nodes = np.unique(nodes)
+    to_nodes = nodes if to_nodes is None else np.unique(to_nodes)
+    pairs = np.sort(np.stack(np.meshgrid(nodes, to_nodes), axis=-1).reshape(-1, 2), axis=1)
+    pairs = np.unique(pairs, axis=0)
+    pairs = pairs[pairs[:, 1] > 0]
+    if keep_self == False:
+        pairs = pairs[pairs[:, 0] != pairs[:, 1]]
+
+    n_nodes = int(index["n_nodes"])
+    edges = index["edges"].astype(np.int64)
+    found = np.flatnonzero(
+        np.isin(
+            edges[:, 0] * (n_nodes + 1) + edges[:, 1],
+            pairs[:, 0] * (n_nodes + 1) + pairs[:, 1],
+        )
+    )
+    indptr = index["indptr"]
+    positions = np.concatenate(
+        [np.arange(indptr[i], indptr[i + 1]) for i in found] + [np.zeros(0, dtype=np.int64)]
+    )
+    return positions[np.argsort(index["streamlines"][positions], kind="stable")]
+
+
+def extract_parcel_bundle(
+    index_file,
+    out_file,
+    nodes,
+    to_nodes=None,
+    tck_file=None,
+    keep_self=False,
+    overwrite=True,
+):
+    """Extracts the sub-bundle between parcels by looking up the streamlines in a parcel index
+    (see build_parcel_index) and copying them from the tractogram (see write_tck_subset)
+    Parameters
+    ==========
+    index_file: str
+            Path to parcel index (.npz)
+    out_file: str
+            Path to output .tck file
+    nodes: list
+            Node indices (see query_parcel_index)
+    to_nodes: list
+            Node indices (see query_parcel_index)
+    tck_file: str
+            Path to the tractogram. Default is the one recorded in the index.
+    keep_self: bool
+            Whether to keep streamlines with both ends in the same node
+    overwrite: bool
+            Whether to allow overwriting outputs
+
+    Outputs
+    =======
+    out_file: str
+            Path to output .tck file
+    n_streamlines: int
+            Number of streamlines extracted
+    """
+
+    index = load_parcel_index(index_file)
+    if tck_file == None:
+        if "tck_file" not in index:
+            raise Exception(f"{index_file} does not record its tractogram, so one must be given.")
+        tck_file = str(index["tck_file"])
+    if "tck_size" in index and op.getsize(tck_file) != int(index["tck_size"]):
+        raise Exception(f"{tck_file} is not the tractogram {index_file} was built from.")
+
+    positions = _parcel_index_positions(index, nodes, to_nodes, keep_self)
+    offsets = None
+    if "starts" in index:
+        offsets = (index["starts"][positions], index["ends"][positions])
+    write_tck_subset(
+        tck_file, index["streamlines"][positions], out_file, overwrite=overwrite, offsets=offsets
+    )
+
+    return out_file, len(positions)
+
+
+def select_assignments(assignments, nodes, keep_self=False):
+    """Finds the streamlines that connectome2tck -nodes <nodes> -exclusive would keep:
+    both ends assigned to one of the nodes, excluding unassigned streamlines and self-connections
+    Parameters
+    ==========
+    assignments: numpy array
+            (n_streamlines, 2) node assignments (see read_assignments)
+    nodes: list
+            Node indices
+    keep_self: bool
+            Whether to keep streamlines with both ends in the same node
+
+    Outputs
+    =======
+    selection: numpy array
+            Boolean mask with one value per streamline
+    """
+    import numpy as np
+
+    selection = np.isin(assignments, nodes).all(axis=1) & (assignments.max(axis=1) > 0)
+    if keep_self == False:
+        selection &= assignments[:, 0] != assignments[:, 1]
+    return selection
+
+
+def weighted_connectome(assignments, weights, n_nodes):
+    """Sums streamline weights between every pair of nodes, as tck2connectome -tck_weights_in does
+    Parameters
+    ==========
+    assignments: numpy array
+            (n_streamlines, 2) node assignments (see read_assignments)
+    weights: numpy array
+            One weight per streamline
+    n_nodes: int
+            Number of nodes (the largest node index)
+
+    Outputs
+    =======
+    connectome: numpy array
+            (n_nodes, n_nodes) upper-triangular matrix; unassigned streamlines are left out
+    """
+    import numpy as np
+
+    if len(weights) != len(assignments):
+        raise Exception(
+            f"Number of SIFT2 weights ({len(weights)}) does not match the number of streamlines ({len(assignments)})."
+        )
+    assigned = assignments.min(axis=1) > 0
+    rows = assignments[assigned].min(axis=1) - 1
+    cols = assignments[assigned].max(axis=1) - 1
+    connectome = np.zeros((n_nodes, n_nodes))
+    np.add.at(connectome, (rows, cols), weights[assigned])
+    return connectome
+
+
+def connectome_edges(assignments, weights=None, lengths=None):
+    """Summarizes the streamlines between every pair of nodes that is connected at least once
+    Parameters
+    ==========
+    assignments: numpy array
+            (n_streamlines, 2) node assignments (see read_assignments)
+    weights: numpy array
+            One SIFT2 weight per streamline (optional)
+    lengths: numpy array
+            One length per streamline (optional, see tck_streamline_lengths)
+
+    Outputs
+    =======
+    edges: dict
+            "edges": (n_edges, 2) node pairs (lower node first), and one value per edge for
+            "count", "sift2_weight" (if weights are given) and "mean_length" (if lengths are given);
+            unassigned streamline ends are left out, as in tck2connectome's connectome
+    """
+    import numpy as np
+
+    for name, values in [("SIFT2 weights", weights), ("streamline lengths", lengths)]:
+        if values is not None and len(values) != len(assignments):
+            raise Exception(
+                f"Number of {name} ({len(values)}) does not match the number of streamlines ({len(assignments)})."
+            )
+    assigned = np.flatnonzero(assignments.min(axis=1) > 0)
+    pairs = np.sort(assignments[assigned], axis=1)
+    edge_pairs, edge_index, counts = np.unique(
+        pairs, axis=0, return_inverse=True, return_counts=True
+    )
+    edge_index = edge_index.ravel()
+
+    edges = {"edges": edge_pairs, "count": counts}
+    if weights is not None:
+        edges["sift2_weight"] = np.bincount(
+            edge_index, weights=weights[assigned], minlength=len(counts)
+        )
+    if lengths is not None:
+        edges["mean_length"] = (
+            np.bincount(edge_index, weights=lengths[assigned], minlength=len(counts))
+            / counts
+        )
+    return edges
+
+
+def save_connectome(edges, n_nodes, out_file, node_names=None, overwrite=True):
+    """Saves connectome edges (see connectome_edges) as a compact binary file (.npz), storing only
+    connected node pairs instead of full matrices
+    Parameters
+    ==========
+    edges: dict
+            Output of connectome_edges
+    n_nodes: int
+            Number of nodes (the largest node index)
+    out_file: str
+            Path to output .npz file
+    node_names: list
+            Name of each node, in node order (optional)
+    overwrite: bool
+            Whether to allow overwriting outputs
+
+    Outputs
+    =======
+    out_file: str
+            Path to output .npz file
+    """
+    import numpy as np
+
+    if overwrite == False:
+        overwrite_check(out_file)
+    if node_names != None and len(node_names) != n_nodes:
+        raise Exception(
+            f"Number of node names ({len(node_names)}) does not match the number of nodes ({n_nodes})."
+        )
+
+    saved = {
+        "n_nodes": np.int64(n_nodes),
+        "edges": edges["edges"].astype(np.uint16 if n_nodes < 2**16 else np.uint32),
+        "count": edges["count"].astype(np.uint32),
+    }
+    for measure in ["sift2_weight", "mean_length"]:
+        if measure in edges:
+            saved[measure] = edges[measure].astype(np.float32)
+    if node_names != None:
+        saved["node_names"] = np.array(node_names)
+    with open(out_file, "wb") as f:
+        np.savez_compressed(f, **saved)
+
+    return out_file
+
+
+def load_connectome(connectome_file, measure="count"):
+    """Loads one measure of a connectome saved by save_connectome as a full matrix
+    Parameters
+    ==========
+    connectome_file: str
+            Path to .npz file
+    measure: str
+            "count", "sift2_weight" or "mean_length"
+
+    Outputs
+    =======
+    connectome: numpy array
+            (n_nodes, n_nodes) upper-triangular matrix, in the same layout as tck2connectome's
+    """
+    import numpy as np
+
+    with np.load(connectome_file) as saved:
+        if measure not in saved:
+            raise Exception(f"{connectome_file} has no {measure} values.")
+        n_nodes = int(saved["n_nodes"])
+        edges = saved["edges"].astype(np.int64) - 1
+        connectome = np.zeros((n_nodes, n_nodes))
+        connectome[edges[:, 0], edges[:, 1]] = saved[measure]
+    return connectome
+
+
+def merge_tck_files(tck_files, outfile, overwrite=True):
+    """Concatenates .tck files into one (wrapper around tckedit)
+    Parameters
+    ==========
+    tck_files: list
+            Paths to .tck files to merge
+    outfile: str
+            Path to merged .tck file
+    overwrite: bool
+            Whether to allow overwriting outputs
+
+    Outputs
+    =======
+    outfile: str
+            Path to merged .tck file
+    """
+
+    tckedit = find_program("tckedit")
+    cmd_tckedit = [tckedit, *tck_files, outfile]
+    if overwrite:
+        cmd_tckedit += ["-force"]
+    else:
+        overwrite_check(outfile)
+
+    run_command(cmd_tckedit)
+
+    return outfile
+
+
 def extract_tck_mrtrix(
     tck_file,
     rois_in,
@@ -45,6 +1249,11 @@ def extract_tck_mrtrix(
     include_mask=None,
     streamline_mask=None,
     overwrite=True,
+    trx=False,
+    trx_float16=False,
+    assignments_text=False,
+    endpoint_cache_dir=None,
+    return_streamlines=False,
 ):
     """Uses MRtrix tools to extract the TCK file that connects to the ROI(s)
     If the ROI image contains one value, finds all streamlines that connect to that region
@@ -72,113 +1281,212 @@ def extract_tck_mrtrix(
             Path to streamline inclusion mask (.nii.gz). Streamlines must intersect this mask to be kept
     streamline_mask: str
             Path to streamline mask (.nii.gz). Streamlines leaving this mask are truncated
+            (masks are applied in Python, see mask_streamlines, unless one is a .mif file, in which
+            case tckedit applies them and its truncation may keep more parts of each streamline)
     overwrite: bool
             Whether to allow overwriting outputs
+    trx: bool
+            Whether to also save the sub-bundle as TRX (see tck_to_trx), with SIFT2 weights and
+            ROI assignments (not available after masking with .mif masks) as per-streamline data
+    trx_float16: bool
+            Whether to store TRX points as float16
+    assignments_text: bool
+            Whether to keep tck2connectome's assignments text file next to the binary copy
+    endpoint_cache_dir: str
+            Where to cache the endpoint voxels of the tractogram for search_type "end"
+            (see endpoint_voxel_map). Default is next to the tractogram.
+    return_streamlines: bool
+            Whether to also return the streamlines read during extraction, so later steps
+            (e.g., visualization) do not read the tractogram or the sub-bundle again
 
     Outputs
     =======
     Function returns the path of the extracted tck file
-    outpath_base + assignments.txt/connectome.txt describe the streamline-to-node assignments
+    If return_streamlines is True, it also returns the sub-bundle's streamlines (None if tckedit
+    applied the masks) and the (points, starts, ends) of the tractogram (see tck_streamline_offsets)
+    outpath_base + assignments.npz/connectome.txt describe the streamline-to-node assignments
+    (see read_assignments); assignments.txt is only kept if assignments_text is True
     outpath_base + extracted.tck is the extracted sub-bundle
     outpath_base + extracted_masked.tck is the extracted bundle after applying exclusion masking (if masking is done)
-    *_weights.csv files are the SIFT2 weights for the extracted and masked bundles
+    *SIFT2weights*.csv files are the SIFT2 weights for the extracted and masked bundles (and a .npy copy
+    for the extracted bundle); with SIFT2 weights, connectome.txt holds the summed weights
+    The returned tck file with a .trx extension, if trx is True
     """
 
-    ### tck2connectome
-    tck2connectome = find_program("tck2connectome")
+    import numpy as np
+
     tck2connectome_connectome_out = outpath_base + "_desc-connectome.txt"
     tck2connectome_assignments_out = outpath_base + "_desc-assignments.txt"
-    cmd_tck2connectome = [
-        tck2connectome,
-        tck_file,
-        rois_in,
-        tck2connectome_connectome_out,
-        # "-assignment_" + search_type + "_search",
-        # search_dist,
-        "-out_assignments",
-        tck2connectome_assignments_out,
-    ]
-    if search_type == "end" or search_type == "all":
-        cmd_tck2connectome += [f"-assignment_{search_type}_voxels"]
-    else:
-        cmd_tck2connectome += [f"-assignment_{search_type}_search", search_dist]
-
     if overwrite == False:
         overwrite_check(tck2connectome_assignments_out)
         overwrite_check(tck2connectome_connectome_out)
+
+    if search_type == "end" and rois_in[-4:] != ".mif":
+        # Endpoint voxels only depend on the tractogram and the image grid, so they are looked up
+        # once (see endpoint_voxel_map) and every later ROI set on that grid skips the tractogram
+        import nibabel as nib
+
+        assignments = assign_endpoints(
+            endpoint_voxel_map(tck_file, rois_in, cache_dir=endpoint_cache_dir), rois_in
+        )
+        # Read the labels as stored, without get_fdata's float64 copy of the image
+        n_nodes = max(int(np.rint(np.asanyarray(nib.load(rois_in).dataobj).max())), 1)
+        connectome = weighted_connectome(assignments, np.ones(len(assignments)), n_nodes)
+        np.savetxt(tck2connectome_connectome_out, connectome, fmt="%.9g")
+        if assignments_text:
+            np.savetxt(tck2connectome_assignments_out, assignments, fmt="%d")
     else:
-        cmd_tck2connectome += ["-force"]
-    if sift2_weights != None:
-        cmd_tck2connectome += ["-tck_weights_in", sift2_weights]
-    run_command(cmd_tck2connectome)
+        ### tck2connectome
+        tck2connectome = find_program("tck2connectome")
+        cmd_tck2connectome = [
+            tck2connectome,
+            tck_file,
+            rois_in,
+            tck2connectome_connectome_out,
+            # "-assignment_" + search_type + "_search",
+            # search_dist,
+            "-out_assignments",
+            tck2connectome_assignments_out,
+        ]
+        if search_type == "end" or search_type == "all":
+            cmd_tck2connectome += [f"-assignment_{search_type}_voxels"]
+        else:
+            cmd_tck2connectome += [f"-assignment_{search_type}_search", search_dist]
+        if overwrite == True:
+            cmd_tck2connectome += ["-force"]
+        run_command(cmd_tck2connectome)
+
+        # The assignments text file holds one line per streamline of the whole tractogram, so parse
+        # it once, keep a compact binary copy, and select the sub-bundle from it (instead of connectome2tck)
+        assignments = read_assignments(tck2connectome_assignments_out)
+        if assignments_text == False:
+            os.remove(tck2connectome_assignments_out)
+    save_assignments(
+        assignments, outpath_base + "_desc-assignments.npz", overwrite=overwrite
+    )
 
-    ### connectome2tck
-    connectome2tck = find_program("connectome2tck")
-    connectome2tck_out = outpath_base + "_desc-fsub.tck"
-    # Change connectome2tck arguments based on single node or pairwise nodes
+    # Single node or pairwise nodes
     if two_rois:
-        nodes = "1,2"
+        nodes = [1, 2]
     else:
-        nodes = "0,1"
-    cmd_connectome2tck = [
-        connectome2tck,
+        nodes = [0, 1]
+    selection = select_assignments(assignments, nodes)
+    extracted = np.flatnonzero(selection)
+    points, starts, ends = tck_streamline_offsets(tck_file)
+    fsub_offsets = (starts[extracted], ends[extracted])
+    extracted_out = write_tck_subset(
         tck_file,
-        tck2connectome_assignments_out,
-        connectome2tck_out,
-        "-nodes",
-        nodes,
-        "-exclusive",
-        "-files",
-        "single",
-    ]
-    if overwrite == False:
-        overwrite_check(connectome2tck_out)
-    else:
-        cmd_connectome2tck += ["-force"]
+        extracted,
+        outpath_base + "_desc-fsub.tck",
+        overwrite=overwrite,
+        offsets=fsub_offsets,
+    )
+
+    # Handle SIFT2 weights in Python, so the whole-brain weights file is parsed once (and cached)
+    # instead of by every MRtrix command
     if sift2_weights != None:
-        sift2_weights_extracted = outpath_base + "desc-fsubSIFT2weights.csv"
-        cmd_connectome2tck += [
-            "-tck_weights_in",
-            sift2_weights,
-            "-prefix_tck_weights_out",
-            sift2_weights_extracted,
-        ]
-    run_command(cmd_connectome2tck)
+        weights = load_sift2_weights(sift2_weights)
+
+        # Weighted connectome, in the same format as tck2connectome's
+        n_nodes = np.loadtxt(tck2connectome_connectome_out, ndmin=2).shape[0]
+        connectome = weighted_connectome(assignments, weights, n_nodes)
+        np.savetxt(tck2connectome_connectome_out, connectome, fmt="%.9g")
+
+        sift2_weights_extracted = save_sift2_weights(
+            weights[selection],
+            outpath_base + "_desc-fsubSIFT2weights.csv",
+            overwrite=overwrite,
+        )
 
     # Mask streamlines if requested
-    if exclude_mask != None or include_mask != None:
-        tckedit_out = outpath_base + "_desc-fsub_desc-masked.tck"
-        tckedit = find_program("tckedit")
-        cmd_tckedit = [
-            tckedit,
-            connectome2tck_out,
-            tckedit_out,
-        ]
-        if exclude_mask != None:
-            cmd_tckedit += ["-exclude", exclude_mask]
-        if include_mask != None:
-            cmd_tckedit += ["-include", include_mask]
-        if streamline_mask != None:
-            cmd_tckedit += ["-mask", streamline_mask]
-        if overwrite == False:
-            overwrite_check(tckedit_out)
+    fsub_out = extracted_out
+    if exclude_mask != None or include_mask != None or streamline_mask != None:
+        masked_out = outpath_base + "_desc-fsub_desc-masked.tck"
+        sift2_weights_edited = outpath_base + "_desc-fsubSIFT2weights_desc-masked.csv"
+        masks = [mask for mask in [exclude_mask, include_mask, streamline_mask] if mask != None]
+        if any(mask[-4:] == ".mif" for mask in masks):
+            # Masks nibabel cannot read are left to tckedit
+            tckedit = find_program("tckedit")
+            cmd_tckedit = [
+                tckedit,
+                extracted_out,
+                masked_out,
+            ]
+            if exclude_mask != None:
+                cmd_tckedit += ["-exclude", exclude_mask]
+            if include_mask != None:
+                cmd_tckedit += ["-include", include_mask]
+            if streamline_mask != None:
+                cmd_tckedit += ["-mask", streamline_mask]
+            if overwrite == False:
+                overwrite_check(masked_out)
+            else:
+                cmd_tckedit += ["-force"]
+            if sift2_weights != None:
+                cmd_tckedit += [
+                    "-tck_weights_in",
+                    sift2_weights_extracted,
+                    "-tck_weights_out",
+                    sift2_weights_edited,
+                ]
+            run_command(cmd_tckedit)
+            # Which streamlines tckedit kept is not known
+            extracted = None
+            fsub_offsets = None
         else:
-            cmd_tckedit += ["-force"]
-        if sift2_weights != None:
-            sift2_weights_edited = (
-                outpath_base + "desc-fsubSIFT2weights_desc-masked.csv"
+            # Evaluate the masks on the extracted streamlines' points and copy the kept
+            # (and truncated) streamlines directly, instead of re-reading the sub-bundle with tckedit
+            kept, masked_starts, masked_ends = mask_streamlines(
+                tck_file,
+                starts[extracted],
+                ends[extracted],
+                exclude_mask=exclude_mask,
+                include_mask=include_mask,
+                streamline_mask=streamline_mask,
             )
-            cmd_tckedit += [
-                "-tck_weights_in",
-                sift2_weights_extracted,
-                "-tck_weights_out",
-                sift2_weights_edited,
-            ]
-        run_command(cmd_tckedit)
+            extracted = extracted[kept]
+            fsub_offsets = (masked_starts, masked_ends)
+            write_tck_subset(
+                tck_file,
+                extracted,
+                masked_out,
+                overwrite=overwrite,
+                offsets=fsub_offsets,
+            )
+            if sift2_weights != None:
+                save_sift2_weights(weights[extracted], sift2_weights_edited, overwrite=overwrite)
+        fsub_out = masked_out
 
-        return tckedit_out
-    else:
-        return connectome2tck_out
+    # Save a TRX copy with the per-streamline data attached
+    if trx:
+        data_per_streamline = {}
+        if extracted is not None:
+            data_per_streamline["assignments"] = assignments[extracted].astype("int32")
+            if sift2_weights != None:
+                data_per_streamline["sift2_weights"] = weights[extracted]
+        elif sift2_weights != None:
+            data_per_streamline["sift2_weights"] = _read_number_file(
+                sift2_weights_edited
+            ).astype("float32")
+        tck_to_trx(
+            fsub_out,
+            op.splitext(fsub_out)[0] + ".trx",
+            rois_in,
+            data_per_streamline=data_per_streamline,
+            float16=trx_float16,
+            overwrite=overwrite,
+        )
+
+    if return_streamlines:
+        # The kept streamlines are views of the tractogram's memory map, so nothing is parsed again
+        fsub_streamlines = None
+        if fsub_offsets is not None:
+            fsub_streamlines = [
+                np.asarray(points[start:end], dtype=np.float32)
+                for start, end in zip(*fsub_offsets)
+            ]
+        return fsub_out, fsub_streamlines, (points, starts, ends)
+    return fsub_out
 
 
 def generate_tck_mrtrix(
@@ -193,7 +1501,13 @@ def generate_tck_mrtrix(
     include_mask=None,
     streamline_mask=None,
     tckgen_params=None,
+    n_shards=1,
+    nthreads=None,
+    seed=None,
+    max_seeds=None,
+    time_limit=None,
     overwrite=True,
+    cancel_event=None,
 ):
     """Uses MRtrix tools to generate a TCK file that connects to the ROI(s)
     If the ROI image contains one value, finds all streamlines that connect to that region
@@ -221,13 +1535,30 @@ def generate_tck_mrtrix(
             Path to streamline mask (.nii.gz). Streamlines leaving this mask are truncated
     tckgen_params: str
             Path to txt file with additional tckgen params
+    n_shards: int
+            Number of independent tckgen processes to split the streamline budget across.
+            Shards get distinct random seeds, run concurrently, and are merged into outfile.
+    nthreads: int
+            Total thread budget shared by all shards (default is all CPUs)
+    seed: int
+            Random seed of the first shard (shard k uses seed + k). Default is unseeded.
+    max_seeds: int
+            Maximum number of seeds tckgen may attempt, summed across shards. Default is no limit.
+    time_limit: float
+            Seconds after which unfinished shards are stopped. Streamlines they completed are kept.
+            Default is no limit.
     overwrite: bool
             Whether to allow overwriting outputs
+    cancel_event: threading.Event
+            If given, every shard is stopped once the event is set. The event is set if a shard
+            fails, so concurrent runs sharing it stop together.
 
     Outputs
     =======
     Function returns the path of the extracted tck file
-    Function saves out tractogram to outfile
+    Function saves out tractogram to outfile, which may hold fewer than n_streamlines
+    streamlines if the seed or time budget ran out (a warning is raised).
+    Per-shard and total acceptance rates are saved to outfile with suffix _tckgen-stats.tsv
     """
 
     ### tckgen
@@ -247,8 +1578,6 @@ def generate_tck_mrtrix(
         fivett,
         "-backtrack",
         "-crop_at_gmwmi",
-        "-select",
-        str(n_streamlines),
     ]
     if roi_end != None:
         cmd_tckgen += ["-include", roi_end]
@@ -261,9 +1590,9 @@ def generate_tck_mrtrix(
     if streamline_mask != None:
         cmd_tckgen += ["-mask", streamline_mask]
     if tckgen_params != None:
-        with open(tckgen_parmas) as f:
+        with open(tckgen_params) as f:
             params_str = f.readlines()[0]
-            params_list = params_str.split(" ")
+            params_list = params_str.split()
             f.close()
         cmd_tckgen += params_list
     if overwrite == False:
@@ -271,6 +1600,196 @@ def generate_tck_mrtrix(
     else:
         cmd_tckgen += ["-force"]
 
-    run_command(cmd_tckgen)
+    # Split the streamline budget across shards (never more shards than streamlines)
+    n_shards = max(1, min(n_shards, n_streamlines))
+    shard_sizes = [n_streamlines // n_shards] * n_shards
+    for k in range(n_streamlines % n_shards):
+        shard_sizes[k] += 1
+    if nthreads == None:
+        nthreads = os.cpu_count() or 1
+    n_concurrent = min(n_shards, nthreads)
+    shard_nthreads = max(1, nthreads // n_concurrent)
+
+    if n_shards == 1:
+        shard_files = [outfile]
+    else:
+        shard_files = [
+            outfile.replace(".tck", f"_shard-{k + 1}.tck") for k in range(n_shards)
+        ]
+    shard_cmds = []
+    shard_envs = []
+    for k, (shard_file, shard_size) in enumerate(zip(shard_files, shard_sizes)):
+        cmd_shard = list(cmd_tckgen)
+        cmd_shard[2] = shard_file
+        cmd_shard += ["-select", str(shard_size), "-nthreads", str(shard_nthreads)]
+        # Cap attempted seeds in proportion to the shard's share of streamlines
+        if max_seeds != None:
+            cmd_shard[4] = str(max(1, -(-max_seeds * shard_size // n_streamlines)))
+        shard_cmds.append(cmd_shard)
+        shard_envs.append(None if seed == None else {"MRTRIX_RNG_SEED": str(seed + k)})
+
+    deadline = None if time_limit == None else time.monotonic() + time_limit
+    if cancel_event == None:
+        cancel_event = threading.Event()
+    with ThreadPoolExecutor(max_workers=n_concurrent) as executor:
+        futures = [
+            executor.submit(
+                _run_tckgen_shard, shard_cmd, shard_env, shard_size, deadline, cancel_event
+            )
+            for shard_cmd, shard_env, shard_size in zip(shard_cmds, shard_envs, shard_sizes)
+        ]
+        raise_first_error([future.exception() for future in futures])
+        shard_stats = [future.result() for future in futures]
+
+    # Report how efficiently each shard found valid streamlines
+    for k, stats in enumerate(shard_stats):
+        print(
+            f"   tckgen shard {k + 1}/{n_shards} ({stats['status']}): {stats['selected']} selected / {stats['generated']} generated (acceptance rate {stats['acceptance']:.4f})"
+        )
+    total_selected = sum(stats["selected"] for stats in shard_stats)
+    total_generated = sum(stats["generated"] for stats in shard_stats)
+    if total_selected == n_streamlines:
+        status = "complete"
+    elif total_selected > 0:
+        status = "partial"
+    else:
+        status = "failed"
+
+    # Record run statistics next to the output
+    total_stats = {
+        "status": status,
+        "requested": n_streamlines,
+        "selected": total_selected,
+        "generated": total_generated,
+        "seeds": sum(stats["seeds"] or 0 for stats in shard_stats),
+        "acceptance": total_selected / total_generated
+        if total_generated > 0
+        else float("nan"),
+        "seconds": max(stats["seconds"] for stats in shard_stats),
+    }
+    rows = [(k + 1, stats) for k, stats in enumerate(shard_stats)]
+    rows += [("total", total_stats)]
+    stats_outfile = outfile.replace(".tck", "_tckgen-stats.tsv")
+    with open(stats_outfile, "w") as f:
+        f.write(
+            "shard\tstatus\trequested\tselected\tgenerated\tseeds\tacceptance\tseconds\n"
+        )
+        for shard, stats in rows:
+            f.write(
+                f"{shard}\t{stats['status']}\t{stats['requested']}\t{stats['selected']}\t{stats['generated']}\t{'n/a' if stats['seeds'] == None else stats['seeds']}\t{stats['acceptance']:.6f}\t{stats['seconds']:.1f}\n"
+            )
+
+    if status == "failed":
+        raise Exception(
+            f"tckgen did not select any streamlines for {outfile} within the seed/time budget. See {stats_outfile}."
+        )
+    if status == "partial":
+        warnings.warn(
+            f"tckgen stopped early: only {total_selected} of {n_streamlines} streamlines were selected for {outfile} (acceptance rate {total_selected / max(total_generated, 1):.4f}). See {stats_outfile}."
+        )
+
+    # Merge shards that produced streamlines
+    if n_shards > 1:
+        kept_files = [
+            shard_file
+            for shard_file, stats in zip(shard_files, shard_stats)
+            if stats["selected"] > 0
+        ]
+        merge_tck_files(kept_files, outfile)
+        for shard_file in shard_files:
+            if op.exists(shard_file):
+                os.remove(shard_file)
 
     return outfile
+
+
+# tckgen progress, e.g. "tckgen: [ 50%]  1200 seeds,  1100 streamlines,  500 selected"
+_TCKGEN_PROGRESS = re.compile(
+    r"(\d+) seeds,\s*(\d+) streamlines,\s*(\d+) selected"
+)
+
+
+def _keep_complete_streamlines(tck_file, generated):
+    """Rewrites a .tck file left behind by a killed tckgen with only the streamlines that were
+    completely written (those followed by a delimiter), removing it if there are none.
+    generated is the number of streamlines tckgen had generated, as parsed from its progress, or 0
+    if no progress was seen; the header's total_count, or failing that the number of complete
+    streamlines, is used instead. Returns the number of streamlines kept and generated."""
+
+    if op.exists(tck_file) == False:
+        return 0, generated
+    try:
+        header = read_tck_header(tck_file)
+        _, starts, ends = tck_streamline_offsets(tck_file)
+    except Exception:
+        # The header was not completely written
+        starts = []
+    if len(starts) == 0:
+        os.remove(tck_file)
+        return 0, generated
+
+    if generated == 0:
+        # E.g., tckgen was stopped before its first progress update, or ran with -quiet
+        try:
+            header_total = int(header.get("total_count", 0))
+        except ValueError:
+            header_total = 0
+        generated = max(header_total, len(starts))
+
+    # The count in the header was not filled in, so rewrite the file (through a temporary copy)
+    write_tck_subset(
+        tck_file, range(len(starts)), tck_file, offsets=(starts, ends), total_count=generated
+    )
+
+    return len(starts), generated
+
+
+def _run_tckgen_shard(cmd_tckgen, env, n_requested, deadline, cancel_event):
+    """Runs one tckgen command, tracking its progress and stopping it at the deadline.
+    Returns a dict of run statistics; the status is 'complete', 'seed_cap' (ran out of seeds),
+    'partial' (stopped at the deadline, streamlines written so far kept) or 'timeout'
+    (stopped at the deadline before any streamline was written). Sets cancel_event if it fails."""
+
+    outfile = cmd_tckgen[2]
+    progress = {"seeds": None, "generated": 0, "selected": 0}
+
+    def monitor(line):
+        match = _TCKGEN_PROGRESS.search(line)
+        if match:
+            progress["seeds"] = int(match.group(1))
+            progress["generated"] = int(match.group(2))
+            progress["selected"] = int(match.group(3))
+
+    start = time.monotonic()
+    timeout = None if deadline == None else max(0, deadline - start)
+    try:
+        run_command(
+            cmd_tckgen,
+            env=env,
+            timeout=timeout,
+            output_callback=monitor,
+            cancel_event=cancel_event,
+        )
+        selected, generated, rate = tck_acceptance(outfile)
+        status = "complete" if selected >= n_requested else "seed_cap"
+    except CommandTimeoutError:
+        # A killed tckgen leaves an unfinished file behind, so keep its complete streamlines
+        selected, generated = _keep_complete_streamlines(outfile, progress["generated"])
+        rate = selected / generated if generated > 0 else float("nan")
+        status = "partial" if selected > 0 else "timeout"
+    except CommandCancelledError:
+        raise
+    except BaseException:
+        # Stop the shards (and other runs) sharing the event
+        cancel_event.set()
+        raise
+
+    return {
+        "status": status,
+        "requested": n_requested,
+        "selected": selected,
+        "generated": generated,
+        "seeds": progress["seeds"],
+        "acceptance": rate,
+        "seconds": time.monotonic() - start,
+    }
@@ -0,0 +1,460 @@
+import os.path as op
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import nibabel as nib
+
+
+def compute_vertex_normals(vertices, faces):
+    """Computes unit-length, area-weighted vertex normals of a triangle mesh
+
+    Parameters
+    ==========
+    vertices: np.ndarray
+            (N, 3) array of vertex coordinates
+    faces: np.ndarray
+            (M, 3) array of vertex indices for each triangle
+
+    Outputs
+    =======
+    normals: np.ndarray
+            (N, 3) float32 array of outward-facing vertex normals
+    """
+
+    vertices = np.asarray(vertices, dtype=np.float64)
+    faces = np.asarray(faces, dtype=np.int64)
+
+    # Un-normalized face normals are proportional to triangle area
+    tris = vertices[faces]
+    face_normals = np.cross(tris[:, 1] - tris[:, 0], tris[:, 2] - tris[:, 0])
+
+    # Accumulate face normals onto their vertices
+    n_vertices = vertices.shape[0]
+    normals = np.zeros((n_vertices, 3))
+    for axis in range(3):
+        for corner in range(3):
+            normals[:, axis] += np.bincount(
+                faces[:, corner],
+                weights=face_normals[:, axis],
+                minlength=n_vertices,
+            )
+
+    # Normalize, leaving isolated vertices as zero vectors
+    norms = np.linalg.norm(normals, axis=1, keepdims=True)
+    np.divide(normals, norms, out=normals, where=norms > 0)
+
+    return normals.astype(np.float32)
+
+
+# In-process cache of loaded geometry, keyed by (subject directory, hemisphere)
+_GEOMETRY_CACHE = {}
+
+
+def _geometry_sources(fs_dir, subject, hemi):
+    """Lists the FreeSurfer files that surface geometry is built from"""
+    subject_dir = op.join(fs_dir, subject)
+    return [
+        op.join(subject_dir, "surf", f"{hemi}.white"),
+        op.join(subject_dir, "surf", f"{hemi}.pial"),
+        op.join(subject_dir, "surf", f"{hemi}.thickness"),
+        op.join(subject_dir, "mri", "orig.mgz"),
+    ]
+
+
+def _read_surface_geometry(fs_dir, subject, hemi):
+    """Parses surface geometry from FreeSurfer outputs (see load_surface_geometry)"""
+    white_file, pial_file, thickness_file, orig_file = _geometry_sources(
+        fs_dir, subject, hemi
+    )
+    vertices, faces = nib.freesurfer.read_geometry(white_file)
+    pial_vertices, _ = nib.freesurfer.read_geometry(pial_file)
+    orig = nib.load(orig_file)
+
+    return {
+        "vertices": vertices.astype(np.float32),
+        "pial_vertices": pial_vertices.astype(np.float32),
+        "faces": faces.astype(np.int32),
+        "normals": compute_vertex_normals(vertices, faces),
+        "thickness": nib.freesurfer.read_morph_data(thickness_file).astype(
+            np.float32
+        ),
+        "vox2ras_tkr": orig.header.get_vox2ras_tkr(),
+        "affine": orig.affine,
+        "shape": np.array(orig.shape[:3]),
+    }
+
+
+def load_surface_geometry(fs_dir, subject, hemi, cache_dir=None):
+    """Loads the surface geometry used for ROI projection, masking and visualization.
+    Geometry is parsed from FreeSurfer files once per process and, if cache_dir is given,
+    saved to an .npz file that is reused as long as the FreeSurfer files are unchanged.
+
+    Parameters
+    ==========
+    fs_dir: str
+            Path to FreeSurfer subjects folder
+    subject: str
+            Subject name. Must match folder name in fs_dir.
+    hemi: str
+            Hemisphere to load ('lh' or 'rh')
+    cache_dir: str
+            Directory to store the geometry cache in (e.g., the subject's anat output folder)
+
+    Outputs
+    =======
+    geometry: dict
+            Dictionary with white surface 'vertices' and 'normals' and 'pial_vertices' (tkRAS, float32),
+            'faces' (int32), 'thickness' (float32), and the 'vox2ras_tkr', 'affine' and 'shape' of orig.mgz
+    """
+
+    sources = _geometry_sources(fs_dir, subject, hemi)
+    mtimes = np.array([op.getmtime(source) for source in sources])
+    key = (op.abspath(op.join(fs_dir, subject)), hemi)
+
+    # Reuse geometry already loaded in this process
+    cached = _GEOMETRY_CACHE.get(key)
+    if cached is not None and np.array_equal(cached["source_mtimes"], mtimes):
+        return cached
+
+    # Reuse geometry cached on disk, then fall back to parsing FreeSurfer files
+    geometry = None
+    if cache_dir is not None:
+        cache_file = op.join(cache_dir, f"{subject}_hemi-{hemi}_desc-surfgeom.npz")
+        if op.exists(cache_file):
+            with np.load(cache_file) as loaded:
+                if np.array_equal(loaded["source_mtimes"], mtimes):
+                    geometry = dict(loaded)
+    if geometry is None:
+        geometry = _read_surface_geometry(fs_dir, subject, hemi)
+        geometry["source_mtimes"] = mtimes
+        if cache_dir is not None:
+            np.savez(cache_file, **geometry)
+
+    _GEOMETRY_CACHE[key] = geometry
+
+    return geometry
+
+
+def load_surface_roi(roi_in, n_vertices):
+    """Reads a surface ROI into a boolean vertex mask
+
+    Parameters
+    ==========
+    roi_in: str
+            Path to surface ROI (.label, .gii, .mgz). Surface files should be binary (nonzero in ROI).
+    n_vertices: int
+            Number of vertices in the surface the ROI is defined on
+
+    Outputs
+    =======
+    roi_mask: np.ndarray
+            Boolean array of length n_vertices, True for vertices in the ROI
+    """
+
+    if roi_in[-6:] == ".label":
+        roi_mask = np.zeros(n_vertices, dtype=bool)
+        roi_mask[nib.freesurfer.read_label(roi_in)] = True
+    elif roi_in[-4:] == ".gii":
+        roi_mask = np.asarray(nib.load(roi_in).darrays[0].data).ravel() > 0
+    elif roi_in[-4:] == ".mgz":
+        roi_mask = np.asarray(nib.load(roi_in).dataobj).ravel() > 0
+    else:
+        raise Exception(f"Surface ROI {roi_in} is not a .label, .gii, or .mgz file.")
+
+    if roi_mask.shape[0] != n_vertices:
+        raise Exception(
+            f"Surface ROI {roi_in} has {roi_mask.shape[0]} vertices, but the surface has {n_vertices}."
+        )
+
+    return roi_mask
+
+
+def projfrac_voxel_indices(geometry, projfrac_params=[-1, 0, 0.05], vertex_mask=None):
+    """Finds the voxel reached by each vertex at each depth of the projfrac sweep
+
+    Parameters
+    ==========
+    geometry: dict
+            Surface geometry, as returned by load_surface_geometry
+    projfrac_params: list
+            List of [start, stop, delta] projection fractions of cortical thickness.
+            Like FreeSurfer's --fill-projfrac, stop is inclusive.
+    vertex_mask: np.ndarray
+            Boolean array selecting the vertices to project. Default is all vertices.
+
+    Outputs
+    =======
+    flat_idx: np.ndarray
+            (n_fracs, n_vertices) array of flat (C-order) voxel indices on the orig.mgz grid,
+            -1 where the projection leaves the volume
+    """
+
+    start, stop, delta = [float(param) for param in projfrac_params]
+    fracs = np.arange(start, stop + delta / 2, delta, dtype=np.float32)
+
+    vertices = geometry["vertices"]
+    offsets = geometry["normals"] * geometry["thickness"][:, None]
+    if vertex_mask is not None:
+        vertices = vertices[vertex_mask]
+        offsets = offsets[vertex_mask]
+
+    # All projection depths at once: (n_fracs, n_vertices, 3) in tkRAS
+    coords = vertices[None] + fracs[:, None, None] * offsets[None]
+
+    # tkRAS -> voxel
+    ras2vox = np.linalg.inv(geometry["vox2ras_tkr"])
+    ijk = np.rint(coords @ ras2vox[:3, :3].T + ras2vox[:3, 3]).astype(np.int64)
+
+    shape = tuple(int(dim) for dim in geometry["shape"])
+    in_bounds = np.all((ijk >= 0) & (ijk < shape), axis=-1)
+    flat_idx = np.full(in_bounds.shape, -1, dtype=np.int64)
+    flat_idx[in_bounds] = np.ravel_multi_index(tuple(ijk[in_bounds].T), shape)
+
+    return flat_idx
+
+
+def projfrac_voxels(geometry, vertex_mask, projfrac_params=[-1, 0, 0.05]):
+    """Finds the voxels reached by projecting surface vertices along their normals
+
+    Parameters
+    ==========
+    geometry: dict
+            Surface geometry, as returned by load_surface_geometry
+    vertex_mask: np.ndarray
+            Boolean array selecting the vertices to project
+    projfrac_params: list
+            List of [start, stop, delta] parameters for projfrac
+
+    Outputs
+    =======
+    ijk: np.ndarray
+            (K, 3) array of unique, in-bounds voxel indices on the orig.mgz grid
+    """
+
+    flat_idx = projfrac_voxel_indices(geometry, projfrac_params, vertex_mask)
+    flat_idx = np.unique(flat_idx[flat_idx >= 0])
+    shape = tuple(int(dim) for dim in geometry["shape"])
+
+    return np.stack(np.unravel_index(flat_idx, shape), axis=1)
+
+
+def surf2vol_native(
+    roi_surf,
+    fs_dir,
+    subject,
+    hemi,
+    out_file,
+    projfrac_params=[-1, 0, 0.05],
+    cache_dir=None,
+):
+    """Projects a surface ROI into a volume without calling FreeSurfer binaries.
+    Replicates 'mri_surf2vol --fill-projfrac' / 'mri_label2vol --proj frac' on the white surface.
+
+    Parameters
+    ==========
+    roi_surf: str
+            Path to surface ROI (.label, .gii, .mgz)
+    fs_dir: str
+            Path to FreeSurfer subjects folder
+    subject: str
+            Subject name. Must match folder name in fs_dir.
+    hemi: str
+            Hemisphere corresponding to the ROI ('lh' or 'rh')
+    out_file: str
+            Path to save the projected ROI (.nii.gz)
+    projfrac_params: list
+            List of [start, stop, delta] parameters for projfrac
+    cache_dir: str
+            Directory for the surface geometry cache (see load_surface_geometry)
+
+    Outputs
+    =======
+    out_file: str
+            Path to binary projected ROI, on the grid of the subject's orig.mgz
+    """
+
+    geometry = load_surface_geometry(fs_dir, subject, hemi, cache_dir=cache_dir)
+    roi_mask = load_surface_roi(roi_surf, geometry["vertices"].shape[0])
+    ijk = projfrac_voxels(geometry, roi_mask, projfrac_params)
+
+    vol = np.zeros(tuple(geometry["shape"]), dtype=np.uint8)
+    vol[ijk[:, 0], ijk[:, 1], ijk[:, 2]] = 1
+    nib.save(nib.Nifti1Image(vol, geometry["affine"]), out_file)
+
+    return out_file
+
+
+def _rasterize_triangles(vertices, faces, shape, max_step=0.1, chunk_faces=50000):
+    """Finds the voxels a triangle mesh passes through, by sampling every triangle on a
+    barycentric grid no coarser than max_step (in voxels) along any edge. Only voxels that a
+    triangle clips by less than about max_step can be missed; at 0.1 voxels, over 99.9% of
+    the surface area falls in marked voxels.
+
+    Parameters
+    ==========
+    vertices: np.ndarray
+            (N, 3) array of vertex coordinates, in voxels
+    faces: np.ndarray
+            (M, 3) array of vertex indices for each triangle
+    shape: tuple
+            Shape of the volume
+    max_step: float
+            Largest distance between neighbouring samples along a triangle edge, in voxels
+    chunk_faces: int
+            Number of triangles sampled at a time
+
+    Outputs
+    =======
+    voxels: np.ndarray
+            Flat (C-order) indices of the voxels the mesh passes through
+    """
+
+    shape = tuple(int(n) for n in shape)
+    corners = vertices[faces]
+    longest_edge = np.max(
+        np.linalg.norm(corners - np.roll(corners, 1, axis=1), axis=2), axis=1
+    )
+    n_steps = np.maximum(1, np.ceil(longest_edge / max_step)).astype(np.int64)
+
+    # Triangles with the same number of steps share one barycentric grid
+    voxels = []
+    for n in np.unique(n_steps):
+        a, b = np.meshgrid(np.arange(n + 1), np.arange(n + 1), indexing="ij")
+        keep = a + b <= n
+        weights = np.stack([a[keep], b[keep], n - a[keep] - b[keep]], axis=1) / n
+        group = np.flatnonzero(n_steps == n)
+        for chunk_start in range(0, len(group), max(1, chunk_faces // len(weights))):
+            chunk = corners[group[chunk_start : chunk_start + max(1, chunk_faces // len(weights))]]
+            points = np.einsum("kc,mcx->mkx", weights, chunk).reshape(-1, 3)
+            ijk = np.rint(points).astype(np.int64)
+            ijk = ijk[np.all((ijk >= 0) & (ijk < shape), axis=1)]
+            voxels += [np.unique(np.ravel_multi_index(ijk.T, shape))]
+
+    return np.unique(np.concatenate(voxels)) if len(voxels) > 0 else np.zeros(0, np.int64)
+
+
+def surface_mask_native(fs_dir, subject, out_file, surf_name="pial", cache_dir=None):
+    """Makes a volumetric mask of the voxels a surface passes through, for both hemispheres.
+    Like 'mri_surf2vol --mkmask' without calling FreeSurfer binaries, but rasterizes whole
+    triangles (see _rasterize_triangles) rather than vertices, so the mask has no holes
+    between vertices for streamlines to pass through.
+
+    Parameters
+    ==========
+    fs_dir: str
+            Path to FreeSurfer subjects folder
+    subject: str
+            Subject name. Must match folder name in fs_dir.
+    out_file: str
+            Path to save the mask (.nii.gz)
+    surf_name: str
+            Surface to rasterize ('white' or 'pial')
+    cache_dir: str
+            Directory for the surface geometry cache (see load_surface_geometry)
+
+    Outputs
+    =======
+    out_file: str
+            Path to binary surface mask, on the grid of the subject's orig.mgz
+    """
+
+    vertex_key = "pial_vertices" if surf_name == "pial" else "vertices"
+
+    def rasterize(hemi):
+        geometry = load_surface_geometry(fs_dir, subject, hemi, cache_dir=cache_dir)
+        ras2vox = np.linalg.inv(geometry["vox2ras_tkr"])
+        vertices = geometry[vertex_key] @ ras2vox[:3, :3].T + ras2vox[:3, 3]
+        return geometry, _rasterize_triangles(vertices, geometry["faces"], geometry["shape"])
+
+    # Both hemispheres are loaded and rasterized at the same time
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        rasterized = list(executor.map(rasterize, ["lh", "rh"]))
+
+    geometry = rasterized[0][0]
+    vol = np.zeros(tuple(geometry["shape"]), dtype=np.uint8)
+    for _, voxels in rasterized:
+        vol.flat[voxels] = 1
+
+    nib.save(nib.Nifti1Image(vol, geometry["affine"]), out_file)
+
+    return out_file
+
+
+def surf2vol_native_batch(
+    rois_surf,
+    hemis,
+    fs_dir,
+    subject,
+    out_file,
+    projfrac_params=[-1, 0, 0.05],
+    stack=False,
+    cache_dir=None,
+):
+    """Projects many surface ROIs into one labelled volume, sweeping projfrac once per hemisphere.
+
+    Parameters
+    ==========
+    rois_surf: list
+            Paths to surface ROIs (.label, .gii, .mgz)
+    hemis: list
+            Hemisphere of each ROI ('lh' or 'rh')
+    fs_dir: str
+            Path to FreeSurfer subjects folder
+    subject: str
+            Subject name. Must match folder name in fs_dir.
+    out_file: str
+            Path to save the projected ROIs (.nii.gz)
+    projfrac_params: list
+            List of [start, stop, delta] parameters for projfrac
+    stack: bool
+            If True, save a 4D binary volume with one ROI per volume.
+            If False, save a 3D volume where ROI i (0-indexed) has value i+1; overlapping voxels take the later ROI in rois_surf.
+    cache_dir: str
+            Directory for the surface geometry cache (see load_surface_geometry)
+
+    Outputs
+    =======
+    out_file: str
+            Path to the projected ROI volume, on the grid of the subject's orig.mgz
+    """
+
+    if len(rois_surf) == 0:
+        raise Exception("No surface ROIs were given to project.")
+    if len(rois_surf) != len(hemis):
+        raise Exception("Number of ROIs and hemispheres do not match.")
+
+    vol = None
+    labelled_voxels = [None] * len(rois_surf)
+    for hemi in sorted(set(hemis)):
+        geometry = load_surface_geometry(fs_dir, subject, hemi, cache_dir=cache_dir)
+        shape = tuple(int(dim) for dim in geometry["shape"])
+        if vol is None:
+            if stack:
+                vol = np.zeros((int(np.prod(shape)), len(rois_surf)), dtype=np.uint8)
+            else:
+                dtype = np.uint8 if len(rois_surf) < 256 else np.uint16
+                vol = np.zeros(int(np.prod(shape)), dtype=dtype)
+
+        # Shared by every ROI in this hemisphere
+        flat_idx = projfrac_voxel_indices(geometry, projfrac_params)
+        n_vertices = flat_idx.shape[1]
+
+        for roi_index, (roi_surf, roi_hemi) in enumerate(zip(rois_surf, hemis)):
+            if roi_hemi != hemi:
+                continue
+            roi_mask = load_surface_roi(roi_surf, n_vertices)
+            roi_voxels = flat_idx[:, roi_mask]
+            roi_voxels = roi_voxels[roi_voxels >= 0]
+            if stack:
+                vol[roi_voxels, roi_index] = 1
+            else:
+                labelled_voxels[roi_index] = roi_voxels
+
+    # Label in input order (not hemisphere order), so overlaps go to the later ROI
+    if stack == False:
+        for roi_index, roi_voxels in enumerate(labelled_voxels):
+            vol[roi_voxels] = roi_index + 1
+
+    vol = vol.reshape(shape + vol.shape[1:])
+    nib.save(nib.Nifti1Image(vol, geometry["affine"]), out_file)
+
+    return out_file
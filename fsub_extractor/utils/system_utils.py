@@ -1,6 +1,20 @@
 import os.path as op
 import os
+import asyncio
+import cProfile
+import pstats
+import signal
 import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+from collections import deque
+from contextlib import contextmanager
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+from itertools import count
+from weakref import WeakKeyDictionary
 
 
 def overwrite_check(file):
@@ -22,8 +36,30 @@ def overwrite_check(file):
     return None
 
 
+def is_up_to_date(file, sources):
+    """Checks whether a derived file exists and is newer than every file it was made from.
+    Parameters
+    ==========
+    file: str
+            name of the derived file
+    sources: list
+            names of the files it was made from
+
+    Outputs
+    =======
+    up_to_date: bool
+            True if file can be reused as is
+    """
+    if op.exists(file) == False:
+        return False
+    mtime = op.getmtime(file)
+
+    return all(op.exists(source) and op.getmtime(source) <= mtime for source in sources)
+
+
 def find_program(program):
     """Checks that a command line tools is executable on path.
+    Lookups are cached per process (for the current PATH), so repeated calls are free.
     Parameters
     ==========
     program: str
@@ -35,48 +71,679 @@ def find_program(program):
             returns the program if found, and errors out if not found
     """
 
+    if _which(program, os.environ.get("PATH", "")) == None:
+        raise Exception(f"Command {program} could not be found in PATH.")
+
+    return program
+
+
+@lru_cache(maxsize=None)
+def _which(program, path_env):
+    """Returns the full path of program on path_env, or None if not found"""
+
     #  Simple function for checking if a program is executable
     def is_exe(fpath):
         return op.exists(fpath) and os.access(fpath, os.X_OK)
 
-    path_split = os.environ["PATH"].split(os.pathsep)
-    if len(path_split) == 0:
+    path_split = path_env.split(os.pathsep)
+    if len(path_split) == 0 or path_env == "":
         raise Exception("PATH environment variable is empty.")
 
     for path in path_split:
         path = path.strip('"')
         exe_file = op.join(path, program)
         if is_exe(exe_file):
-            return program
-    raise Exception(f"Command {program} could not be found in PATH.")
+            return exe_file
+    return None
+
+
+@lru_cache(maxsize=None)
+def probe_program_version(program):
+    """Finds the version of a command line tool (first line of 'program --version'), cached per process.
+    Parameters
+    ==========
+    program: str
+            name of command to probe
+
+    Outputs
+    =======
+    version: str
+            first non-empty line printed by the tool, "not found" if it is not on PATH,
+            or "unknown" if it does not report a version
+    """
+
+    if _which(program, os.environ.get("PATH", "")) == None:
+        return "not found"
+    try:
+        result = subprocess.run(
+            [program, "--version"], capture_output=True, text=True, timeout=30
+        )
+    except (OSError, subprocess.TimeoutExpired):
+        return "unknown"
+    for line in (result.stdout + result.stderr).splitlines():
+        if line.strip():
+            return line.strip().strip("=").strip()
+    return "unknown"
+
+
+class CommandError(Exception):
+    """Raised when a command run by run_command fails.
+    Attributes hold the command, its return code, the log file (if any)
+    and the last lines it wrote, so callers can report or retry it."""
+
+    def __init__(self, message, cmd_list, return_code=None, log_file=None, output_tail=()):
+        self.cmd_list = cmd_list
+        self.return_code = return_code
+        self.log_file = log_file
+        self.output_tail = list(output_tail)
+        details = [message]
+        if log_file != None:
+            details += [f"Full output is in {log_file}."]
+        if len(self.output_tail) > 0:
+            details += ["Last output lines:", *self.output_tail]
+        super().__init__("\n".join(details))
+
+
+class CommandTimeoutError(CommandError, TimeoutError):
+    """Raised when a command run by run_command exceeds its timeout"""
+
+
+class CommandCancelledError(CommandError):
+    """Raised when a command run by run_command is cancelled"""
+
+
+# Where run_command saves the output of each command (None prints it to the console)
+_COMMAND_LOG_DIR = None
+_COMMAND_LOG_COUNTER = count(1)
+
+
+def set_command_log_dir(log_dir):
+    """Sends the output of every following command to its own log file in log_dir
+    Parameters
+    ==========
+    log_dir: str
+            Directory for the log files, or None to print output to the console
+
+    Outputs
+    =======
+    None
+    """
+    global _COMMAND_LOG_DIR
+    if log_dir != None:
+        os.makedirs(log_dir, exist_ok=True)
+    _COMMAND_LOG_DIR = log_dir
+
+    return None
 
 
-def run_command(cmd_list, verbose=True):
+# Serializes console output, so lines and banners of commands run at the same time do not interleave
+_CONSOLE_LOCK = threading.Lock()
+
+
+def _print_console(text):
+    """Prints text to the console in one piece, under the shared console lock"""
+    with _CONSOLE_LOCK:
+        print(text, flush=True)
+
+
+def _command_banner(cmd_list, log_file):
+    """Text printed before running a command"""
+    lines = [
+        "\n######## Running Shell Command: ########",
+        " ".join(str(arg) for arg in cmd_list),
+    ]
+    if log_file != None:
+        lines += [f"(output saved to {log_file})"]
+    lines += ["########################################\n"]
+    return "\n".join(lines)
+
+
+def _open_command_output(cmd_list, verbose, log_file, output_callback):
+    """Sets up where a command's output goes, for run_command and run_command_async: names its log
+    file (see set_command_log_dir), prints the command if verbose, and opens the log.
+    Returns the log file path, the open log (or None), the last output lines (kept for error
+    messages) and the function that sends each output line to the log or console."""
+
+    function_name = cmd_list[0]
+    if log_file == None and _COMMAND_LOG_DIR != None:
+        log_file = op.join(
+            _COMMAND_LOG_DIR,
+            f"{next(_COMMAND_LOG_COUNTER):03d}_{op.basename(function_name)}.log",
+        )
+
+    if verbose:
+        # Print command information to output, in one piece so parallel commands do not interleave
+        _print_console(_command_banner(cmd_list, log_file))
+
+    output_tail = deque(maxlen=20)
+    log = None if log_file == None else open(log_file, "w")
+    if log != None:
+        log.write(" ".join(str(arg) for arg in cmd_list) + "\n\n")
+    prefix = f"[{op.basename(function_name)}] "
+
+    def handle_line(line):
+        output_tail.append(line)
+        if log != None:
+            # stdout and stderr may be read from different threads
+            with _CONSOLE_LOCK:
+                log.write(line + "\n")
+                log.flush()
+        else:
+            _print_console(prefix + line)
+        if output_callback != None:
+            output_callback(line)
+
+    return log_file, log, output_tail, handle_line
+
+
+def _raise_command_error(cmd_list, stop_reason, timeout, return_code, log_file, output_tail):
+    """Raises the error for a command that was stopped ("timeout" or "cancelled") or failed"""
+
+    function_name = cmd_list[0]
+    if stop_reason == "timeout":
+        raise CommandTimeoutError(
+            f"Command {function_name} did not finish within {timeout} seconds and was stopped.",
+            cmd_list,
+            return_code,
+            log_file,
+            output_tail,
+        )
+    if stop_reason == "cancelled":
+        raise CommandCancelledError(
+            f"Command {function_name} was cancelled.",
+            cmd_list,
+            return_code,
+            log_file,
+            output_tail,
+        )
+    if return_code != 0:
+        raise CommandError(
+            f"Command {function_name} exited with errors (return code {return_code}).",
+            cmd_list,
+            return_code,
+            log_file,
+            output_tail,
+        )
+
+    return None
+
+
+def _stream_lines(stream, handle_line):
+    """Reads a child process's output stream and hands each line to handle_line.
+    Progress bars update in place with carriage returns, so those also end a line."""
+    buffer = b""
+    while True:
+        chunk = stream.read1(4096) if hasattr(stream, "read1") else stream.read(4096)
+        if not chunk:
+            break
+        buffer += chunk
+        *lines, buffer = buffer.replace(b"\r", b"\n").split(b"\n")
+        for line in lines:
+            if line.strip():
+                handle_line(line.decode(errors="replace"))
+    if buffer.strip():
+        handle_line(buffer.decode(errors="replace"))
+
+
+def _stop_process_group(process, grace_period=5):
+    """Sends SIGTERM to a process and its children, then SIGKILL if they do not exit"""
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+        process.wait(timeout=grace_period)
+    except subprocess.TimeoutExpired:
+        os.killpg(process.pid, signal.SIGKILL)
+        process.wait()
+    except ProcessLookupError:
+        process.wait()
+
+
+def run_command(
+    cmd_list,
+    verbose=True,
+    env=None,
+    timeout=None,
+    output_callback=None,
+    log_file=None,
+    cancel_event=None,
+):
     """Interface for running CLI commands in Python. Crashes if command returns an error.
+    Output is streamed line by line to the console, or to a log file if one is given
+    (or a log directory was set with set_command_log_dir).
     Parameters
     ==========
     cmd_list: list
             List containing arguments for the function, e.g. ['CommandName', '--argName1', 'arg1'...]
+    verbose: bool
+            Whether to print the command before running it
+    env: dict
+            Extra environment variables to set for the command
+    timeout: float
+            Seconds after which the command is stopped and a CommandTimeoutError is raised
+    output_callback: function
+            If given, called with every line the command writes (e.g., progress updates)
+    log_file: str
+            Path to save the command's output to
+    cancel_event: threading.Event
+            If given, the command is stopped and a CommandCancelledError is raised once the event is set
 
     Outputs
     =======
     None
     """
 
-    function_name = cmd_list[0]
+    log_file, log, output_tail, handle_line = _open_command_output(
+        cmd_list, verbose, log_file, output_callback
+    )
+    if env != None:
+        env = {**os.environ, **env}
 
-    if verbose:
-        # Print command information to output
-        print(
-            "\n######## Running Shell Command: ########",
+    # New session, so the whole process group can be stopped together
+    process = subprocess.Popen(
+        cmd_list,
+        env=env,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        start_new_session=True,
+    )
+    readers = [
+        threading.Thread(target=_stream_lines, args=(stream, handle_line), daemon=True)
+        for stream in (process.stdout, process.stderr)
+    ]
+    for reader in readers:
+        reader.start()
+
+    deadline = None if timeout == None else time.monotonic() + timeout
+    stop_reason = None
+    try:
+        while process.poll() == None:
+            if cancel_event != None and cancel_event.is_set():
+                stop_reason = "cancelled"
+            elif deadline != None and time.monotonic() > deadline:
+                stop_reason = "timeout"
+            if stop_reason != None:
+                _stop_process_group(process)
+                break
+            time.sleep(0.1)
+    except BaseException:
+        # E.g., KeyboardInterrupt: do not leave the command running
+        _stop_process_group(process)
+        raise
+    finally:
+        for reader in readers:
+            reader.join()
+        process.stdout.close()
+        process.stderr.close()
+        if log != None:
+            log.close()
+
+    _raise_command_error(
+        cmd_list, stop_reason, timeout, process.returncode, log_file, output_tail
+    )
+
+    return None
+
+
+def run_commands_parallel(cmd_lists, max_workers, envs=None, verbose=True):
+    """Runs several CLI commands at once. Crashes if any command returns an error,
+    after cancelling the commands that are still running or waiting.
+    Parameters
+    ==========
+    cmd_lists: list
+            List of command lists, each as passed to run_command
+    max_workers: int
+            Maximum number of commands to run at the same time
+    envs: list
+            Extra environment variables (dict or None) for each command
+    verbose: bool
+            Whether to print each command before running it
+
+    Outputs
+    =======
+    None
+    """
+
+    if envs == None:
+        envs = [None] * len(cmd_lists)
+    cancel_event = threading.Event()
+
+    def run_or_cancel(cmd_list, env):
+        if cancel_event.is_set():
+            raise CommandCancelledError(
+                f"Command {cmd_list[0]} was cancelled before it started.", cmd_list
+            )
+        try:
+            run_command(cmd_list, verbose, env, cancel_event=cancel_event)
+        except CommandCancelledError:
+            raise
+        except BaseException:
+            cancel_event.set()
+            raise
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        futures = [
+            executor.submit(run_or_cancel, cmd_list, env)
+            for cmd_list, env in zip(cmd_lists, envs)
+        ]
+        errors = [future.exception() for future in futures]
+    raise_first_error(errors)
+
+    return None
+
+
+def raise_first_error(errors):
+    """Raises the error of a group of tasks that were run together and cancelled each other
+    on failure, preferring the failure that caused the cancellations
+    Parameters
+    ==========
+    errors: list
+            Error raised by each task (None for tasks that succeeded)
+
+    Outputs
+    =======
+    None
+    """
+
+    errors = [error for error in errors if error != None]
+    for error in errors:
+        if not isinstance(error, CommandCancelledError):
+            raise error
+    if len(errors) > 0:
+        raise errors[0]
+
+    return None
+
+
+# Limit on commands run at once by run_command_async, and one semaphore per event loop
+_ASYNC_CONCURRENCY = os.cpu_count() or 1
+_ASYNC_SEMAPHORES = WeakKeyDictionary()
+
+
+def set_async_concurrency(max_concurrent):
+    """Sets how many commands run_command_async may run at the same time
+    Parameters
+    ==========
+    max_concurrent: int
+            Maximum number of concurrent commands (default is the number of CPUs)
+
+    Outputs
+    =======
+    None
+    """
+    global _ASYNC_CONCURRENCY
+    _ASYNC_CONCURRENCY = max(1, max_concurrent)
+    _ASYNC_SEMAPHORES.clear()
+
+    return None
+
+
+def _async_semaphore():
+    """Returns the command semaphore of the running event loop"""
+    loop = asyncio.get_running_loop()
+    if loop not in _ASYNC_SEMAPHORES:
+        _ASYNC_SEMAPHORES[loop] = asyncio.Semaphore(_ASYNC_CONCURRENCY)
+    return _ASYNC_SEMAPHORES[loop]
+
+
+async def _stream_lines_async(stream, handle_line):
+    """Async version of _stream_lines, for asyncio subprocess streams"""
+    buffer = b""
+    while True:
+        chunk = await stream.read(4096)
+        if not chunk:
+            break
+        buffer += chunk
+        *lines, buffer = buffer.replace(b"\r", b"\n").split(b"\n")
+        for line in lines:
+            if line.strip():
+                handle_line(line.decode(errors="replace"))
+    if buffer.strip():
+        handle_line(buffer.decode(errors="replace"))
+
+
+async def run_command_async(
+    cmd_list,
+    verbose=True,
+    env=None,
+    timeout=None,
+    output_callback=None,
+    log_file=None,
+):
+    """Async interface for running CLI commands, so many commands can be overlapped
+    from one event loop. Behaves like run_command; at most set_async_concurrency()
+    commands run at once, and cancelling the awaiting task stops the command.
+    Parameters
+    ==========
+    cmd_list: list
+            List containing arguments for the function, e.g. ['CommandName', '--argName1', 'arg1'...]
+    verbose: bool
+            Whether to print the command before running it
+    env: dict
+            Extra environment variables to set for the command
+    timeout: float
+            Seconds after which the command is stopped and a CommandTimeoutError is raised
+    output_callback: function
+            If given, called with every line the command writes (e.g., progress updates)
+    log_file: str
+            Path to save the command's output to
+
+    Outputs
+    =======
+    None
+    """
+
+    async with _async_semaphore():
+        log_file, log, output_tail, handle_line = _open_command_output(
+            cmd_list, verbose, log_file, output_callback
         )
-        print(*cmd_list, sep=" ")
-        print("########################################\n")
+        if env != None:
+            env = {**os.environ, **env}
 
-    return_code = subprocess.run(cmd_list).returncode
-    if return_code != 0:
-        raise Exception(
-            f"Command {function_name} exited with errors. See message above for more information."
+        # New session, so the whole process group can be stopped together
+        process = await asyncio.create_subprocess_exec(
+            *[str(arg) for arg in cmd_list],
+            env=env,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            start_new_session=True,
         )
+        readers = asyncio.gather(
+            _stream_lines_async(process.stdout, handle_line),
+            _stream_lines_async(process.stderr, handle_line),
+        )
+
+        async def stop():
+            try:
+                os.killpg(process.pid, signal.SIGTERM)
+                await asyncio.wait_for(process.wait(), 5)
+            except asyncio.TimeoutError:
+                os.killpg(process.pid, signal.SIGKILL)
+                await process.wait()
+            except ProcessLookupError:
+                await process.wait()
+
+        stop_reason = None
+        try:
+            await asyncio.wait_for(process.wait(), timeout)
+        except asyncio.TimeoutError:
+            stop_reason = "timeout"
+            await stop()
+        except asyncio.CancelledError:
+            await stop()
+            raise
+        finally:
+            await readers
+            if log != None:
+                log.close()
+
+    _raise_command_error(
+        cmd_list, stop_reason, timeout, process.returncode, log_file, output_tail
+    )
 
     return None
+
+
+# Where profile_stage saves its profiles (None turns profiling off), and a summary row per stage
+_PROFILE_DIR = None
+_PROFILE_RESULTS = []
+# Nesting depth of profile stages in each thread, so only a thread's outermost stage is profiled
+_PROFILE_STATE = threading.local()
+# Stages running in any thread share tracemalloc, which is started by the first and stopped by the
+# last, and are numbered in the order they finish
+_PROFILE_LOCK = threading.Lock()
+_PROFILE_TRACING = {"stages": 0, "started": False, "finished": 0}
+
+
+def set_profile_dir(profile_dir):
+    """Profiles every following profile_stage and saves the results in profile_dir
+    Parameters
+    ==========
+    profile_dir: str
+            Directory for the profiles, or None to turn profiling off
+
+    Outputs
+    =======
+    None
+    """
+    global _PROFILE_DIR
+    if profile_dir != None:
+        os.makedirs(profile_dir, exist_ok=True)
+    _PROFILE_DIR = profile_dir
+    _PROFILE_RESULTS.clear()
+    _PROFILE_TRACING["finished"] = 0
+
+    return None
+
+
+@contextmanager
+def profile_stage(name, n_top=10):
+    """Profiles the enclosed code as one named stage, if a directory was set with set_profile_dir.
+    Python calls are timed with cProfile (saved to {index}_{name}.pstats, e.g. for snakeviz or pstats)
+    and allocations are traced with tracemalloc (the n_top largest sources and the peak are saved to
+    {index}_{name}_memory.txt). Stages nested in another stage of the same thread count towards the
+    outer one. Only the calling thread is profiled (stages in other threads are profiled separately,
+    but memory peaks include their allocations), and external commands show up as time spent waiting on them.
+    Parameters
+    ==========
+    name: str
+            Stage name, used in file names and the summary
+    n_top: int
+            Number of allocation sources to save
+
+    Outputs
+    =======
+    None
+    """
+    if _PROFILE_DIR == None or getattr(_PROFILE_STATE, "depth", 0) > 0:
+        yield
+        return
+
+    _PROFILE_STATE.depth = 1
+    with _PROFILE_LOCK:
+        if _PROFILE_TRACING["stages"] == 0:
+            _PROFILE_TRACING["started"] = tracemalloc.is_tracing() == False
+            if _PROFILE_TRACING["started"]:
+                tracemalloc.start()
+        _PROFILE_TRACING["stages"] += 1
+        tracemalloc.reset_peak()
+        traced_before, _ = tracemalloc.get_traced_memory()
+    snapshot_before = tracemalloc.take_snapshot()
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # From Python 3.12, one profiler runs at a time: a stage in another thread has it
+        profiler = None
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if profiler != None:
+            profiler.disable()
+        seconds = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        snapshot = tracemalloc.take_snapshot()
+        with _PROFILE_LOCK:
+            _PROFILE_TRACING["stages"] -= 1
+            if _PROFILE_TRACING["stages"] == 0 and _PROFILE_TRACING["started"]:
+                tracemalloc.stop()
+            _PROFILE_TRACING["finished"] += 1
+            index = _PROFILE_TRACING["finished"]
+        _PROFILE_STATE.depth = 0
+
+        out_base = op.join(_PROFILE_DIR, f"{index:02d}_{name.replace(' ', '_')}")
+        if profiler != None:
+            profiler.dump_stats(out_base + ".pstats")
+
+        # Largest allocation sources that were still held when the stage ended
+        not_tracemalloc = tracemalloc.Filter(False, tracemalloc.__file__)
+        top_allocations = (
+            snapshot.filter_traces([not_tracemalloc])
+            .compare_to(snapshot_before.filter_traces([not_tracemalloc]), "lineno")
+        )[:n_top]
+        with open(out_base + "_memory.txt", "w") as f:
+            f.write(f"Stage: {name}\nPeak traced memory: {(peak - traced_before) / 1e6:.1f} MB\n")
+            f.write(f"Largest allocation sources:\n")
+            for allocation in top_allocations:
+                f.write(f"{allocation}\n")
+
+        # Function with the most time spent in its own code
+        stats = {} if profiler == None else pstats.Stats(profiler).stats
+        slowest = max(stats.items(), key=lambda item: item[1][2], default=None)
+        _PROFILE_RESULTS.append(
+            {
+                "stage": name,
+                "seconds": seconds,
+                "peak_mb": (peak - traced_before) / 1e6,
+                "slowest_function": "-" if slowest == None else pstats.func_std_string(slowest[0]),
+                "slowest_seconds": 0 if slowest == None else slowest[1][2],
+                "largest_allocation": "-"
+                if len(top_allocations) == 0
+                else str(top_allocations[0].traceback),
+            }
+        )
+
+
+def print_profile_summary(verbose=True):
+    """Prints a table of the stages profiled so far and saves it as profile_summary.tsv
+    in the profile directory
+    Parameters
+    ==========
+    verbose: bool
+            Whether to print the table (it is saved either way)
+
+    Outputs
+    =======
+    summary_file: str
+            Path to the saved summary (None if profiling is off)
+    """
+    if _PROFILE_DIR == None:
+        return None
+
+    columns = ["stage", "seconds", "peak_mb", "slowest_function", "slowest_seconds", "largest_allocation"]
+    rows = [
+        [
+            result["stage"],
+            f"{result['seconds']:.2f}",
+            f"{result['peak_mb']:.1f}",
+            result["slowest_function"],
+            f"{result['slowest_seconds']:.2f}",
+            result["largest_allocation"],
+        ]
+        for result in _PROFILE_RESULTS
+    ]
+    summary_file = op.join(_PROFILE_DIR, "profile_summary.tsv")
+    with open(summary_file, "w") as f:
+        for row in [columns] + rows:
+            f.write("\t".join(row) + "\n")
+    if verbose == False:
+        return summary_file
+
+    # Long function names go last, so the table stays readable in a terminal
+    widths = [max(len(row[i]) for row in [columns] + rows) for i in range(len(columns))]
+    print("\n######## Profile Summary: ########")
+    for row in [columns] + rows:
+        print("  ".join(value.ljust(width) for value, width in zip(row, widths)).rstrip())
+    print(f"(profiles saved to {_PROFILE_DIR})")
+    print("##################################\n")
+
+    return summary_file
@@ -5,7 +5,7 @@ with open("README.md", "r") as fh:
 
 setup(
     name="fsub_extractor",
-    packages=find_packages(),
+    packages=find_packages(exclude=["benchmarks", "benchmarks.*"]),
     version="0.0.1",
     description="Software that functionally segments white matter connections to generate task-specific subcomponents of fiber bundles.",
     long_description=long_description,
@@ -0,0 +1,17 @@
+import numpy as np
+import nibabel as nib
+import pytest
+from fsub_extractor.utils.froi_utils import label_rois
+
+
+def test_label_rois_later_roi_wins_overlap(tmp_path):
+    rois = []
+    for name, voxels in [("a", np.s_[0:3]), ("b", np.s_[2:5])]:
+        mask = np.zeros((5, 1, 1), dtype=np.uint8)
+        mask[voxels] = 1
+        rois += [str(tmp_path / f"{name}.nii.gz")]
+        nib.save(nib.Nifti1Image(mask, np.eye(4)), rois[-1])
+
+    with pytest.warns(UserWarning, match="overlaps earlier ROIs"):
+        out_file = label_rois(rois, str(tmp_path / "labels.nii.gz"))
+    assert np.asanyarray(nib.load(out_file).dataobj).ravel().tolist() == [1, 1, 2, 2, 2]
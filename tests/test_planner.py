@@ -0,0 +1,58 @@
+import numpy as np
+import nibabel as nib
+from fsub_extractor.functions.planner import missing_inputs, plan_extractor, print_plan
+
+
+def plan_for_tract(tract, out_dir, **kwargs):
+    args = dict(
+        subject="sub-test",
+        tract=tract,
+        generate=False,
+        tract_name="tract",
+        roi1="roi1.nii.gz",
+        roi1_name="roi1",
+        roi2=None,
+        roi2_name=None,
+        hemi_list=["lh"],
+        fs_dir=str(out_dir),
+        projection_method="native",
+        fivett=None,
+        skip_fivett_registration=True,
+        skip_roi_projection=True,
+        skip_gmwmi_intersection=True,
+        out_dir=str(out_dir),
+        reg=None,
+        reg_type=None,
+        reg_invert=False,
+        exclude_mask=None,
+        include_mask=None,
+        sift2_weights=None,
+        wmfod=None,
+        n_streamlines=1000,
+        nthreads=1,
+        make_viz=True,
+        search_type="end",
+    )
+    return plan_extractor(**{**args, **kwargs})
+
+
+def test_plan_reports_missing_tract(tmp_path, capsys):
+    tract = str(tmp_path / "missing.tck")
+    plan = plan_for_tract(tract, tmp_path)
+
+    assert missing_inputs(plan) == [tract]
+    assert "Extract sub-bundle from missing tractogram" in [stage["name"] for stage in plan]
+    print_plan(plan)
+    assert f"MISSING INPUTS: {tract}" in capsys.readouterr().out
+
+
+def test_plan_with_existing_tract(tmp_path):
+    tract = str(tmp_path / "tracks.tck")
+    tractogram = nib.streamlines.Tractogram(
+        [np.zeros((2, 3), dtype=np.float32)] * 3, affine_to_rasmm=np.eye(4)
+    )
+    nib.streamlines.save(tractogram, tract)
+    plan = plan_for_tract(tract, tmp_path)
+
+    assert missing_inputs(plan) == []
+    assert any(stage["name"].startswith("Extract sub-bundle from 3 streamlines") for stage in plan)
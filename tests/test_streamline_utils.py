@@ -0,0 +1,244 @@
+import os
+import os.path as op
+import time
+import numpy as np
+import nibabel as nib
+import pytest
+from fsub_extractor.utils.streamline_utils import (
+    assign_endpoints,
+    connectome_edges,
+    decimate_streamlines,
+    endpoint_voxel_map,
+    extract_tck_mrtrix,
+    load_connectome,
+    read_assignments,
+    _keep_complete_streamlines,
+    _run_tckgen_shard,
+    read_tck_header,
+    read_tck_streamlines,
+    save_assignments,
+    save_connectome,
+    tck_streamline_offsets,
+    weighted_connectome,
+)
+
+SHAPE = (10, 10, 10)
+
+
+def write_tck(tck_file, streamlines):
+    tractogram = nib.streamlines.Tractogram(
+        [np.array(streamline, dtype=np.float32) for streamline in streamlines],
+        affine_to_rasmm=np.eye(4),
+    )
+    nib.streamlines.save(tractogram, str(tck_file))
+    return str(tck_file)
+
+
+@pytest.fixture
+def atlas(tmp_path):
+    """A 10^3 atlas with an identity affine, where every voxel is its own node (flat index + 1)"""
+    atlas_file = str(tmp_path / "atlas.nii.gz")
+    labels = np.arange(1, np.prod(SHAPE) + 1, dtype=np.int16).reshape(SHAPE)
+    nib.save(nib.Nifti1Image(labels, np.eye(4)), atlas_file)
+    return atlas_file
+
+
+def node(i, j, k):
+    return np.ravel_multi_index((i, j, k), SHAPE) + 1
+
+
+def test_assign_endpoints_rounds_half_voxels_up(tmp_path, atlas):
+    # Endpoints on voxel boundaries go to the upper voxel, as floor(x + 0.5) in MRtrix
+    # (np.rint would round 2.5 and 0.5 down to even)
+    tck_file = write_tck(
+        tmp_path / "tracks.tck",
+        [
+            [[2.5, 0, 0], [2, 2, 2], [2.4999, 0, 0]],
+            [[-0.5, 1, 1], [1, 1, 1], [-0.5001, 1, 1]],
+            [[9.4999, 0, 0], [9, 0, 0], [9.5, 0, 0]],
+            [[0.5, 1.5, 3.5], [1, 1, 1], [1.5, 0.5, -0.5]],
+        ],
+    )
+    endpoint_map = endpoint_voxel_map(tck_file, atlas, cache_dir=str(tmp_path))
+    assignments = assign_endpoints(endpoint_map, atlas)
+
+    expected = [
+        [node(3, 0, 0), node(2, 0, 0)],
+        [node(0, 1, 1), 0],
+        [node(9, 0, 0), 0],
+        [node(1, 2, 4), node(2, 1, 0)],
+    ]
+    assert assignments.tolist() == expected
+
+
+def test_endpoint_voxel_map_cache(tmp_path, atlas):
+    tck_file = write_tck(tmp_path / "tracks.tck", [[[1, 1, 1], [2, 2, 2]]])
+    endpoint_voxel_map(tck_file, atlas, cache_dir=str(tmp_path))
+    cache_files = [f for f in os.listdir(tmp_path) if f.endswith("_desc-endpointvoxels.npz")]
+    assert len(cache_files) == 1
+    cache_file = op.join(tmp_path, cache_files[0])
+
+    # While the tractogram is unchanged, the cached map is returned as saved
+    with np.load(cache_file) as cached:
+        saved = dict(cached)
+    saved["voxels"] = np.array([[7, 7]], dtype=np.int32)
+    np.savez(cache_file, **saved)
+    assert endpoint_voxel_map(tck_file, atlas, cache_dir=str(tmp_path))["voxels"].tolist() == [[7, 7]]
+
+    # Rewriting the tractogram invalidates the cache, even within the same mtime tick
+    write_tck(tck_file, [[[3, 3, 3], [4, 4, 4]]])
+    stat = os.stat(tck_file)
+    os.utime(tck_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+    endpoint_map = endpoint_voxel_map(tck_file, atlas, cache_dir=str(tmp_path))
+    assert endpoint_map["voxels"].tolist() == [[node(3, 3, 3) - 1, node(4, 4, 4) - 1]]
+
+
+def test_assignments_round_trip(tmp_path):
+    assignments = np.array([[1, 2], [0, 0], [3, 0], [0, 70000], [5, 5], [0, 0]])
+    out_file = save_assignments(assignments, str(tmp_path / "assignments.npz"))
+
+    with np.load(out_file) as saved:
+        # Only streamlines with an assigned end are stored
+        assert saved["streamlines"].tolist() == [0, 2, 3, 4]
+    assert np.array_equal(read_assignments(out_file), assignments)
+
+
+def test_assignments_overwrite(tmp_path):
+    out_file = save_assignments(np.array([[1, 2]]), str(tmp_path / "assignments.npz"))
+    with pytest.raises(Exception):
+        save_assignments(np.array([[1, 2]]), out_file, overwrite=False)
+
+
+# Streamlines 3 and 5 have an unassigned end, and are left out of every connectome
+ASSIGNMENTS = np.array([[1, 2], [2, 1], [3, 3], [0, 2], [1, 3], [2, 0]])
+WEIGHTS = np.array([0.5, 1.5, 2, 4, 1, 8])
+LENGTHS = np.array([10, 20, 30, 40, 50, 60])
+
+
+def test_weighted_connectome():
+    expected = np.array([[0, 2, 1], [0, 0, 0], [0, 0, 2]])
+    assert np.allclose(weighted_connectome(ASSIGNMENTS, WEIGHTS, 3), expected)
+
+
+def test_weighted_connectome_weight_count():
+    with pytest.raises(Exception, match="does not match"):
+        weighted_connectome(ASSIGNMENTS, WEIGHTS[:-1], 3)
+
+
+def test_connectome_edges():
+    edges = connectome_edges(ASSIGNMENTS, weights=WEIGHTS, lengths=LENGTHS)
+    assert edges["edges"].tolist() == [[1, 2], [1, 3], [3, 3]]
+    assert edges["count"].tolist() == [2, 1, 1]
+    assert np.allclose(edges["sift2_weight"], [2, 1, 2])
+    assert np.allclose(edges["mean_length"], [15, 50, 30])
+
+
+def test_connectome_round_trip(tmp_path):
+    edges = connectome_edges(ASSIGNMENTS, weights=WEIGHTS, lengths=LENGTHS)
+    out_file = save_connectome(edges, 3, str(tmp_path / "connectome.npz"))
+
+    assert np.array_equal(
+        load_connectome(out_file), np.array([[0, 2, 1], [0, 0, 0], [0, 0, 1]])
+    )
+    assert np.allclose(
+        load_connectome(out_file, "sift2_weight"), weighted_connectome(ASSIGNMENTS, WEIGHTS, 3)
+    )
+    assert np.allclose(
+        load_connectome(out_file, "mean_length"), [[0, 15, 50], [0, 0, 0], [0, 0, 30]]
+    )
+
+
+def test_extract_returns_streamlines_read_during_extraction(tmp_path):
+    # ROI 1 fills the x = 0 plane and ROI 2 the x = 9 plane; the exclusion mask is one voxel
+    rois = np.zeros(SHAPE, dtype=np.int16)
+    rois[0], rois[9] = 1, 2
+    rois_file = str(tmp_path / "rois.nii.gz")
+    nib.save(nib.Nifti1Image(rois, np.eye(4)), rois_file)
+    exclude = np.zeros(SHAPE, dtype=np.uint8)
+    exclude[5, 2, 2] = 1
+    exclude_file = str(tmp_path / "exclude.nii.gz")
+    nib.save(nib.Nifti1Image(exclude, np.eye(4)), exclude_file)
+    tck_file = write_tck(
+        tmp_path / "tracks.tck",
+        [
+            [[0, 0, 0], [4, 0, 0], [9, 0, 0]],
+            [[0, 1, 1], [5, 1, 1]],
+            [[9, 2, 2], [5, 2, 2], [0, 2, 2]],
+        ],
+    )
+
+    fsub_out, fsub_streamlines, tck_offsets = extract_tck_mrtrix(
+        tck_file,
+        rois_file,
+        str(tmp_path / "sub-test"),
+        two_rois=True,
+        search_type="end",
+        exclude_mask=exclude_file,
+        return_streamlines=True,
+    )
+
+    # Only the first streamline connects both ROIs without entering the exclusion mask
+    saved = read_tck_streamlines(fsub_out)
+    assert len(fsub_streamlines) == len(saved) == 1
+    assert np.array_equal(fsub_streamlines[0], saved[0])
+    assert np.array_equal(fsub_streamlines[0], [[0, 0, 0], [4, 0, 0], [9, 0, 0]])
+
+    # The scanned tractogram decimates like the file it came from
+    points, starts, ends = tck_streamline_offsets(tck_file)
+    assert np.array_equal(tck_offsets[1], starts) and np.array_equal(tck_offsets[2], ends)
+    from_offsets, _ = decimate_streamlines(tck_offsets)
+    from_file, _ = decimate_streamlines(tck_file)
+    assert all(np.array_equal(a, b) for a, b in zip(from_offsets, from_file))
+    assert len(from_offsets) == 3
+
+
+def write_unfinished_tck(tck_file, n_complete, total_count=0):
+    """Writes a .tck file as a killed tckgen leaves it: counts not filled in, no end marker,
+    and a last streamline that was cut off"""
+    header = "mrtrix tracks\ncount: {:010d}\ntotal_count: {:010d}\ndatatype: Float32LE\n"
+    offset = len(header.format(0, 0)) + len("file: . 0000000000\nEND\n")
+    header += f"file: . {offset:010d}\nEND\n"
+    with open(tck_file, "wb") as f:
+        f.write(header.format(0, total_count).encode("latin-1"))
+        for i in range(n_complete):
+            f.write(np.full((2, 3), i, dtype="<f4").tobytes())
+            f.write(np.full((1, 3), np.nan, dtype="<f4").tobytes())
+        f.write(np.full((1, 3), 9, dtype="<f4").tobytes())
+    return str(tck_file)
+
+
+@pytest.mark.parametrize(
+    "generated, header_total, expected",
+    [(7, 0, 7), (0, 0, 3), (0, 40, 40)],
+)
+def test_keep_complete_streamlines(tmp_path, generated, header_total, expected):
+    # Without tckgen's progress, the generated count comes from the header or the file itself
+    tck_file = write_unfinished_tck(tmp_path / "shard.tck", 3, header_total)
+    assert _keep_complete_streamlines(tck_file, generated) == (3, expected)
+
+    header = read_tck_header(tck_file)
+    assert int(header["count"]) == 3 and int(header["total_count"]) == expected
+    assert [s[0, 0] for s in read_tck_streamlines(tck_file)] == [0, 1, 2]
+
+
+def test_keep_complete_streamlines_none_written(tmp_path):
+    tck_file = write_unfinished_tck(tmp_path / "shard.tck", 0)
+    assert _keep_complete_streamlines(tck_file, 0) == (0, 0)
+    assert op.exists(tck_file) == False
+
+
+def test_tckgen_shard_without_progress(tmp_path):
+    from benchmarks.fake_toolchain import fake_toolchain, install_fake_toolchain
+    from fsub_extractor.utils.system_utils import find_program
+
+    bin_dir = install_fake_toolchain(str(tmp_path / "bin"))
+    out_file = str(tmp_path / "shard.tck")
+    with fake_toolchain(delays={"tckgen": 10}, bin_dir=bin_dir):
+        cmd_tckgen = [find_program("tckgen"), "wmfod.nii.gz", out_file, "-select", "1000", "-quiet"]
+        stats = _run_tckgen_shard(cmd_tckgen, None, 1000, time.monotonic() + 2.5, None)
+
+    # Stopped partway with no progress parsed: the kept streamlines are counted from the file
+    assert stats["status"] == "partial"
+    assert 0 < stats["selected"] < 1000
+    assert stats["generated"] == stats["selected"]
+    assert int(read_tck_header(out_file)["count"]) == stats["selected"]
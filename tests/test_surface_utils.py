@@ -0,0 +1,127 @@
+import numpy as np
+import nibabel as nib
+import pytest
+from fsub_extractor.utils import surface_utils
+from fsub_extractor.utils.surface_utils import (
+    projfrac_voxel_indices,
+    surf2vol_native,
+    surf2vol_native_batch,
+    surface_mask_native,
+)
+
+# tkRAS of a conformed 20^3 orig.mgz: x = 10 - i, y = k - 10, z = 10 - j
+SHAPE = (20, 20, 20)
+VOX2RAS_TKR = np.array(
+    [[-1.0, 0, 0, 10], [0, 0, 1, -10], [0, -1, 0, 10], [0, 0, 0, 1]]
+)
+
+
+def tkras_to_voxel(x, y, z):
+    return (10 - x, 10 - z, y + 10)
+
+
+def flat(i, j, k):
+    return np.ravel_multi_index((i, j, k), SHAPE)
+
+
+def make_geometry(vertices, normals, thickness):
+    return {
+        "vertices": np.array(vertices, dtype=np.float32),
+        "normals": np.array(normals, dtype=np.float32),
+        "thickness": np.array(thickness, dtype=np.float32),
+        "vox2ras_tkr": VOX2RAS_TKR,
+        "shape": np.array(SHAPE),
+    }
+
+
+def test_projfrac_voxel_indices_known_surface():
+    # Vertex 0 projects 2 mm along -x into white matter; vertex 1 starts outside the grid
+    geometry = make_geometry(
+        vertices=[[0.2, 0.3, -0.1], [-9.4, 0, 0]],
+        normals=[[1, 0, 0], [1, 0, 0]],
+        thickness=[2, 2],
+    )
+    flat_idx = projfrac_voxel_indices(geometry, [-1, 0, 0.5])
+
+    # Depths -1, -0.5 and 0 (stop is inclusive) put vertex 0 at x = -1.8, -0.8 and 0.2
+    assert flat_idx.shape == (3, 2)
+    assert flat_idx[:, 0].tolist() == [flat(12, 10, 10), flat(11, 10, 10), flat(10, 10, 10)]
+    # Vertex 1 is at i = 21.4, 20.4 and 19.4: only the last depth is inside the grid
+    assert flat_idx[:, 1].tolist() == [-1, -1, flat(19, 10, 10)]
+
+
+def test_projfrac_voxel_indices_vertex_mask():
+    geometry = make_geometry(
+        vertices=[[0, 0, 0], [3, 0, 0]], normals=[[1, 0, 0], [1, 0, 0]], thickness=[1, 1]
+    )
+    flat_idx = projfrac_voxel_indices(geometry, [-1, 0, 1], vertex_mask=np.array([False, True]))
+    assert flat_idx.tolist() == [[flat(8, 10, 10)], [flat(7, 10, 10)]]
+
+
+@pytest.fixture
+def fs_subject(tmp_path):
+    """A FreeSurfer-like subject whose lh / rh surfaces are squares in the plane y = 0.2 (tkRAS),
+    spanning x and z from -3.3 to 3.3, with 2 mm thickness and a conformed 20^3 orig.mgz"""
+    subject_dir = tmp_path / "sub-test"
+    for folder in ["surf", "mri", "label"]:
+        (subject_dir / folder).mkdir(parents=True)
+    vertices = np.array(
+        [[-3.3, 0.2, -3.3], [3.3, 0.2, -3.3], [3.3, 0.2, 3.3], [-3.3, 0.2, 3.3]]
+    )
+    # Counter-clockwise seen from -y, so the normals point towards -y
+    faces = np.array([[0, 1, 2], [0, 2, 3]])
+    for hemi in ["lh", "rh"]:
+        nib.freesurfer.write_geometry(str(subject_dir / "surf" / f"{hemi}.white"), vertices, faces)
+        nib.freesurfer.write_geometry(str(subject_dir / "surf" / f"{hemi}.pial"), vertices, faces)
+        nib.freesurfer.write_morph_data(
+            str(subject_dir / "surf" / f"{hemi}.thickness"), np.full(4, 2, dtype=np.float32)
+        )
+        with open(subject_dir / "label" / f"{hemi}.test.label", "w") as f:
+            f.write("#!ascii label\n1\n0 -3.300 0.200 -3.300 0.000000\n")
+    nib.save(
+        nib.MGHImage(np.zeros(SHAPE, dtype=np.uint8), np.eye(4)),
+        str(subject_dir / "mri" / "orig.mgz"),
+    )
+    surface_utils._GEOMETRY_CACHE.clear()
+    return str(tmp_path), "sub-test", str(subject_dir / "label" / "lh.test.label")
+
+
+def test_surf2vol_native_label(fs_subject, tmp_path):
+    fs_dir, subject, label = fs_subject
+    out_file = surf2vol_native(label, fs_dir, subject, "lh", str(tmp_path / "roi.nii.gz"), [-1, 0, 0.5])
+
+    # Vertex 0 (-3.3, 0.2, -3.3) with its normal along -y: projected to y = 2.2, 1.2 and 0.2
+    expected = {tkras_to_voxel(-3.3, y, -3.3) for y in [2.2, 1.2, 0.2]}
+    expected = {tuple(int(np.rint(c)) for c in ijk) for ijk in expected}
+    assert set(map(tuple, np.argwhere(nib.load(out_file).get_fdata() > 0))) == expected
+
+
+def test_surf2vol_native_batch_input_order(fs_subject, tmp_path):
+    fs_dir, subject, label = fs_subject
+    out_file = str(tmp_path / "rois.nii.gz")
+    # The same vertex in both hemispheres: the later ROI (lh) wins, whatever the hemisphere order
+    surf2vol_native_batch(
+        [label.replace("lh.", "rh."), label], ["rh", "lh"], fs_dir, subject, out_file, [-1, 0, 0.5]
+    )
+    labels = np.asanyarray(nib.load(out_file).dataobj)
+    assert np.unique(labels).tolist() == [0, 2]
+    assert (labels == 2).sum() == 3
+
+
+def test_surf2vol_native_batch_no_rois(fs_subject, tmp_path):
+    fs_dir, subject, _ = fs_subject
+    with pytest.raises(Exception, match="No surface ROIs"):
+        surf2vol_native_batch([], [], fs_dir, subject, str(tmp_path / "rois.nii.gz"))
+
+
+def test_surface_mask_native_covers_triangles(fs_subject, tmp_path):
+    fs_dir, subject, _ = fs_subject
+    out_file = surface_mask_native(fs_dir, subject, str(tmp_path / "pial.nii.gz"))
+
+    # The square covers voxel centers from x, z = -3 to 3 in the plane y = 0.2 (k = 10)
+    expected = {
+        tuple(int(np.rint(c)) for c in tkras_to_voxel(x, 0.2, z))
+        for x in range(-3, 4)
+        for z in range(-3, 4)
+    }
+    assert set(map(tuple, np.argwhere(nib.load(out_file).get_fdata() > 0))) == expected
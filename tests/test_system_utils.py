@@ -0,0 +1,35 @@
+import os
+import threading
+import tracemalloc
+from fsub_extractor.utils import system_utils
+from fsub_extractor.utils.system_utils import profile_stage, set_profile_dir
+
+
+def test_profile_stages_in_threads(tmp_path):
+    set_profile_dir(str(tmp_path))
+    try:
+        barrier = threading.Barrier(3)
+
+        def work(n):
+            with profile_stage(f"worker{n}"):
+                # Nested stages count towards the outer stage of the same thread
+                with profile_stage("nested"):
+                    barrier.wait()
+
+        threads = [threading.Thread(target=work, args=(n,)) for n in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # A stage in one thread does not hide the stages running in the others
+        stages = sorted(result["stage"] for result in system_utils._PROFILE_RESULTS)
+        assert stages == ["worker0", "worker1", "worker2"]
+        assert sorted(name[:2] for name in os.listdir(tmp_path) if name.endswith("_memory.txt")) == [
+            "01",
+            "02",
+            "03",
+        ]
+        assert tracemalloc.is_tracing() == False
+    finally:
+        set_profile_dir(None)